@@ -1,5 +1,23 @@
+import io
 import os
+import gzip
+import time
+import ipaddress
+import contextlib
 import requests
+import numpy as np
+
+from seen_store import SeenStore, consecutive_runs, ips_to_uint32
+
+try:
+    # instrumentation de Map-bad-ip/src/metrics.py, disponible quand run_all.py lance Barracuda
+    from metrics import api_call, record_rows
+except ImportError:
+    def api_call(provider):
+        return contextlib.nullcontext(None)
+
+    def record_rows(**counts):
+        pass
 
 # Configuration via GitHub Secrets
 BLOCKLIST_URL = os.getenv("BLOCKLIST_URL")
@@ -7,84 +25,207 @@ WEBHOOK_URL_IP = os.getenv("WEBHOOK_URL_IP")
 
 # Directories and files
 BASE_DIR = os.path.dirname(__file__)
-LOG_DIR = os.path.join(BASE_DIR, "logs")
-SEEN_IPS_FILE = os.path.join(LOG_DIR, "seen_ips.log")
+LOG_DIR = os.getenv("BARRACUDA_LOG_DIR", os.path.join(BASE_DIR, "logs"))
+SEEN_IPS_FILE = os.path.join(LOG_DIR, "seen_ips.log")  # ancien format texte, migré au premier lancement
+SEEN_STORE_FILE = os.path.join(LOG_DIR, "seen_ips.npz")
+
+# Une IP absente de la blocklist depuis plus longtemps est oubliée (et resignalée si elle revient)
+SEEN_TTL_DAYS = float(os.getenv("SEEN_TTL_DAYS", "30"))
+
+# Au-delà de ce nombre de messages, envoi groupé : résumé + pièce jointe compressée
+BULK_MAX_PARTS = int(os.getenv("BULK_MAX_PARTS", "3"))
+DISCORD_MAX_CHARS = 2000
+DISCORD_MAX_RETRIES = 5
 
 
 def ensure_log():
     """
-    Création du dossier et du fichier de log s'ils n'existent pas.
+    Création du dossier de log s'il n'existe pas.
     """
     os.makedirs(LOG_DIR, exist_ok=True)
-    if not os.path.exists(SEEN_IPS_FILE):
-        open(SEEN_IPS_FILE, 'w').close()
 
 
 def load_seen_ips():
     """
-    Lecture des IP déjà signalées.
+    Lecture des IP déjà signalées (store uint32 + horodatages).
     """
-    with open(SEEN_IPS_FILE, 'r') as f:
-        return set(line.strip() for line in f if line.strip())
+    return SeenStore.load(SEEN_STORE_FILE, legacy_log=SEEN_IPS_FILE)
 
 
-def save_new_ips(new_ips):
+def save_new_ips(store, current, now, delivered):
     """
-    Ajout des IP envoyées à la fin du fichier.
+    Mise à jour du store : IP signalées ajoutées, last_seen rafraîchi, entrées périmées expirées.
     """
-    with open(SEEN_IPS_FILE, 'a') as f:
-        for ip in sorted(new_ips):
-            f.write(ip + '\n')
+    store.update(current, now, only=delivered)
+    expired = store.compact(SEEN_TTL_DAYS * 86400, now)
+    store.save()
+    return expired
 
 
 def fetch_blocklist():
     """
     Récupération et nettoyage de la blocklist distante.
     """
-    response = requests.get(BLOCKLIST_URL)
-    response.raise_for_status()
+    with api_call("blocklist"):
+        response = requests.get(BLOCKLIST_URL)
+        response.raise_for_status()
     return set(line.strip() for line in response.text.splitlines() if line.strip())
 
 
 def wrap_ip(ip: str) -> str:
     """
     Encapsule chaque octet de l'IP dans des crochets.
-    Ex: "192.168.0.1" -> "[192].[168].[0].[1]"
+    Ex: "192.168.0.1" -> "[192].[168].[0].[1]", "10.0.0.0/24" -> "[10].[0].[0].[0]/24"
     """
-    return '.'.join(f'[{octet}]' for octet in ip.split('.'))
+    address, _, prefix = ip.partition('/')
+    wrapped = '.'.join(f'[{octet}]' for octet in address.split('.'))
+    return f"{wrapped}/{prefix}" if prefix else wrapped
 
 
-def send_discord(new_ips):
+def collapse_networks(new_ips):
     """
-    Envoi des IP en une ou plusieurs parties pour ne pas dépasser 2000 caractères,
-    avec chaque octet encapsulé.
+    Regroupe les IP contiguës (tableau uint32 trié) en réseaux, dans l'ordre des adresses.
     """
-    header = "**🛡️ Nouvelles IP malveillantes :**\n"
-    # on wrappe chaque IP
-    lines = [header] + [wrap_ip(ip) + "\n" for ip in sorted(new_ips)]
-    message = "".join(lines)
+    networks = []
+    for start, end in zip(*consecutive_runs(new_ips)):
+        networks.extend(ipaddress.summarize_address_range(
+            ipaddress.IPv4Address(int(start)), ipaddress.IPv4Address(int(end))
+        ))
+    return networks
 
-    # Découpage si >2000 caractères
-    parts = []
-    while len(message) > 2000:
-        cut = message.rfind('\n', 0, 2000)
-        parts.append(message[:cut])
-        message = message[cut+1:]
-    parts.append(message)
 
-    for part in parts:
-        requests.post(WEBHOOK_URL_IP, json={'content': part})
+def cidr_text(network):
+    """
+    Notation d'un réseau : "10.0.0.0/30", ou l'adresse seule pour un /32.
+    """
+    return str(network) if network.prefixlen < 32 else str(network.network_address)
+
+
+def split_lines(header, lines, limit=DISCORD_MAX_CHARS):
+    """
+    Découpe en messages de moins de `limit` caractères, en un seul passage.
+    Retourne, pour chaque message, la plage (début, fin) des lignes qu'il contient.
+    """
+    bounds, start, size = [], 0, len(header)
+    for i, line in enumerate(lines):
+        if size + len(line) + 1 > limit and i > start:
+            bounds.append((start, i))
+            start, size = i, 0
+        size += len(line) + 1
+    bounds.append((start, len(lines)))
+    return bounds
+
+
+class DiscordWebhook:
+    """
+    Envoi vers un webhook Discord cadencé par les en-têtes de rate-limit.
+    Chaque envoi utilise ?wait=true : un succès signifie que Discord a créé le message.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.session = requests.Session()
+        self.wait_until = 0.0
+
+    def _pace(self, resp):
+        if resp.headers.get("X-RateLimit-Remaining") == "0":
+            reset_after = float(resp.headers.get("X-RateLimit-Reset-After", "1"))
+            self.wait_until = time.monotonic() + reset_after
+
+    def post(self, **kwargs):
+        for _ in range(DISCORD_MAX_RETRIES):
+            delay = self.wait_until - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                with api_call("discord") as call:
+                    resp = self.session.post(self.url, params={"wait": "true"}, timeout=15, **kwargs)
+                    if call is not None:
+                        call.ok = resp.ok
+            except requests.RequestException as e:
+                print(f"[!] Discord injoignable : {e}")
+                time.sleep(2)
+                continue
+            self._pace(resp)
+            if resp.status_code == 429:
+                try:
+                    retry_after = float(resp.json().get("retry_after", 1))
+                except ValueError:
+                    retry_after = float(resp.headers.get("Retry-After", "1"))
+                print(f"[*] Discord rate-limit, nouvel essai dans {retry_after:.1f}s.")
+                self.wait_until = time.monotonic() + retry_after
+                continue
+            if resp.ok:
+                return True
+            print(f"[!] Discord a refusé le message ({resp.status_code}) : {resp.text[:200]}")
+            return False
+        return False
+
+
+def build_attachment(cidrs):
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode="wb", mtime=0) as gz:
+        gz.write(("\n".join(cidrs) + "\n").encode())
+    return buf.getvalue()
+
+
+def send_discord(new_ips):
+    """
+    Envoi des nouvelles IP (tableau uint32 trié), regroupées en plages CIDR, avec chaque octet encapsulé.
+    Petits volumes : un ou plusieurs messages de moins de 2000 caractères.
+    Gros volumes : un résumé + la liste complète en pièce jointe .txt.gz.
+    Retourne les IP dont Discord a confirmé l'envoi (celles des messages acceptés) ;
+    les autres seront resignalées au prochain passage.
+    """
+    if not WEBHOOK_URL_IP:
+        print("[!] WEBHOOK_URL_IP non défini, alerte non envoyée.")
+        return new_ips[:0]
+
+    webhook = DiscordWebhook(WEBHOOK_URL_IP)
+    networks = collapse_networks(new_ips)
+    cidrs = [cidr_text(n) for n in networks]
+    header = "**🛡️ Nouvelles IP malveillantes :**"
+    lines = [wrap_ip(c) for c in cidrs]
+    bounds = split_lines(header, lines)
+
+    if len(bounds) <= BULK_MAX_PARTS:
+        delivered = np.zeros(len(new_ips), dtype=bool)
+        for k, (a, b) in enumerate(bounds):
+            if b > a and webhook.post(json={"content": "\n".join(([header] if k == 0 else []) + lines[a:b])}):
+                # réseaux triés : le message couvre exactement les IP entre ses deux bornes
+                first, last = int(networks[a].network_address), int(networks[b - 1].broadcast_address)
+                delivered |= (new_ips >= first) & (new_ips <= last)
+        return new_ips[delivered]
+
+    stamp = time.strftime("%Y%m%d-%H%M", time.gmtime())
+    summary = (
+        f"{header}\n{len(new_ips)} nouvelles IP ({len(cidrs)} plages CIDR).\n"
+        f"Liste complète en pièce jointe.\nAperçu :\n"
+        + "\n".join(wrap_ip(c) for c in cidrs[:20])
+    )
+    sent = webhook.post(
+        data={"content": summary[:DISCORD_MAX_CHARS]},
+        files={"file": (f"new_ips_{stamp}.txt.gz", build_attachment(cidrs), "application/gzip")},
+    )
+    return new_ips if sent else new_ips[:0]
 
 
 def main():
     ensure_log()
-    seen = load_seen_ips()
-    current = fetch_blocklist()
-
-    new_ips = current - seen
-    if new_ips:
-        send_discord(new_ips)
-        save_new_ips(new_ips)
+    store = load_seen_ips()
+    current = ips_to_uint32(fetch_blocklist())
+    now = int(time.time())
+
+    new_ips, removed_ips = store.diff(current)
+    delivered = send_discord(new_ips) if len(new_ips) else new_ips
+    if len(delivered) < len(new_ips):
+        # Non confirmées par Discord : elles seront resignalées au prochain passage
+        print(f"[!] Alerte non confirmée pour {len(new_ips) - len(delivered)} IP, non marquées comme vues.")
+    expired = save_new_ips(store, current, now, delivered)
+    record_rows(rows_in=len(current), rows_out=len(delivered), removed=len(removed_ips), expired=expired)
+
+    print(f"[+] Barracuda : {len(new_ips)} nouvelles IP, {len(removed_ips)} retirées de la blocklist, "
+          f"{expired} expirées, {len(store)} suivies.")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,123 @@
+import os
+import sys
+import numpy as np
+
+# Utilitaires IPv4 partagés avec Map-bad-ip (src/iputils.py)
+MAP_SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Map-bad-ip", "src")
+if MAP_SRC_DIR not in sys.path:
+    sys.path.append(MAP_SRC_DIR)
+
+import iputils  # noqa: E402
+from iputils import sorted_contains  # noqa: E402
+
+
+def ips_to_uint32(ips):
+    """
+    Conversion d'IP texte en tableau uint32 trié et sans doublon, avec le parseur strict
+    de iputils (les entrées qui ne sont pas en décimal pointé sont ignorées).
+    """
+    keys, valid = iputils.ips_to_uint32(list(ips))
+    return np.unique(keys[valid])
+
+
+def consecutive_runs(sorted_keys):
+    """
+    Découpe un tableau uint32 trié en plages d'adresses contiguës : retourne (débuts, fins).
+    """
+    if not len(sorted_keys):
+        return sorted_keys[:0], sorted_keys[:0]
+    breaks = np.flatnonzero(np.diff(sorted_keys.astype(np.int64)) != 1)
+    starts = sorted_keys[np.r_[0, breaks + 1]]
+    ends = sorted_keys[np.r_[breaks, len(sorted_keys) - 1]]
+    return starts, ends
+
+
+class SeenStore:
+    """
+    Ensemble des IP déjà signalées : tableau uint32 trié + horodatages first_seen / last_seen
+    (epoch, uint32), sauvegardé en .npz compressé.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.ips = np.empty(0, dtype=np.uint32)
+        self.first_seen = np.empty(0, dtype=np.uint32)
+        self.last_seen = np.empty(0, dtype=np.uint32)
+        self.last_run = 0
+
+    @classmethod
+    def load(cls, path, legacy_log=None):
+        """
+        Charge le store ; à défaut, migre l'ancien fichier texte seen_ips.log s'il existe.
+        """
+        store = cls(path)
+        if os.path.exists(path):
+            with np.load(path) as data:
+                store.ips = data["ips"]
+                store.first_seen = data["first_seen"]
+                store.last_seen = data["last_seen"]
+                store.last_run = int(data["last_run"])
+        elif legacy_log and os.path.exists(legacy_log):
+            with open(legacy_log, "r") as f:
+                store.ips = ips_to_uint32(line.strip() for line in f if line.strip())
+            stamp = int(os.path.getmtime(legacy_log))
+            store.first_seen = np.full(len(store.ips), stamp, dtype=np.uint32)
+            store.last_seen = store.first_seen.copy()
+            store.last_run = stamp
+            print(f"[*] Migration de {legacy_log} : {len(store.ips)} IP.")
+        return store
+
+    def __len__(self):
+        return len(self.ips)
+
+    def diff(self, current):
+        """
+        Compare la blocklist courante (uint32 trié) au store.
+        Retourne (nouvelles IP, IP sorties de la liste depuis la dernière exécution).
+        """
+        new = current[~sorted_contains(self.ips, current)]
+        listed_last_run = self.ips[self.last_seen == self.last_run] if self.last_run else self.ips[:0]
+        removed = listed_last_run[~sorted_contains(current, listed_last_run)]
+        return new, removed
+
+    def update(self, current, now, only=None):
+        """
+        Marque `current` comme vue à `now` ; les IP absentes du store y sont ajoutées.
+        `only` restreint les ajouts (ex: IP effectivement signalées).
+        """
+        now = np.uint32(now)
+        present = sorted_contains(current, self.ips)
+        self.last_seen[present] = now
+        additions = current[~sorted_contains(self.ips, current)]
+        if only is not None:
+            additions = additions[sorted_contains(only, additions)]
+        ips = np.concatenate([self.ips, additions])
+        order = np.argsort(ips, kind="stable")
+        self.ips = ips[order]
+        self.first_seen = np.concatenate([self.first_seen, np.full(len(additions), now, np.uint32)])[order]
+        self.last_seen = np.concatenate([self.last_seen, np.full(len(additions), now, np.uint32)])[order]
+        self.last_run = int(now)
+
+    def compact(self, max_age, now):
+        """
+        Expire les IP absentes de la blocklist depuis plus de `max_age` secondes.
+        """
+        keep = self.last_seen.astype(np.int64) >= int(now) - int(max_age)
+        expired = int((~keep).sum())
+        self.ips = self.ips[keep]
+        self.first_seen = self.first_seen[keep]
+        self.last_seen = self.last_seen[keep]
+        return expired
+
+    def save(self):
+        """
+        Écriture atomique (fichier temporaire + rename).
+        """
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez_compressed(
+                f, ips=self.ips, first_seen=self.first_seen, last_seen=self.last_seen,
+                last_run=np.int64(self.last_run),
+            )
+        os.replace(tmp, self.path)
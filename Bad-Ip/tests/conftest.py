@@ -0,0 +1,12 @@
+"""
+Configuration des tests de Bad-Ip : barracuda.py et seen_store.py sont importes depuis
+le dossier parent et les journaux sont rediriges vers un dossier temporaire.
+"""
+
+import os
+import sys
+import tempfile
+
+os.environ.setdefault("BARRACUDA_LOG_DIR", tempfile.mkdtemp(prefix="bad-ip-tests-"))
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
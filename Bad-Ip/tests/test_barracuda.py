@@ -0,0 +1,116 @@
+import gzip
+
+import numpy as np
+import pytest
+
+import barracuda
+from iputils import uint32_to_ips
+from seen_store import SeenStore, ips_to_uint32
+
+
+class FakeWebhook:
+    """
+    Remplace DiscordWebhook : enregistre les envois, refuse ceux dont le numero est dans `failing`.
+    """
+    failing = set()
+    sent = []
+
+    def __init__(self, url):
+        pass
+
+    def post(self, **kwargs):
+        FakeWebhook.sent.append(kwargs)
+        return len(FakeWebhook.sent) not in FakeWebhook.failing
+
+
+@pytest.fixture
+def webhook(monkeypatch):
+    FakeWebhook.failing, FakeWebhook.sent = set(), []
+    monkeypatch.setattr(barracuda, "WEBHOOK_URL_IP", "https://discord.invalid/webhook")
+    monkeypatch.setattr(barracuda, "DiscordWebhook", FakeWebhook)
+    return FakeWebhook
+
+
+def scattered(n):
+    """n IP non contigues (une ligne CIDR chacune)."""
+    return (np.arange(n, dtype=np.uint32) * 4 + 0x0A000001).astype(np.uint32)
+
+
+def sent_ips(post):
+    return post["json"]["content"].replace("[", "").replace("]", "").split("\n")
+
+
+def test_wrap_ip():
+    assert barracuda.wrap_ip("192.168.0.1") == "[192].[168].[0].[1]"
+    assert barracuda.wrap_ip("10.0.0.0/24") == "[10].[0].[0].[0]/24"
+
+
+def test_collapse_networks():
+    ips = ips_to_uint32(["10.0.0.0", "10.0.0.1", "10.0.0.2", "10.0.0.3", "10.0.0.4", "192.168.1.1"])
+    cidrs = [barracuda.cidr_text(n) for n in barracuda.collapse_networks(ips)]
+    assert cidrs == ["10.0.0.0/30", "10.0.0.4", "192.168.1.1"]
+    assert barracuda.collapse_networks(ips[:0]) == []
+
+
+def test_split_lines_respects_limit():
+    lines = [f"line-{i:04d}" for i in range(500)]
+    bounds = barracuda.split_lines("header", lines, limit=200)
+    parts = ["\n".join((["header"] if k == 0 else []) + lines[a:b]) for k, (a, b) in enumerate(bounds)]
+    assert all(len(p) <= 200 for p in parts)
+    assert "\n".join(parts).split("\n")[1:] == lines
+    assert barracuda.split_lines("header", []) == [(0, 0)]
+
+
+def test_split_lines_bounds_cover_all_lines():
+    bounds = barracuda.split_lines("h", ["x" * 50] * 10, limit=120)
+    assert bounds[0][0] == 0 and bounds[-1][1] == 10
+    assert all(a < b for a, b in bounds)
+    assert all(prev[1] == nxt[0] for prev, nxt in zip(bounds, bounds[1:]))
+
+
+def test_send_discord_all_delivered(webhook):
+    ips = scattered(300)
+    assert barracuda.send_discord(ips).tolist() == ips.tolist()
+    assert 1 < len(webhook.sent) <= barracuda.BULK_MAX_PARTS
+
+
+def test_send_discord_partial_delivery(webhook):
+    ips = scattered(300)
+    webhook.failing = {2}
+    delivered = barracuda.send_discord(ips)
+    missing = ips_to_uint32(sent_ips(webhook.sent[1]))
+    assert len(missing) and len(delivered) == len(ips) - len(missing)
+    assert not np.isin(missing, delivered).any()
+
+
+def test_send_discord_bulk_is_all_or_nothing(webhook):
+    ips = scattered(2000)
+    assert len(barracuda.send_discord(ips)) == len(ips)
+    attachment = webhook.sent[0]["files"]["file"][1]
+    assert len(gzip.decompress(attachment).decode().split()) == len(ips)
+    webhook.failing = {2}
+    assert len(barracuda.send_discord(ips)) == 0
+
+
+def test_send_discord_without_webhook(monkeypatch):
+    monkeypatch.setattr(barracuda, "WEBHOOK_URL_IP", None)
+    assert len(barracuda.send_discord(scattered(3))) == 0
+
+
+def test_main_resends_only_undelivered(webhook, tmp_path, monkeypatch):
+    monkeypatch.setattr(barracuda, "LOG_DIR", str(tmp_path))
+    monkeypatch.setattr(barracuda, "SEEN_STORE_FILE", str(tmp_path / "seen_ips.npz"))
+    monkeypatch.setattr(barracuda, "SEEN_IPS_FILE", str(tmp_path / "seen_ips.log"))
+    blocklist = set(uint32_to_ips(scattered(300))) | {"not-an-ip", "010.0.0.1"}
+    monkeypatch.setattr(barracuda, "fetch_blocklist", lambda: blocklist)
+
+    webhook.failing = {2}
+    barracuda.main()
+    first_run = SeenStore.load(str(tmp_path / "seen_ips.npz"))
+    assert 0 < len(first_run) < 300
+
+    webhook.failing, webhook.sent = set(), []
+    barracuda.main()
+    resent = ips_to_uint32(sum((sent_ips(post) for post in webhook.sent), []))
+    assert len(resent) == 300 - len(first_run)
+    assert len(SeenStore.load(str(tmp_path / "seen_ips.npz"))) == 300
@@ -0,0 +1,82 @@
+import os
+
+import numpy as np
+import pytest
+
+from seen_store import SeenStore, consecutive_runs, ips_to_uint32
+
+DAY = 86400
+
+
+def keys(*values):
+    return np.array(values, dtype=np.uint32)
+
+
+def test_ips_to_uint32_sorted_unique():
+    assert ips_to_uint32(["10.0.0.2", "10.0.0.1", "10.0.0.2"]).tolist() == [0x0A000001, 0x0A000002]
+    assert ips_to_uint32([]).tolist() == []
+
+
+@pytest.mark.parametrize("text", ["010.0.0.1", "1.2.3", "1.2.3.4.5", "0x1.2.3.4", "256.0.0.1", "1.2.3.4/24", "", "abc"])
+def test_ips_to_uint32_rejects_non_dotted_decimal(text):
+    assert ips_to_uint32([text]).tolist() == []
+
+
+def test_consecutive_runs():
+    starts, ends = consecutive_runs(keys(1, 2, 3, 7, 9, 10))
+    assert starts.tolist() == [1, 7, 9]
+    assert ends.tolist() == [3, 7, 10]
+    starts, ends = consecutive_runs(keys())
+    assert len(starts) == len(ends) == 0
+
+
+def test_diff_and_update(tmp_path):
+    store = SeenStore(str(tmp_path / "seen.npz"))
+    new, removed = store.diff(keys(1, 2))
+    assert new.tolist() == [1, 2] and removed.tolist() == []
+    store.update(keys(1, 2), 1000)
+
+    new, removed = store.diff(keys(2, 3))
+    assert new.tolist() == [3] and removed.tolist() == [1]
+    store.update(keys(2, 3), 2000, only=keys())  # rien de signale : 3 reste nouvelle
+    assert store.ips.tolist() == [1, 2]
+    assert store.diff(keys(2, 3))[0].tolist() == [3]
+    assert store.first_seen.tolist() == [1000, 1000]
+    assert store.last_seen.tolist() == [1000, 2000]
+
+
+def test_update_only_subset(tmp_path):
+    store = SeenStore(str(tmp_path / "seen.npz"))
+    store.update(keys(1, 2, 3), 1000, only=keys(2))
+    assert store.ips.tolist() == [2]
+
+
+def test_compact(tmp_path):
+    store = SeenStore(str(tmp_path / "seen.npz"))
+    store.update(keys(1, 2), 1000)
+    store.update(keys(2), 1000 + 40 * DAY)
+    assert store.compact(30 * DAY, 1000 + 40 * DAY) == 1
+    assert store.ips.tolist() == [2]
+
+
+def test_save_load_round_trip(tmp_path):
+    path = str(tmp_path / "logs" / "seen.npz")
+    store = SeenStore(path)
+    store.update(keys(5, 9), 1234)
+    store.save()
+    loaded = SeenStore.load(path)
+    assert loaded.ips.tolist() == [5, 9]
+    assert loaded.last_run == 1234
+    assert not os.path.exists(path + ".tmp")
+
+
+def test_migrates_legacy_log(tmp_path):
+    legacy = tmp_path / "seen_ips.log"
+    legacy.write_text("1.2.3.4\n\n010.0.0.1\n5.6.7.8\n1.2.3.4\n")
+    store = SeenStore.load(str(tmp_path / "seen.npz"), str(legacy))
+    assert len(store) == 2
+    assert store.last_run == int(os.path.getmtime(legacy))
+
+
+def test_load_missing(tmp_path):
+    assert len(SeenStore.load(str(tmp_path / "seen.npz"), str(tmp_path / "absent.log"))) == 0
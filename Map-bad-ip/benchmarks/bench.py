@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+"""
+bench.py
+Benchmarks a echelle synthetique de Map-bad-ip et Barracuda.
+
+Pour chaque echelle (10k a 10M IP), un jeu de donnees synthetique est genere dans un
+dossier temporaire : blocklist, ips.csv, geo_enriched.csv (avec ~1 % de doublons) et
+store Barracuda deja peuple. Chaque etape est ensuite lancee dans son propre processus
+contre des serveurs locaux qui remplacent la blocklist, IPInfo, Mistral et Discord ;
+la duree et le pic de memoire (RSS) de chaque etape sont mesures via metrics.py.
+Chaque echelle est rejouee BENCH_REPEAT fois (donnees regenerees) et la mediane est retenue.
+Les resultats sont compares a baseline.json : un depassement des tolerances est une
+regression (code retour 1).
+
+Usage :
+    python bench.py                        # echelles par defaut (BENCH_SCALES, 10k,100k)
+    python bench.py --scales 10k,1m,10m    # echelles choisies
+    python bench.py --update-baseline      # enregistre les resultats comme reference
+    python bench.py --repeat 5             # nombre de passes par echelle (BENCH_REPEAT, 3)
+    python bench.py --keep                 # conserve les dossiers de travail
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import importlib
+import platform
+import tempfile
+import threading
+import subprocess
+import numpy as np
+import pandas as pd
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BENCH_DIR, "..", "src")
+BAD_IP_DIR = os.path.join(BENCH_DIR, "..", "..", "Bad-Ip")
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+sys.path.insert(0, SRC_DIR)
+sys.path.insert(0, BAD_IP_DIR)
+
+from geo_writer import OUTPUT_COLUMNS  # noqa: E402
+from iputils import uint32_to_ips  # noqa: E402
+from seen_store import SeenStore  # noqa: E402
+
+DEFAULT_SCALES = os.getenv("BENCH_SCALES", "10k,100k")
+REPEAT = int(os.getenv("BENCH_REPEAT", "3"))  # mediane de plusieurs passes : bruit d'une machine partagee
+TIME_TOLERANCE = float(os.getenv("BENCH_TIME_TOLERANCE", "0.25"))
+MEM_TOLERANCE = float(os.getenv("BENCH_MEM_TOLERANCE", "0.15"))
+# en dessous de ces ecarts absolus, la difference est du bruit
+MIN_SECONDS = 0.5
+MIN_MB = 20
+
+# Etapes mesurees, dans l'ordre d'execution du pipeline
+STAGES = [
+    "barracuda", "fetch_ips", "load_done_ips", "geolocate",
+    "check_double_entree", "aggregate", "tiles", "visualizev2",
+]
+
+SEED = 42
+CITIES = 5000
+IPINFO_MISS_RATE = 0.05  # part des IP sans coordonnees IPInfo (passent par Mistral)
+DUPLICATE_RATE = 0.01
+REMOVED_RATE = 0.01
+
+
+def parse_scale(label):
+    label = label.strip().lower()
+    factor = {"k": 10**3, "m": 10**6}.get(label[-1], 1)
+    return int(float(label.rstrip("km")) * factor)
+
+
+def synthetic_cities():
+    rng = np.random.default_rng(SEED)
+    letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    countries = [a + b for a in letters for b in letters][:150]
+    return pd.DataFrame({
+        "latitude": rng.uniform(-55, 70, CITIES).round(4),
+        "longitude": rng.uniform(-180, 180, CITIES).round(4),
+        "city": [f"City{i}" for i in range(CITIES)],
+        "region": [f"Region{i % 700}" for i in range(CITIES)],
+        "country": rng.choice(countries, CITIES),
+    })
+
+
+def city_of(ip):
+    """
+    Ville deterministe d'une IP (memes reponses pour le jeu de donnees et les faux services).
+    """
+    return int(hashlib.md5(ip.encode()).hexdigest()[:8], 16) % CITIES
+
+
+def unique_ips(rng, count):
+    pool = np.empty(0, dtype=np.uint32)
+    while len(pool) < count:
+        draw = rng.integers(1 << 24, 0xDF000000, size=int((count - len(pool)) * 1.05) + 1000, dtype=np.uint32)
+        pool = np.unique(np.concatenate([pool, draw]))
+    return rng.permutation(pool)[:count]
+
+
+def generate(workdir, n):
+    """
+    Genere le jeu de donnees d'une echelle. Retourne le contenu de la blocklist servie.
+    """
+    rng = np.random.default_rng(SEED + n)
+    new = min(max(100, n // 1000), 10000)
+    pool = unique_ips(rng, n + new)
+    known, fresh = pool[:n], pool[n:]
+    known_txt = pd.Series(uint32_to_ips(known))
+
+    data_dir = os.path.join(workdir, "data")
+    logs_dir = os.path.join(workdir, "logs")
+    os.makedirs(data_dir)
+    os.makedirs(logs_dir)
+    os.makedirs(os.path.join(workdir, "site"))
+
+    known_txt.to_csv(os.path.join(data_dir, "ips.csv"), index=False, header=False)
+
+    cities = synthetic_cities()
+    idx = rng.integers(0, CITIES, n)
+    geo = cities.iloc[idx].reset_index(drop=True)
+    geo.insert(0, "ip", known_txt)
+    geo.insert(1, "source", "ipinfo")
+    geo = pd.concat([geo, geo.sample(frac=DUPLICATE_RATE, random_state=SEED)], ignore_index=True)
+    geo[OUTPUT_COLUMNS].to_csv(os.path.join(data_dir, "geo_enriched.csv"), index=False)
+
+    now = int(time.time()) - 3600
+    store = SeenStore(os.path.join(logs_dir, "seen_ips.npz"))
+    store.ips = np.sort(known)
+    store.first_seen = np.full(n, now, dtype=np.uint32)
+    store.last_seen = store.first_seen.copy()
+    store.last_run = now
+    store.save()
+
+    listed = np.concatenate([known[int(n * REMOVED_RATE):], fresh])
+    blocklist = "\n".join(uint32_to_ips(rng.permutation(listed))) + "\n"
+    return blocklist.encode(), new
+
+
+class StandIns:
+    """
+    Serveurs locaux remplacant la blocklist, IPInfo, Mistral et Discord.
+    """
+
+    def __init__(self):
+        self.blocklist = b""
+        self.cities = synthetic_cities()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def ipinfo(self, ip):
+        if int(hashlib.md5(ip.encode()).hexdigest()[8:12], 16) / 0xFFFF < IPINFO_MISS_RATE:
+            return {"ip": ip}
+        c = self.cities.iloc[city_of(ip)]
+        return {"ip": ip, "city": c["city"], "region": c["region"], "country": c["country"],
+                "loc": f"{c['latitude']},{c['longitude']}"}
+
+    def mistral(self, body):
+        ips = body["messages"][-1]["content"].split()
+        results = []
+        for ip in ips:
+            c = self.cities.iloc[city_of(ip)]
+            results.append({"ip": ip, "source": "city", "latitude": float(c["latitude"]),
+                            "longitude": float(c["longitude"]), "city": c["city"],
+                            "region": c["region"], "country": c["country"]})
+        return {
+            "id": "bench", "object": "chat.completion", "model": body.get("model", "bench"),
+            "created": int(time.time()),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": json.dumps({"results": results})}}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        }
+
+    def handler(self):
+        stand_ins = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            wbufsize = 1 << 16  # en-tetes et corps en un seul envoi (evite les delais Nagle)
+
+            def reply(self, payload, content_type="application/json"):
+                body = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                path = self.path.split("?")[0]
+                if path == "/blocklist.txt":
+                    self.reply(stand_ins.blocklist, "text/plain")
+                elif path.startswith("/ipinfo/"):
+                    self.reply(stand_ins.ipinfo(path.split("/")[2]))
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.path.startswith("/v1/chat/completions"):
+                    self.reply(stand_ins.mistral(json.loads(body)))
+                else:
+                    self.reply({"id": "1"})
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def stage_env(workdir, url):
+    env = dict(os.environ)
+    env.update({
+        "MAP_DATA_DIR": os.path.join(workdir, "data"),
+        "SITE_ROOT": os.path.join(workdir, "site"),
+        "BARRACUDA_LOG_DIR": os.path.join(workdir, "logs"),
+        "BLOCKLIST_URL": f"{url}/blocklist.txt",
+        "RSS_FEED_URL": f"{url}/blocklist.txt",
+        "IPINFO_API_URL": f"{url}/ipinfo/",
+        "IPINFO_TOKEN": "bench",
+        "IPINFO_DELAY_SECONDS": "0",
+        # debit brut : ni quota ni echeance (voir geo_scheduler.py)
+        "IPINFO_MONTHLY_QUOTA": "0",
+        "GEO_DEADLINE_SECONDS": "0",
+        "MISTRAL_API_KEY": "bench",
+        "MISTRAL_SERVER_URL": url,
+        "WEBHOOK_URL_IP": f"{url}/discord/barracuda",
+        "DISCORD_WEBHOOK_URL": f"{url}/discord/geolocate",
+        "GEOIP_DB_PATH": "",
+        "METRICS_RSS_SAMPLE_SECONDS": "0.01",
+    })
+    return env
+
+
+def run_stage(name):
+    """
+    Mode enfant : execute une etape sous metrics.stage() et affiche ses mesures.
+    """
+    import metrics
+
+    # import hors mesure : seul le travail de l'etape est chronometre
+    module = importlib.import_module({"load_done_ips": "geolocate"}.get(name, name))
+
+    def target():
+        if name == "load_done_ips":
+            metrics.record_rows(rows_out=len(module.load_done_ips()))
+        elif name == "check_double_entree":
+            if module.DEDUPE_MODE == "chunked":
+                module.remove_duplicates_chunked()
+            else:
+                module.remove_duplicates()
+        else:
+            module.main()
+
+    metrics.start_run()
+    try:
+        with metrics.stage(name):
+            target()
+    finally:
+        _, payload = metrics.finish_run()
+    m = payload["stages"][name]
+    print("BENCH_RESULT " + json.dumps({
+        "seconds": m["wall_seconds"],
+        # RSS echantillonne pendant l'etape : ru_maxrss herite du processus parent (fork)
+        "peak_rss_mb": round(m["peak_rss"] / 2**20, 1),
+        "rows_in": m["rows_in"],
+        "rows_out": m["rows_out"],
+        "api_calls": {p: s["calls"] for p, s in m["api"].items()},
+    }))
+
+
+def bench_scale(label, stand_ins, keep=False):
+    n = parse_scale(label)
+    workdir = tempfile.mkdtemp(prefix=f"mapbadip-bench-{label}-")
+    print(f"[*] Echelle {label} : generation de {n} IP dans {workdir}...")
+    start = time.perf_counter()
+    stand_ins.blocklist, new = generate(workdir, n)
+    print(f"[+] Donnees generees en {time.perf_counter() - start:.1f} s ({new} nouvelles IP).")
+
+    env = stage_env(workdir, stand_ins.url)
+    results = {}
+    try:
+        for name in STAGES:
+            proc = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--stage", name],
+                env=env, cwd=SRC_DIR, capture_output=True, text=True,
+            )
+            line = next((l for l in proc.stdout.splitlines() if l.startswith("BENCH_RESULT ")), None)
+            if proc.returncode or line is None:
+                print(f"[!] {label}/{name} en echec :\n{proc.stderr[-2000:]}")
+                results[name] = {"status": "echec"}
+                continue
+            results[name] = dict(json.loads(line[len("BENCH_RESULT "):]), status="ok")
+            r = results[name]
+            print(f"    {name:<20} {r['seconds']:8.2f} s {r['peak_rss_mb']:8.1f} Mo  "
+                  f"{r['rows_in']:>9} -> {r['rows_out']:<9} {r['api_calls'] or ''}")
+    finally:
+        if keep:
+            print(f"[*] Dossier conserve : {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def median_results(runs):
+    """
+    Regroupe les passes d'une echelle : mediane de la duree et du pic de memoire par etape,
+    echec si une passe a echoue.
+    """
+    merged = {}
+    for name in runs[0]:
+        passes = [run.get(name, {"status": "echec"}) for run in runs]
+        if any(p["status"] != "ok" for p in passes):
+            merged[name] = {"status": "echec"}
+            continue
+        merged[name] = dict(
+            passes[0],
+            seconds=round(float(np.median([p["seconds"] for p in passes])), 3),
+            peak_rss_mb=round(float(np.median([p["peak_rss_mb"] for p in passes])), 1),
+        )
+    return merged
+
+
+def compare(results, baseline):
+    """
+    Compare aux mesures de reference ; retourne la liste des regressions.
+    """
+    regressions = []
+    for label, stages in results.items():
+        for name, r in stages.items():
+            ref = baseline.get("scales", {}).get(label, {}).get(name)
+            if r.get("status") != "ok":
+                if ref:
+                    regressions.append(f"{label}/{name} : echec")
+                continue
+            if not ref or ref.get("status") != "ok":
+                continue
+            dt = r["seconds"] - ref["seconds"]
+            if dt > MIN_SECONDS and r["seconds"] > ref["seconds"] * (1 + TIME_TOLERANCE):
+                regressions.append(f"{label}/{name} : {ref['seconds']:.2f} s -> {r['seconds']:.2f} s")
+            dm = r["peak_rss_mb"] - ref["peak_rss_mb"]
+            if dm > MIN_MB and r["peak_rss_mb"] > ref["peak_rss_mb"] * (1 + MEM_TOLERANCE):
+                regressions.append(f"{label}/{name} : {ref['peak_rss_mb']:.0f} Mo -> {r['peak_rss_mb']:.0f} Mo")
+    return regressions
+
+
+def machine():
+    return {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()}
+
+
+def main(argv):
+    scales = DEFAULT_SCALES
+    if "--scales" in argv:
+        scales = argv[argv.index("--scales") + 1]
+    labels = [s.strip().lower() for s in scales.split(",") if s.strip()]
+    repeat = int(argv[argv.index("--repeat") + 1]) if "--repeat" in argv else REPEAT
+
+    stand_ins = StandIns()
+    results = {}
+    for label in labels:
+        runs = [bench_scale(label, stand_ins, keep="--keep" in argv) for _ in range(max(1, repeat))]
+        results[label] = median_results(runs)
+    stand_ins.server.shutdown()
+
+    report = {"date": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), "machine": machine(),
+              "repeat": repeat, "scales": results}
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"bench-{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}.json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"[+] Resultats enregistres dans {path}")
+
+    if "--update-baseline" in argv:
+        baseline = {"scales": {}}
+        if os.path.exists(BASELINE_PATH):
+            with open(BASELINE_PATH) as f:
+                baseline = json.load(f)
+        baseline.update(date=report["date"], machine=report["machine"], repeat=report["repeat"])
+        baseline["scales"].update(results)
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(baseline, f, indent=2)
+        print(f"[+] Reference mise a jour : {BASELINE_PATH}")
+        return 0
+
+    if not os.path.exists(BASELINE_PATH):
+        print("[*] Pas de reference (baseline.json), comparaison ignoree.")
+        return 0
+    with open(BASELINE_PATH) as f:
+        baseline = json.load(f)
+    if baseline.get("machine") != report["machine"]:
+        print(f"[*] Reference mesuree sur une autre machine ({baseline.get('machine')}), ecarts indicatifs.")
+    regressions = compare(results, baseline)
+    for r in regressions:
+        print(f"[!] Regression {r}")
+    if not regressions:
+        print("[+] Aucune regression par rapport a la reference.")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "--stage":
+        run_stage(sys.argv[2])
+    else:
+        sys.exit(main(sys.argv[1:]))
@@ -1,35 +1,143 @@
 import os
+import json
 import pandas as pd
 
-DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "data")
+import geostore
+import metrics
+from geo_writer import complete_end, file_fingerprint, iter_rows_since
+
+DATA_DIR = os.getenv("MAP_DATA_DIR", os.path.join(os.path.dirname(__file__), "..", "data"))
 INPUT_CSV = os.path.join(DATA_DIR, "geo_enriched.csv")
 OUTPUT_CSV = os.path.join(DATA_DIR, "agg_by_country.csv")
 TOP_COUNTRIES_CSV = os.path.join(DATA_DIR, "top_countries.csv")
+CITY_CSV = os.path.join(DATA_DIR, "agg_by_city.csv")
+STATE_PATH = os.path.join(DATA_DIR, "agg_state.json")
+
+# "incremental" : ne replie que les lignes ajoutees depuis le dernier filigrane
+# "full"        : recalcule tout depuis le store
+# "chunked"     : recalcule tout en flux, par blocs de CHUNK_ROWS lignes (memoire bornee)
+AGG_MODE = os.getenv("AGG_MODE", "incremental")
+CHUNK_ROWS = int(os.getenv("CHUNK_ROWS", "200000"))
+
+
+def empty_state():
+    return {"offset": 0, "fingerprint": None, "countries": {}, "cities": {}}
+
+
+def load_state():
+    try:
+        with open(STATE_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_state(state):
+    tmp = STATE_PATH + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, STATE_PATH)
+
+
+def fold_rows(state, df):
+    """
+    Ajoute un lot de lignes aux compteurs courants :
+    - par pays (toutes les lignes avec un pays)
+    - par ville : nombre d'IP + sommes lat/lon (coordonnees valides uniquement), pour les moyennes
+    """
+    for country, n in df.groupby("country", observed=True).size().items():
+        state["countries"][str(country)] = state["countries"].get(str(country), 0) + int(n)
+
+    geo = df.dropna(subset=["latitude", "longitude"])
+    geo = geo[geo["latitude"].between(-90, 90) & geo["longitude"].between(-180, 180)]
+    cities = geo.groupby(["city", "country"], observed=True).agg(
+        n=("latitude", "size"), lat=("latitude", "sum"), lon=("longitude", "sum")
+    )
+    for (city, country), row in cities.iterrows():
+        key = f"{city}|{country}"
+        cur = state["cities"].get(key, [0, 0.0, 0.0])
+        state["cities"][key] = [cur[0] + int(row.n), cur[1] + float(row.lat), cur[2] + float(row.lon)]
+
+
+def aggregate_incremental(reset=False):
+    """
+    Replie le delta de geo_enriched.csv dans l'etat persiste, bloc par bloc
+    (comptes partiels par bloc fusionnes dans l'etat).
+    Retourne (etat, nb_nouvelles_lignes) ; repart de zero si le CSV a ete reecrit.
+    """
+    state = load_state()
+    size = os.path.getsize(INPUT_CSV)
+    if reset:
+        state = empty_state()
+    elif (
+        state is None
+        or state["offset"] > size
+        or file_fingerprint(INPUT_CSV, state["offset"]) != state["fingerprint"]
+    ):
+        print("[*] Etat d'agregation absent ou perime, recalcul complet.")
+        state = empty_state()
+
+    end = complete_end(INPUT_CSV)
+    rows = 0
+    for chunk in iter_rows_since(
+        INPUT_CSV, state["offset"], end,
+        usecols=["latitude", "longitude", "city", "country"], chunksize=CHUNK_ROWS,
+    ):
+        fold_rows(state, chunk)
+        rows += len(chunk)
+    state["offset"] = max(end, state["offset"])
+    state["fingerprint"] = file_fingerprint(INPUT_CSV, state["offset"])
+    return state, rows
+
+
+def aggregate_full():
+    # Lecture des seules colonnes utiles depuis le store colonne
+    df = geostore.load(columns=["latitude", "longitude", "city", "country"])
+    state = empty_state()
+    fold_rows(state, df)
+    return state, len(df)
+
+
+def write_atomic(df, path):
+    tmp = path + ".tmp"
+    df.to_csv(tmp, index=False)
+    os.replace(tmp, path)
+
 
 def main():
-    # Lecture du fichier CSV
-    df = pd.read_csv(INPUT_CSV)
-    
-    # Vérifie si 'country_code' existe, sinon on utilise 'country' comme fallback
-    if 'country_code' not in df.columns:
-        print("[!] 'country_code' non trouvé, utilisation de 'country' comme alternative.")
-        df['country_code'] = df['country']  # Assigner la colonne 'country' à 'country_code'
-
-    # Agrégation par pays et code pays
-    agg = df.groupby(["country", "country_code"]).size().reset_index(name="count")
-    
+    if AGG_MODE == "full":
+        state, rows = aggregate_full()
+    else:
+        state, rows = aggregate_incremental(reset=AGG_MODE == "chunked")
+
+    # 'country_code' absent des donnees : 'country' (code ISO) sert d'alternative
+    agg = pd.DataFrame(
+        [(c, c, n) for c, n in sorted(state["countries"].items())],
+        columns=["country", "country_code", "count"],
+    )
+
     # Trie les pays par nombre d'IP, du plus élevé au plus bas
-    top_countries = agg.sort_values(by="count", ascending=False)
-    
-    # Enregistrer les résultats agrégés dans un fichier CSV
+    top_countries = agg.sort_values(by="count", ascending=False, kind="stable")
+
+    metrics.record_rows(rows_in=rows, rows_out=len(agg) + len(state["cities"]))
     os.makedirs(DATA_DIR, exist_ok=True)
-    agg.to_csv(OUTPUT_CSV, index=False)
-    top_countries.to_csv(TOP_COUNTRIES_CSV, index=False)
-    
-    print(f"[+] Agrégation terminée : {len(agg)} pays.")
-    print(f"[+] Résultats agrégés enregistrés dans {OUTPUT_CSV}")
-    print(f"[+] Liste des pays les plus touchés enregistrée dans {TOP_COUNTRIES_CSV}")
-    
+    if rows or not os.path.exists(OUTPUT_CSV):
+        cities = pd.DataFrame(
+            [(*key.split("|", 1), lat / n, lon / n, n) for key, (n, lat, lon) in sorted(state["cities"].items())],
+            columns=["city", "country", "latitude", "longitude", "ip_count"],
+        )
+        # Enregistrer les résultats agrégés dans un fichier CSV
+        write_atomic(agg, OUTPUT_CSV)
+        write_atomic(top_countries, TOP_COUNTRIES_CSV)
+        write_atomic(cities, CITY_CSV)
+        print(f"[+] Agrégation terminée : {len(agg)} pays ({rows} lignes repliées).")
+        print(f"[+] Résultats agrégés enregistrés dans {OUTPUT_CSV}")
+        print(f"[+] Liste des pays les plus touchés enregistrée dans {TOP_COUNTRIES_CSV}")
+    else:
+        print("[*] Aucune nouvelle ligne, agrégats inchangés.")
+    if AGG_MODE != "full":
+        save_state(state)
+
     # Affichage des 10 pays les plus touchés
     print("\n[+] Top 10 des pays les plus touchés :")
     print(top_countries.head(10))
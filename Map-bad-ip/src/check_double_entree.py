@@ -1,19 +1,101 @@
+import os
+import numpy as np
 import pandas as pd
 
+import geostore
+import metrics
+from geo_writer import OUTPUT_COLUMNS, complete_end, iter_rows_since
+from iputils import ips_to_uint32, sorted_contains
+
 # Chemin du fichier CSV
-DATA_DIR = "data"
-INPUT_CSV = f"{DATA_DIR}/geo_enriched.csv"
+INPUT_CSV = geostore.GEO_CSV
+
+# "store"   : detection et reecriture via le store colonne (tout en memoire)
+# "chunked" : passage en flux par blocs de CHUNK_ROWS lignes, memoire bornee
+DEDUPE_MODE = os.getenv("DEDUPE_MODE", "store")
+CHUNK_ROWS = int(os.getenv("CHUNK_ROWS", "200000"))
+
+
+def first_occurrences(texts, seen=None, seen_invalid=None):
+    """
+    Masque des lignes a garder : premiere occurrence de chaque IPv4 (cle uint32, absente
+    de `seen`) et de chaque entree non IPv4 (sur son texte, absente de `seen_invalid`,
+    complete sur place). Retourne (masque, cles, masque_valide).
+    """
+    keys, valid = ips_to_uint32(texts)
+    first = ~pd.Series(np.where(valid, keys.astype(np.int64), -1)).duplicated().to_numpy()
+    keep = valid & first
+    if seen is not None:
+        keep &= ~sorted_contains(seen, keys)
+    seen_invalid = set() if seen_invalid is None else seen_invalid
+    # IP non IPv4 (absentes du store) : conservees, dedoublonnees sur leur texte
+    for i in np.flatnonzero(~valid):
+        text = texts.iat[i]
+        if text not in seen_invalid:
+            seen_invalid.add(text)
+            keep[i] = True
+    return keep, keys, valid
+
 
 def remove_duplicates():
-    # Charger le fichier CSV dans un DataFrame
-    df = pd.read_csv(INPUT_CSV)
+    # Detection des doublons sur la seule colonne 'ip' (uint32) du store
+    ips = geostore.load(columns=["ip"])["ip"]
+    metrics.record_rows(rows_in=len(ips))
+    if not ips.duplicated().any():
+        print(f"[✔] Aucun doublon, {len(ips)} entrées uniques.")
+        return
 
-    # Supprimer les doublons en fonction de la colonne 'ip'
-    df_unique = df.drop_duplicates(subset=["ip"])
+    # Reecriture depuis le texte du CSV : les lignes dont l'IP n'est pas IPv4 (absentes
+    # du store) sont gardees, comme en mode chunked
+    end = complete_end(INPUT_CSV)
+    df = next(iter_rows_since(INPUT_CSV, 0, end, dtype=str), pd.DataFrame(columns=OUTPUT_COLUMNS))
+    keep, _, _ = first_occurrences(df["ip"])
+    df_unique = df[keep]
+    metrics.record_rows(rows_out=len(df_unique))
 
-    # Sauvegarder le fichier sans doublons
-    df_unique.to_csv(INPUT_CSV, index=False)
+    # Sauvegarder le fichier sans doublons (ecriture atomique) puis reconstruire le store
+    tmp = INPUT_CSV + ".tmp"
+    df_unique.to_csv(tmp, index=False)
+    os.replace(tmp, INPUT_CSV)
+    geostore.migrate()
     print(f"[✔] Doublons supprimés, {len(df_unique)} entrées uniques.")
 
+
+def remove_duplicates_chunked():
+    """
+    Dedoublonnage en flux : l'index des IP deja vues est un tableau uint32 trie
+    (4 octets par IP), chaque bloc est filtre puis ecrit dans un fichier temporaire
+    qui ne remplace l'original qu'a la fin (os.replace), et seulement s'il y avait des doublons.
+    """
+    seen = np.empty(0, dtype=np.uint32)
+    seen_invalid = set()
+    kept = dropped = 0
+    end = complete_end(INPUT_CSV)
+    tmp = INPUT_CSV + ".tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8", newline="") as out:
+            out.write(",".join(OUTPUT_COLUMNS) + "\n")
+            for chunk in iter_rows_since(INPUT_CSV, 0, end, chunksize=CHUNK_ROWS, dtype=str):
+                keep, keys, valid = first_occurrences(chunk["ip"], seen, seen_invalid)
+                chunk[keep].to_csv(out, header=False, index=False)
+                seen = np.union1d(seen, keys[keep & valid])
+                kept += int(keep.sum())
+                dropped += int((~keep).sum())
+            out.flush()
+            os.fsync(out.fileno())
+        metrics.record_rows(rows_in=kept + dropped, rows_out=kept)
+        if dropped:
+            os.replace(tmp, INPUT_CSV)
+            print(f"[✔] Doublons supprimés ({dropped}), {kept} entrées uniques.")
+        else:
+            print(f"[✔] Aucun doublon, {kept} entrées uniques.")
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
 if __name__ == "__main__":
-    remove_duplicates()
+    if DEDUPE_MODE == "chunked":
+        remove_duplicates_chunked()
+    else:
+        remove_duplicates()
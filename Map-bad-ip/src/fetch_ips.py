@@ -13,13 +13,15 @@ import pandas as pd
 from pandas.errors import EmptyDataError
 from dotenv import load_dotenv
 
+import metrics
+
 load_dotenv()
 
 FEED_URL = os.getenv(
     "RSS_FEED_URL",
     "https://raw.githubusercontent.com/duggytuxy/Data-Shield_IPv4_Blocklist/refs/heads/main/prod_data-shield_ipv4_blocklist.txt"
 )
-DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "data")
+DATA_DIR = os.getenv("MAP_DATA_DIR", os.path.join(os.path.dirname(__file__), "..", "data"))
 CSV_PATH = os.path.join(DATA_DIR, "ips.csv")
 JSON_PATH = os.path.join(DATA_DIR, "ips.json")
 
@@ -48,8 +50,9 @@ def fetch():
     """
     Recupere le fichier texte brut et en extrait toutes les IP.
     """
-    resp = requests.get(FEED_URL, timeout=15, headers=HEADERS)
-    resp.raise_for_status()
+    with metrics.api_call("blocklist"):
+        resp = requests.get(FEED_URL, timeout=15, headers=HEADERS)
+        resp.raise_for_status()
     return set(IP_REGEX.findall(resp.text))
 
 
@@ -77,6 +80,7 @@ def main():
     existing = load_existing()
     fetched = fetch()
     new_ips = fetched - existing
+    metrics.record_rows(rows_in=len(fetched), rows_out=len(new_ips))
 
     if not new_ips:
         print("[*] Aucune nouvelle IP detectee.")
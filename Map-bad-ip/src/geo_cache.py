@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+geo_cache.py
+Cache persistant de geolocalisation, indexe par IP exacte et par prefixe reseau.
+- TTL distincts pour les entrees exactes, les prefixes et les echecs (cache negatif)
+- taille bornee par une eviction LRU
+- un prefixe ne remplace une requete exacte que s'il est juge fiable
+  (assez d'observations, et une localisation tres majoritaire)
+
+Le fichier (data/cache/geo_cache.json) n'est pas versionne : le workflow le conserve
+d'une execution a l'autre avec actions/cache, et il n'est reecrit que s'il a change.
+"""
+
+import os
+import json
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from iputils import uint32_to_ips
+
+DATA_DIR = os.getenv("MAP_DATA_DIR", os.path.join(os.path.dirname(__file__), "..", "data"))
+CACHE_PATH = os.getenv("GEO_CACHE_PATH", os.path.join(DATA_DIR, "cache", "geo_cache.json"))
+
+EXACT_TTL = float(os.getenv("GEO_CACHE_TTL_DAYS", "30")) * 86400
+PREFIX_TTL = float(os.getenv("GEO_CACHE_PREFIX_TTL_DAYS", "14")) * 86400
+NEGATIVE_TTL = float(os.getenv("GEO_CACHE_NEGATIVE_TTL_HOURS", "6")) * 3600
+MAX_EXACT = int(os.getenv("GEO_CACHE_MAX_EXACT", "200000"))
+MAX_PREFIX = int(os.getenv("GEO_CACHE_MAX_PREFIX", "50000"))
+PREFIX_LEN = int(os.getenv("GEO_CACHE_PREFIX_LEN", "24"))
+PREFIX_MIN_SAMPLES = int(os.getenv("GEO_CACHE_PREFIX_MIN_SAMPLES", "2"))
+PREFIX_MIN_AGREEMENT = float(os.getenv("GEO_CACHE_PREFIX_MIN_AGREEMENT", "0.9"))
+
+REC_FIELDS = ("source", "latitude", "longitude", "city", "region", "country")
+
+# Sentinelle : IP en echec recent, inutile de la redemander avant expiration
+NEGATIVE = object()
+
+
+def ip_prefix(ip, length=PREFIX_LEN):
+    """
+    Retourne le prefixe reseau d'une IPv4 (ex: "1.12.246.0/24"), ou None si l'IP est invalide.
+    """
+    parts = ip.split(".")
+    if len(parts) != 4 or not all(p.isdigit() and int(p) <= 255 for p in parts):
+        return None
+    value = 0
+    for p in parts:
+        value = (value << 8) | int(p)
+    value &= (0xFFFFFFFF << (32 - length)) & 0xFFFFFFFF
+    network = ".".join(str((value >> s) & 0xFF) for s in (24, 16, 8, 0))
+    return f"{network}/{length}"
+
+
+def _location_key(rec):
+    return "|".join(str(rec.get(k) or "") for k in ("city", "region", "country"))
+
+
+class GeoCache:
+
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        self.exact = OrderedDict()
+        self.prefix = OrderedDict()
+        self.dirty = False
+        self.stats = dict.fromkeys(
+            ["exact_hits", "prefix_hits", "negative_hits", "misses", "expired", "evicted", "stored"], 0
+        )
+
+    @classmethod
+    def load(cls, path=CACHE_PATH):
+        cache = cls(path)
+        if os.path.exists(path):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    data = json.load(f)
+                cache.exact = OrderedDict(data.get("exact", {}))
+                cache.prefix = OrderedDict(data.get("prefix", {}))
+            except (OSError, ValueError) as e:
+                print(f"[!] Cache de geolocalisation illisible ({e}), repart a vide.")
+        return cache
+
+    def __len__(self):
+        return len(self.exact)
+
+    def save(self):
+        """
+        Ecriture atomique (fichier temporaire + rename), seulement si le cache a change.
+        """
+        if not self.dirty:
+            return False
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"exact": self.exact, "prefix": self.prefix}, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, self.path)
+        self.dirty = False
+        return True
+
+    def warm(self, df, now=None):
+        """
+        Pre-remplit le cache a partir des IP deja geolocalisees (DataFrame de geostore.load,
+        ip en uint32, de la plus ancienne a la plus recente), sans boucle par ligne :
+        les MAX_EXACT IP les plus recentes en entrees exactes, les MAX_PREFIX prefixes
+        les plus recents avec le decompte de leurs localisations.
+        """
+        now = now or time.time()
+        df = df[df["latitude"].notna() & df["longitude"].notna()].reset_index(drop=True)
+        if df.empty:
+            return
+        self.dirty = True
+        fields = df[list(REC_FIELDS)].astype(object)
+        fields = fields.where(fields.notna(), None)
+
+        tail = slice(max(0, len(df) - MAX_EXACT), len(df))
+        ips = uint32_to_ips(df["ip"].to_numpy()[tail])
+        recs = fields.iloc[tail].to_dict("records")
+        self.exact.update((ip, {"ts": now, "rec": rec}) for ip, rec in zip(ips, recs))
+
+        # prefixes : decompte par (prefixe, localisation), hors resultats deja issus d'un prefixe
+        mask = (0xFFFFFFFF << (32 - PREFIX_LEN)) & 0xFFFFFFFF
+        observed = (df["source"].astype(str) != "prefix_cache").to_numpy()
+        text = fields[["city", "region", "country"]].fillna("").astype(str)
+        stats = pd.DataFrame({
+            "prefix": df["ip"].to_numpy().astype(np.uint32) & np.uint32(mask),
+            "loc": text["city"] + "|" + text["region"] + "|" + text["country"],
+            "row": np.arange(len(df)),
+        })[observed]
+        recent = stats.groupby("prefix")["row"].max().nlargest(MAX_PREFIX).sort_values()
+        stats = stats[stats["prefix"].isin(recent.index)]
+        groups = stats.groupby(["prefix", "loc"])["row"].agg(["size", "max"]).reset_index()
+        rep_recs = fields.iloc[groups["max"].to_numpy()].to_dict("records")
+        names = dict(zip(recent.index, (f"{ip}/{PREFIX_LEN}" for ip in uint32_to_ips(recent.index.to_numpy()))))
+        for prefix in recent.index:
+            self.prefix[names[prefix]] = {"ts": now, "locs": {}}
+        for prefix, loc, n, rec in zip(groups["prefix"], groups["loc"], groups["size"], rep_recs):
+            self.prefix[names[prefix]]["locs"][loc] = {"n": int(n), "rec": rec}
+
+    def get(self, ip, now=None):
+        """
+        Retourne l'enregistrement en cache, NEGATIVE pour un echec recent, ou None.
+        """
+        now = now or time.time()
+        entry = self.exact.get(ip)
+        if entry is not None:
+            ttl = EXACT_TTL if entry["rec"] is not None else NEGATIVE_TTL
+            if now - entry["ts"] <= ttl:
+                self.exact.move_to_end(ip)
+                if entry["rec"] is None:
+                    self.stats["negative_hits"] += 1
+                    return NEGATIVE
+                self.stats["exact_hits"] += 1
+                return dict(entry["rec"], ip=ip)
+            del self.exact[ip]
+            self.dirty = True
+            self.stats["expired"] += 1
+
+        rec = self._prefix_lookup(ip, now)
+        if rec is not None:
+            self.stats["prefix_hits"] += 1
+            return rec
+        self.stats["misses"] += 1
+        return None
+
+    def _prefix_lookup(self, ip, now):
+        key = ip_prefix(ip)
+        entry = self.prefix.get(key) if key else None
+        if entry is None:
+            return None
+        if now - entry["ts"] > PREFIX_TTL:
+            del self.prefix[key]
+            self.dirty = True
+            self.stats["expired"] += 1
+            return None
+        self.prefix.move_to_end(key)
+
+        # Regle de confiance : assez d'observations et une localisation dominante
+        total = sum(loc["n"] for loc in entry["locs"].values())
+        best = max(entry["locs"].values(), key=lambda loc: loc["n"])
+        if total < PREFIX_MIN_SAMPLES or best["n"] / total < PREFIX_MIN_AGREEMENT:
+            return None
+        return dict(best["rec"], ip=ip, source="prefix_cache")
+
+    def put(self, ip, rec, now=None):
+        """
+        Memorise un resultat ; rec=None enregistre un echec (cache negatif a TTL court).
+        """
+        self._store(ip, rec, now=now)
+
+    def _store(self, ip, rec, now=None):
+        now = now or time.time()
+        clean = None
+        if rec is not None:
+            clean = {k: rec.get(k) for k in REC_FIELDS}
+        self.exact[ip] = {"ts": now, "rec": clean}
+        self.exact.move_to_end(ip)
+        self.dirty = True
+        self.stats["stored"] += 1
+
+        key = ip_prefix(ip)
+        if clean is not None and key and clean.get("source") != "prefix_cache":
+            entry = self.prefix.setdefault(key, {"ts": now, "locs": {}})
+            loc = entry["locs"].setdefault(_location_key(clean), {"n": 0, "rec": clean})
+            loc["n"] += 1
+            entry["ts"] = now
+            self.prefix.move_to_end(key)
+
+        self._evict(self.exact, MAX_EXACT)
+        self._evict(self.prefix, MAX_PREFIX)
+
+    def _evict(self, table, limit):
+        while len(table) > limit:
+            table.popitem(last=False)
+            self.stats["evicted"] += 1
+
+    def report(self):
+        lookups = self.stats["exact_hits"] + self.stats["prefix_hits"] + self.stats["negative_hits"] + self.stats["misses"]
+        hits = lookups - self.stats["misses"]
+        rate = (100.0 * hits / lookups) if lookups else 0.0
+        return (
+            f"[+] Cache geoloc : {hits}/{lookups} hits ({rate:.1f}%) — "
+            f"exact={self.stats['exact_hits']} prefixe={self.stats['prefix_hits']} "
+            f"negatif={self.stats['negative_hits']} miss={self.stats['misses']} "
+            f"expires={self.stats['expired']} evinces={self.stats['evicted']} "
+            f"({len(self.exact)} IP, {len(self.prefix)} prefixes)"
+        )
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+geo_scheduler.py
+Ordonnancement de l'arriere de geolocalisation (IP de ips.csv pas encore enrichies).
+
+- GeoQueue : file persistante (data/geo_queue.npz) des IP en attente, avec date d'entree
+  et nombre de tentatives ; l'ordre de traitement donne la priorite aux IP les plus
+  recentes, puis a celles d'un reseau (/24) dont aucune IP n'est encore geolocalisee.
+- Quota : consommation mensuelle d'un fournisseur (data/geo_quota.json), repartie sur
+  la periode de facturation : chaque execution ne recoit que sa part du reste.
+- Deadline : arret propre avant la fin de la fenetre du cron.
+- write_backlog : etat de l'arriere (data/geo_backlog.json), repris par le dashboard.
+"""
+
+import os
+import json
+import math
+import time
+import calendar
+import numpy as np
+
+from iputils import sorted_contains
+
+DATA_DIR = os.getenv("MAP_DATA_DIR", os.path.join(os.path.dirname(__file__), "..", "data"))
+QUEUE_PATH = os.path.join(DATA_DIR, "geo_queue.npz")
+QUOTA_PATH = os.path.join(DATA_DIR, "geo_quota.json")
+BACKLOG_PATH = os.path.join(DATA_DIR, "geo_backlog.json")
+
+FRESH_HOURS = float(os.getenv("QUEUE_FRESH_HOURS", "24"))  # IP "recentes", traitees en premier
+PREFIX_BITS = 8  # reseau = /24
+RUN_INTERVAL_SECONDS = float(os.getenv("RUN_INTERVAL_SECONDS", "1800"))  # periode du cron
+BILLING_DAY = int(os.getenv("QUOTA_BILLING_DAY", "1"))  # jour de renouvellement des quotas
+
+# Priorites (plus petit = plus urgent)
+FRESH, UNRESOLVED_NETWORK, BACKLOG = 0, 1, 2
+PRIORITY_NAMES = {FRESH: "recentes", UNRESOLVED_NETWORK: "reseaux_inconnus", BACKLOG: "arriere"}
+
+
+class GeoQueue:
+    """
+    IP en attente (uint32 trie) + date d'entree dans la file + tentatives reseau echouees.
+    """
+
+    def __init__(self, path=QUEUE_PATH):
+        self.path = path
+        self.ips = np.empty(0, dtype=np.uint32)
+        self.queued_at = np.empty(0, dtype=np.uint32)
+        self.attempts = np.empty(0, dtype=np.uint16)
+
+    @classmethod
+    def load(cls, path=QUEUE_PATH):
+        queue = cls(path)
+        if os.path.exists(path):
+            with np.load(path) as data:
+                queue.ips = data["ips"]
+                queue.queued_at = data["queued_at"]
+                queue.attempts = data["attempts"]
+        return queue
+
+    def __len__(self):
+        return len(self.ips)
+
+    def sync(self, pending, now):
+        """
+        Aligne la file sur les IP en attente : les nouvelles y entrent a `now`,
+        celles qui ne sont plus en attente (enrichies) en sortent.
+        """
+        pending = np.unique(pending)
+        keep = sorted_contains(pending, self.ips)
+        added = pending[~sorted_contains(self.ips, pending)]
+        ips = np.concatenate([self.ips[keep], added])
+        order = np.argsort(ips, kind="stable")
+        self.ips = ips[order]
+        self.queued_at = np.concatenate([self.queued_at[keep], np.full(len(added), now, np.uint32)])[order]
+        self.attempts = np.concatenate([self.attempts[keep], np.zeros(len(added), np.uint16)])[order]
+        return len(added)
+
+    def priorities(self, keys, resolved_networks, now):
+        """
+        Priorite de chaque cle : recente, reseau sans aucune IP geolocalisee, ou arriere.
+        """
+        pos = np.searchsorted(self.ips, keys).clip(max=max(len(self.ips) - 1, 0))
+        queued_at = self.queued_at[pos] if len(self.ips) else np.full(len(keys), now, np.uint32)
+        prio = np.full(len(keys), BACKLOG, dtype=np.int8)
+        prio[~sorted_contains(resolved_networks, keys >> PREFIX_BITS)] = UNRESOLVED_NETWORK
+        prio[queued_at.astype(np.int64) >= int(now - FRESH_HOURS * 3600)] = FRESH
+        return prio, queued_at, pos
+
+    def order(self, keys, resolved_networks, now):
+        """
+        Indices de `keys` dans l'ordre de traitement : priorite, puis plus recent d'abord,
+        puis moins de tentatives, puis position la plus tardive dans ips.csv.
+        """
+        prio, queued_at, pos = self.priorities(keys, resolved_networks, now)
+        attempts = self.attempts[pos] if len(self.ips) else np.zeros(len(keys), np.uint16)
+        position = np.arange(len(keys))
+        return np.lexsort((-position, attempts, -queued_at.astype(np.int64), prio))
+
+    def record_failures(self, keys):
+        if len(keys) and len(self.ips):
+            pos = np.searchsorted(self.ips, keys).clip(max=len(self.ips) - 1)
+            hit = self.ips[pos] == keys
+            self.attempts[pos[hit]] += 1
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez_compressed(f, ips=self.ips, queued_at=self.queued_at, attempts=self.attempts)
+        os.replace(tmp, self.path)
+
+
+def billing_period(now, day=BILLING_DAY):
+    """
+    Bornes (epoch UTC) de la periode de facturation mensuelle contenant `now`.
+    """
+    t = time.gmtime(now)
+
+    def start_of(year, month):
+        day_in_month = min(day, calendar.monthrange(year, month)[1])
+        return calendar.timegm((year, month, day_in_month, 0, 0, 0))
+
+    year, month = t.tm_year, t.tm_mon
+    start = start_of(year, month)
+    if start > now:
+        year, month = (year - 1, 12) if month == 1 else (year, month - 1)
+        start = start_of(year, month)
+    next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return start, start_of(next_year, next_month)
+
+
+class Quota:
+    """
+    Quota mensuel d'un fournisseur (limit <= 0 : illimite). L'allocation d'une execution
+    est le reste du quota divise par le nombre d'executions restant dans la periode,
+    si bien qu'une execution sans travail laisse sa part aux suivantes.
+    """
+
+    def __init__(self, provider, limit, state, now):
+        self.provider = provider
+        self.limit = limit
+        self.start, self.end = billing_period(now)
+        entry = state.get(provider, {})
+        self.used = entry.get("used", 0) if entry.get("period_start") == self.start else 0
+        if self.unlimited:
+            self.allowance = math.inf
+        else:
+            runs_left = max(1, math.ceil((self.end - now) / RUN_INTERVAL_SECONDS))
+            self.allowance = max(0, math.ceil((limit - self.used) / runs_left))
+        self.spent = 0
+
+    @property
+    def unlimited(self):
+        return self.limit <= 0
+
+    def available(self, units=1):
+        return self.spent + units <= self.allowance
+
+    def consume(self, units=1):
+        self.spent += units
+        self.used += units
+
+    def to_dict(self):
+        return {"period_start": self.start, "period_end": self.end, "used": self.used,
+                "limit": self.limit, "run_allowance": None if self.unlimited else self.allowance,
+                "run_spent": self.spent}
+
+
+def load_quota_state(path=QUOTA_PATH):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_quotas(quotas, path=QUOTA_PATH):
+    state = load_quota_state(path)
+    state.update({q.provider: q.to_dict() for q in quotas})
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+class Deadline:
+    """
+    Echeance d'une execution (secondes depuis sa creation ; <= 0 : aucune).
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.at = time.monotonic() + seconds if seconds > 0 else math.inf
+
+    def expired(self):
+        return time.monotonic() >= self.at
+
+    def remaining(self):
+        return self.at - time.monotonic()
+
+
+def write_backlog(queue, keys, resolved_networks, quotas, now, stopped_by=None, path=BACKLOG_PATH):
+    """
+    Etat de l'arriere apres l'execution : IP restantes par priorite, anciennete, quotas.
+    """
+    prio, queued_at, _ = queue.priorities(keys, resolved_networks, now)
+    payload = {
+        "updated": int(now),
+        "pending": int(len(keys)),
+        "by_priority": {name: int((prio == p).sum()) for p, name in PRIORITY_NAMES.items()},
+        "oldest_queued_at": int(queued_at.min()) if len(keys) else None,
+        "stopped_by": stopped_by,
+        "quotas": {q.provider: q.to_dict() for q in quotas},
+    }
+    with open(path + ".tmp", "w") as f:
+        json.dump(payload, f, indent=2)
+    os.replace(path + ".tmp", path)
+    return payload
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+geo_writer.py
+Ecriture bufferisee et resistante aux interruptions de geo_enriched.csv.
+- les lignes sont accumulees puis ecrites par lots (nombre de lignes ou delai)
+- chaque lot part en un seul write() + fsync, et une ligne tronquee par un crash est reparee au demarrage
+- un index compact (IP en uint32 + filigrane JSON) evite de relire tout l'historique :
+  seules les lignes ajoutees depuis le dernier filigrane sont relues
+"""
+
+import io
+import os
+import json
+import time
+import hashlib
+import numpy as np
+import pandas as pd
+
+from iputils import ips_to_uint32
+
+OUTPUT_COLUMNS = ["ip", "source", "latitude", "longitude", "city", "region", "country"]
+
+FLUSH_ROWS = int(os.getenv("GEO_FLUSH_ROWS", "50"))
+FLUSH_SECONDS = float(os.getenv("GEO_FLUSH_SECONDS", "10"))
+FINGERPRINT_BYTES = 4096
+
+
+def file_fingerprint(path, offset):
+    """
+    Empreinte des derniers octets avant `offset` : detecte une reecriture du fichier
+    (ex: dedoublonnage) qui invaliderait un filigrane.
+    """
+    start = max(0, offset - FINGERPRINT_BYTES)
+    with open(path, "rb") as f:
+        f.seek(start)
+        chunk = f.read(offset - start)
+    if len(chunk) != offset - start:
+        return None
+    return hashlib.sha1(chunk).hexdigest()
+
+
+def repair_tail(path):
+    """
+    Tronque une eventuelle ligne incomplete en fin de fichier (ecriture interrompue).
+    """
+    if not os.path.exists(path):
+        return
+    size = os.path.getsize(path)
+    if size == 0:
+        return
+    with open(path, "rb+") as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) == b"\n":
+            return
+        pos = size
+        while pos > 0:
+            step = min(pos, 4096)
+            f.seek(pos - step)
+            chunk = f.read(step)
+            nl = chunk.rfind(b"\n")
+            if nl != -1:
+                f.truncate(pos - step + nl + 1)
+                print(f"[!] Ligne incomplete supprimee en fin de {os.path.basename(path)}.")
+                return
+            pos -= step
+        f.truncate(0)
+
+
+class _BoundedReader(io.RawIOBase):
+    """
+    Vue en lecture seule sur [offset, end) d'un fichier, pour lire en flux sans depasser `end`.
+    """
+
+    def __init__(self, f, remaining):
+        self.f = f
+        self.remaining = remaining
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), self.remaining)
+        if n <= 0:
+            return 0
+        data = self.f.read(n)
+        b[:len(data)] = data
+        self.remaining -= len(data)
+        return len(data)
+
+
+def complete_end(path):
+    """
+    Offset juste apres le dernier saut de ligne : les lignes au-dela sont incompletes.
+    """
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        pos = size
+        while pos > 0:
+            step = min(pos, 4096)
+            f.seek(pos - step)
+            nl = f.read(step).rfind(b"\n")
+            if nl != -1:
+                return pos - step + nl + 1
+            pos -= step
+    return 0
+
+
+def iter_rows_since(path, offset, end=None, columns=OUTPUT_COLUMNS, usecols=None, chunksize=None, dtype=None):
+    """
+    Lit en flux les lignes completes entre `offset` et `end`, par blocs de `chunksize` lignes
+    (un seul bloc si chunksize vaut None). A offset 0, l'en-tete est saute.
+    """
+    end = complete_end(path) if end is None else end
+    if end <= offset:
+        return
+    with open(path, "rb") as f:
+        f.seek(offset)
+        stream = io.BufferedReader(_BoundedReader(f, end - offset))
+        try:
+            reader = pd.read_csv(
+                stream, header=None, names=columns, usecols=usecols,
+                skiprows=1 if offset == 0 else 0, chunksize=chunksize, dtype=dtype,
+                keep_default_na=dtype is not str,
+            )
+        except pd.errors.EmptyDataError:
+            return
+        if chunksize is None:
+            yield reader
+        else:
+            with reader:
+                yield from reader
+
+
+def read_rows_since(path, offset, columns=OUTPUT_COLUMNS, usecols=None):
+    """
+    Lit les lignes completes ajoutees apres `offset` (octets).
+    Retourne (DataFrame, nouvel_offset) ; a offset 0, l'en-tete est saute.
+    """
+    end = complete_end(path)
+    chunks = list(iter_rows_since(path, offset, end, columns=columns, usecols=usecols))
+    if not chunks:
+        return pd.DataFrame(columns=usecols or columns), max(end, offset)
+    return chunks[0], end
+
+
+class DoneIndex:
+    """
+    Index des IP deja enrichies : fichier binaire d'uint32 + filigrane JSON
+    (offset CSV couvert, nombre d'entrees, empreinte).
+    """
+
+    def __init__(self, csv_path, index_path=None):
+        self.csv_path = csv_path
+        self.index_path = index_path or os.path.splitext(csv_path)[0] + ".idx"
+        self.meta_path = self.index_path + ".json"
+
+    def _read_meta(self):
+        try:
+            with open(self.meta_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, offset, rows):
+        meta = {"offset": offset, "rows": rows, "fingerprint": file_fingerprint(self.csv_path, offset)}
+        tmp = self.meta_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, self.meta_path)
+
+    def append(self, ips, offset):
+        """
+        Ajoute des IP a l'index puis avance le filigrane jusqu'a `offset`.
+        """
+        meta = self._read_meta() or {"rows": 0}
+        keys, valid = ips_to_uint32(ips)
+        keys = keys[valid]
+        with open(self.index_path, "ab") as f:
+            f.truncate(meta["rows"] * 4)  # retire une queue ecrite sans filigrane
+            f.write(keys.tobytes())
+        self._write_meta(offset, meta["rows"] + len(keys))
+
+    def load(self):
+        """
+        Retourne le tableau uint32 des IP deja traitees.
+        Ne relit que la partie du CSV posterieure au filigrane ; reconstruit tout si le CSV a ete reecrit.
+        """
+        meta = self._read_meta()
+        size = os.path.getsize(self.csv_path)
+        valid = (
+            meta is not None
+            and os.path.exists(self.index_path)
+            and os.path.getsize(self.index_path) >= meta["rows"] * 4
+            and meta["offset"] <= size
+            and file_fingerprint(self.csv_path, meta["offset"]) == meta["fingerprint"]
+        )
+        if not valid:
+            print("[*] Index des IP traitees absent ou perime, reconstruction...")
+            if os.path.exists(self.index_path):
+                os.remove(self.index_path)
+            if os.path.exists(self.meta_path):
+                os.remove(self.meta_path)
+            meta = {"offset": 0, "rows": 0}
+
+        done = np.fromfile(self.index_path, dtype=np.uint32, count=meta["rows"]) if meta["rows"] else np.empty(0, np.uint32)
+        if meta["offset"] < size or not valid:
+            new_rows, offset = read_rows_since(self.csv_path, meta["offset"], usecols=["ip"])
+            self.append(new_rows["ip"].astype(str).tolist(), offset)
+            new_keys, ok = ips_to_uint32(new_rows["ip"])
+            done = np.concatenate([done, new_keys[ok]])
+        return done
+
+
+class GeoWriter:
+    """
+    Writer bufferise pour geo_enriched.csv.
+    A utiliser comme gestionnaire de contexte : le tampon est vide a la sortie, meme sur exception.
+    """
+
+    def __init__(self, csv_path, index=None, flush_rows=FLUSH_ROWS, flush_seconds=FLUSH_SECONDS):
+        self.csv_path = csv_path
+        self.index = index or DoneIndex(csv_path)
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.buffer = []
+        self.last_flush = time.monotonic()
+        self.written = 0
+        repair_tail(csv_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+
+    def write(self, rec):
+        self.buffer.append(rec)
+        if len(self.buffer) >= self.flush_rows or time.monotonic() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        """
+        Ecrit le tampon en un seul appel write() puis fsync, et met l'index a jour.
+        """
+        self.last_flush = time.monotonic()
+        if not self.buffer:
+            return
+        payload = pd.DataFrame(self.buffer, columns=OUTPUT_COLUMNS).to_csv(index=False, header=False)
+        data = payload.encode("utf-8")
+        fd = os.open(self.csv_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            start = os.lseek(fd, 0, os.SEEK_END)
+            try:
+                written = os.write(fd, data)
+                if written != len(data):
+                    raise OSError(f"ecriture partielle ({written}/{len(data)} octets)")
+                os.fsync(fd)
+            except OSError:
+                # le lot reste en tampon : retirer un debut d'ecriture pour que le prochain
+                # essai ne se colle pas derriere une ligne tronquee
+                try:
+                    os.ftruncate(fd, start)
+                except OSError:
+                    pass
+                raise
+            offset = os.lseek(fd, 0, os.SEEK_END)
+        finally:
+            os.close(fd)
+        self.index.append([rec["ip"] for rec in self.buffer], offset)
+        self.written += len(self.buffer)
+        self.buffer = []
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+geoip_db.py
+Backend de geolocalisation hors ligne.
+Charge une base de plages d'IP (CSV ip-to-city type DB-IP / IP2Location, ou .mmdb)
+dans des tableaux numpy tries start/end, puis resout un lot complet d'IP
+en une seule passe vectorisee (searchsorted).
+La base est compilee une fois en fichiers .npy, rouverts ensuite en memory-map.
+"""
+
+import os
+import json
+import ipaddress
+import numpy as np
+import pandas as pd
+
+from iputils import ips_to_uint32
+
+COLUMNS = ["start", "end", "latitude", "longitude", "country", "region", "city"]
+STRING_COLUMNS = ["country", "region", "city"]
+
+
+def _read_csv_ranges(path):
+    """
+    Lit un CSV de plages IPv4 sans en-tete.
+    - DB-IP ip-to-city-lite : start,end,continent,country,region,city,lat,lon (IP texte)
+    - IP2Location LITE DB5  : from,to,country_code,country_name,region,city,lat,lon (entiers)
+    """
+    raw = pd.read_csv(path, header=None, dtype=str, keep_default_na=False)
+    if raw[0].str.isdigit().all():
+        start = pd.to_numeric(raw[0]).to_numpy(dtype=np.uint64)
+        end = pd.to_numeric(raw[1]).to_numpy(dtype=np.uint64)
+        valid = (start <= 0xFFFFFFFF) & (end <= 0xFFFFFFFF)
+        country_col = 2
+    else:
+        start, valid_start = ips_to_uint32(raw[0])
+        end, valid_end = ips_to_uint32(raw[1])
+        valid = valid_start & valid_end  # les lignes IPv6 sont ignorees
+        country_col = 3
+    return pd.DataFrame({
+        "start": start[valid].astype(np.uint32),
+        "end": end[valid].astype(np.uint32),
+        "latitude": pd.to_numeric(raw[6][valid], errors="coerce").to_numpy(dtype=np.float32),
+        "longitude": pd.to_numeric(raw[7][valid], errors="coerce").to_numpy(dtype=np.float32),
+        "country": raw[country_col][valid].to_numpy(),
+        "region": raw[4][valid].to_numpy(),
+        "city": raw[5][valid].to_numpy(),
+    })
+
+
+def _read_mmdb_ranges(path):
+    """
+    Lit une base MaxMind (.mmdb, format GeoLite2-City). Necessite le paquet optionnel maxminddb.
+    """
+    try:
+        import maxminddb
+    except ImportError:
+        raise RuntimeError("Le paquet 'maxminddb' est requis pour lire une base .mmdb")
+
+    rows = []
+    mapped = ipaddress.ip_network("::ffff:0:0/96")
+    with maxminddb.open_database(path) as reader:
+        for network, rec in reader:
+            if network.version == 6:
+                if not network.subnet_of(mapped):
+                    continue
+                base = int(network.network_address) - int(mapped.network_address)
+                size = network.num_addresses
+            else:
+                base = int(network.network_address)
+                size = network.num_addresses
+            rec = rec or {}
+            loc = rec.get("location", {})
+            subdivisions = rec.get("subdivisions") or [{}]
+            rows.append((
+                base,
+                base + size - 1,
+                loc.get("latitude"),
+                loc.get("longitude"),
+                rec.get("country", {}).get("iso_code", ""),
+                subdivisions[0].get("names", {}).get("en", ""),
+                rec.get("city", {}).get("names", {}).get("en", ""),
+            ))
+    df = pd.DataFrame(rows, columns=COLUMNS)
+    df["start"] = df["start"].astype(np.uint32)
+    df["end"] = df["end"].astype(np.uint32)
+    df["latitude"] = df["latitude"].astype(np.float32)
+    df["longitude"] = df["longitude"].astype(np.float32)
+    return df
+
+
+def compile_database(source_path, index_dir):
+    """
+    Compile la base source en tableaux .npy tries (un fichier par colonne).
+    Les colonnes texte sont stockees sous forme de codes entiers + une table de libelles.
+    """
+    if source_path.endswith(".mmdb"):
+        df = _read_mmdb_ranges(source_path)
+    else:
+        df = _read_csv_ranges(source_path)
+
+    df = df.sort_values("start", kind="stable").reset_index(drop=True)
+    labels, codes = np.unique(
+        np.concatenate([df[c].astype(str).to_numpy() for c in STRING_COLUMNS]),
+        return_inverse=True,
+    )
+    codes = codes.astype(np.int32).reshape(len(STRING_COLUMNS), len(df))
+
+    os.makedirs(index_dir, exist_ok=True)
+    for name in ["start", "end", "latitude", "longitude"]:
+        np.save(os.path.join(index_dir, f"{name}.npy"), df[name].to_numpy())
+    for i, name in enumerate(STRING_COLUMNS):
+        np.save(os.path.join(index_dir, f"{name}.npy"), codes[i])
+    with open(os.path.join(index_dir, "labels.json"), "w", encoding="utf-8") as f:
+        json.dump(labels.tolist(), f, ensure_ascii=False)
+
+    st = os.stat(source_path)
+    meta = {"source": os.path.basename(source_path), "size": st.st_size, "mtime": st.st_mtime, "ranges": len(df)}
+    # meta.json ecrit en dernier : son absence signale une compilation interrompue
+    with open(os.path.join(index_dir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    return meta
+
+
+class GeoIPDatabase:
+    """
+    Base de plages IPv4 ouverte en memory-map.
+    """
+
+    def __init__(self, source_path, index_dir=None):
+        self.source_path = source_path
+        self.index_dir = index_dir or source_path + ".idx"
+        if self._needs_compile():
+            print(f"[*] Compilation de la base GeoIP {source_path}...")
+            compile_database(source_path, self.index_dir)
+
+        def load(name):
+            return np.load(os.path.join(self.index_dir, f"{name}.npy"), mmap_mode="r")
+
+        self.start = load("start")
+        self.end = load("end")
+        self.latitude = load("latitude")
+        self.longitude = load("longitude")
+        self.codes = {name: load(name) for name in STRING_COLUMNS}
+        with open(os.path.join(self.index_dir, "labels.json"), encoding="utf-8") as f:
+            self.labels = json.load(f)
+
+    def _needs_compile(self):
+        meta_path = os.path.join(self.index_dir, "meta.json")
+        if not os.path.exists(meta_path):
+            return True
+        with open(meta_path) as f:
+            meta = json.load(f)
+        st = os.stat(self.source_path)
+        return meta.get("size") != st.st_size or meta.get("mtime") != st.st_mtime
+
+    def __len__(self):
+        return len(self.start)
+
+    def lookup(self, ips):
+        """
+        Resout toutes les IP en une passe.
+        Retourne (masque_trouve, index_plage) ; index_plage n'a de sens que la ou le masque est vrai.
+        """
+        keys, valid = ips_to_uint32(ips)
+        idx = np.searchsorted(self.start, keys, side="right") - 1
+        safe = np.clip(idx, 0, max(len(self.start) - 1, 0))
+        found = valid & (idx >= 0) & (len(self.start) > 0)
+        if len(self.start):
+            found &= keys <= self.end[safe]
+            found &= ~np.isnan(self.latitude[safe]) & ~np.isnan(self.longitude[safe])
+        return found, safe
+
+    def resolve(self, ips):
+        """
+        Retourne un dict {ip: enregistrement} pour les IP presentes dans la base.
+        """
+        ips = list(ips)
+        found, idx = self.lookup(ips)
+        hit_idx = idx[found]
+        lat = np.asarray(self.latitude[hit_idx], dtype=float).round(4)
+        lon = np.asarray(self.longitude[hit_idx], dtype=float).round(4)
+        strings = {
+            name: [self.labels[c] or None for c in self.codes[name][hit_idx]]
+            for name in STRING_COLUMNS
+        }
+        hit_ips = [ip for ip, ok in zip(ips, found) if ok]
+        return {
+            ip: {
+                "ip": ip,
+                "source": "geoip_db",
+                "latitude": float(lat[i]),
+                "longitude": float(lon[i]),
+                "city": strings["city"][i],
+                "region": strings["region"][i],
+                "country": strings["country"][i],
+            }
+            for i, ip in enumerate(hit_ips)
+        }
+
+
+def open_database(path):
+    """
+    Ouvre la base locale si elle existe, sinon retourne None (backend desactive).
+    """
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        return GeoIPDatabase(path)
+    except Exception as e:
+        print(f"[!] Base GeoIP locale inutilisable ({e}), backend desactive.")
+        return None
@@ -1,9 +1,11 @@
 #!/usr/bin/env python3
 """
 geolocate.py
-Combine geoloc via IPInfo + fallback IA (Mistral) si coords manquantes.
-Traite les IP une par une, passe a la suivante meme si l'IA echoue,
-et evite les IP deja traitees.
+Combine geoloc via base GeoIP locale (optionnelle) + IPInfo + fallback IA (Mistral) si coords manquantes.
+Traite les IP une par une via IPInfo, regroupe les echecs pour un fallback IA
+par lots (plusieurs IP par requete, reponses validees), et evite les IP deja traitees.
+L'arriere est traite par priorite (geo_scheduler.py) : IP recentes et reseaux inconnus
+d'abord, quotas mensuels IPInfo / Mistral repartis sur la periode, arret a l'echeance.
 """
 
 import os
@@ -11,40 +13,57 @@ import time
 import json
 import re
 import requests
+import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 from mistralai import Mistral
 
+import metrics
+import geostore
+from geoip_db import open_database
+from geo_cache import GeoCache, NEGATIVE, REC_FIELDS
+from geo_writer import GeoWriter, DoneIndex, OUTPUT_COLUMNS
+from geo_scheduler import GeoQueue, Quota, Deadline, PREFIX_BITS, load_quota_state, save_quotas, write_backlog
+from iputils import ips_to_uint32
+
 load_dotenv(os.path.join(os.path.dirname(__file__), ".env"))
 
 # --- Config ---
-IPINFO_API_URL      = "https://ipinfo.io/"
+IPINFO_API_URL      = os.getenv("IPINFO_API_URL", "https://ipinfo.io/")
+IPINFO_DELAY        = float(os.getenv("IPINFO_DELAY_SECONDS", "0.5"))  # pause entre deux appels IPInfo
 IPINFO_TOKEN        = os.getenv("IPINFO_TOKEN", "")
 MISTRAL_API_KEY     = os.getenv("MISTRAL_API_KEY", "")
 MISTRAL_MODEL       = os.getenv("MISTRAL_MODEL", "mistral-large-latest")
+MISTRAL_SERVER_URL  = os.getenv("MISTRAL_SERVER_URL") or None  # None = API officielle
 DISCORD_WEBHOOK_URL = os.getenv("DISCORD_WEBHOOK_URL", "")
+MISTRAL_BATCH_SIZE  = int(os.getenv("MISTRAL_BATCH_SIZE", "25"))
+MISTRAL_MAX_RETRIES = int(os.getenv("MISTRAL_MAX_RETRIES", "2"))
+
+# Quotas mensuels (appels ; 0 = illimite) et duree maximale d'une execution (secondes)
+IPINFO_MONTHLY_QUOTA  = int(os.getenv("IPINFO_MONTHLY_QUOTA", "50000"))
+MISTRAL_MONTHLY_QUOTA = int(os.getenv("MISTRAL_MONTHLY_QUOTA", "0"))
+GEO_DEADLINE_SECONDS  = float(os.getenv("GEO_DEADLINE_SECONDS", "1200"))
 
-DATA_DIR   = os.path.join(os.path.dirname(__file__), "..", "data")
+DATA_DIR   = os.getenv("MAP_DATA_DIR", os.path.join(os.path.dirname(__file__), "..", "data"))
 INPUT_CSV  = os.path.join(DATA_DIR, "ips.csv")
 OUTPUT_CSV = os.path.join(DATA_DIR, "geo_enriched.csv")
 
+# Base de plages IP locale (CSV DB-IP / IP2Location ou .mmdb) ; vide = backend desactive
+GEOIP_DB_PATH = os.getenv("GEOIP_DB_PATH", os.path.join(DATA_DIR, "geoip", "dbip-city-lite.csv"))
+
 SYSTEM_PROMPT = (
     "Tu es un service de geolocalisation d'adresses IP.\n"
-    "Quand je te fournis une adresse IP, tu dois d'abord tenter d'obtenir ses coordonnees GPS exactes (latitude, longitude).\n"
+    "Je te fournis une liste d'adresses IP, une par ligne.\n"
+    "Pour chacune, tu dois d'abord tenter d'obtenir ses coordonnees GPS exactes (latitude, longitude).\n"
     "Si les coordonnees GPS exactes ne sont pas disponibles, tu recuperes alors les coordonnees (latitude, longitude) du centre de la ville d'origine de cette IP.\n"
-    "Tu repondras uniquement par un objet JSON formate exactement comme :\n"
-    "{\n"
-    "  \"ip\": \"1.2.3.4\",\n"
-    "  \"source\": \"gps\" | \"city\",\n"
-    "  \"latitude\": 0.0,\n"
-    "  \"longitude\": 0.0,\n"
-    "  \"city\": \"\",\n"
-    "  \"region\": \"\",\n"
-    "  \"country\": \"\"\n"
-    "}\n"
-    "sans texte additionnel."
+    "Tu repondras uniquement par un objet JSON contenant un tableau \"results\", avec un element par IP, formate exactement comme :\n"
+    "{\"results\": [\n"
+    "  {\"ip\": \"1.2.3.4\", \"source\": \"gps\" | \"city\", \"latitude\": 0.0, \"longitude\": 0.0,\n"
+    "   \"city\": \"\", \"region\": \"\", \"country\": \"FR\"}\n"
+    "]}\n"
+    "Le champ country est le code pays ISO 3166-1 alpha-2. Sans texte additionnel."
 )
 
 # Session HTTP avec retry
@@ -56,22 +75,25 @@ session.mount("https://", HTTPAdapter(max_retries=retries))
 def ensure_output_csv():
     os.makedirs(DATA_DIR, exist_ok=True)
     if not os.path.exists(OUTPUT_CSV) or os.path.getsize(OUTPUT_CSV) == 0:
-        df = pd.DataFrame(columns=["ip", "source", "latitude", "longitude", "city", "region", "country"])
+        df = pd.DataFrame(columns=OUTPUT_COLUMNS)
         df.to_csv(OUTPUT_CSV, index=False)
 
 
 def load_done_ips():
-    df = pd.read_csv(OUTPUT_CSV)
-    return set(df["ip"].astype(str).tolist())
+    """
+    IP deja enrichies (uint32), via l'index compact : seules les nouvelles lignes du CSV sont relues.
+    """
+    return DoneIndex(OUTPUT_CSV).load()
 
 
 def call_ipinfo(ip):
     if not IPINFO_TOKEN:
         raise RuntimeError("IPINFO_TOKEN manquant")
     url = f"{IPINFO_API_URL}{ip}/json"
-    resp = session.get(url, params={"token": IPINFO_TOKEN}, timeout=10)
-    resp.raise_for_status()
-    d = resp.json()
+    with metrics.api_call("ipinfo"):
+        resp = session.get(url, params={"token": IPINFO_TOKEN}, timeout=10)
+        resp.raise_for_status()
+        d = resp.json()
     lat, lon = None, None
     if "loc" in d and d["loc"]:
         parts = d["loc"].split(",")
@@ -88,43 +110,127 @@ def call_ipinfo(ip):
     }
 
 
-def call_mistral(ip, client):
+def parse_mistral_results(text):
+    """
+    Extrait la liste de resultats d'une reponse Mistral (objet {"results": [...]} ou tableau brut).
+    """
+    text = text.strip()
+    text = re.sub(r"^```(?:json)?", "", text)
+    text = re.sub(r"```$", "", text).strip()
+    data = json.loads(text)
+    if isinstance(data, dict):
+        data = data.get("results", [data])
+    if not isinstance(data, list):
+        raise ValueError("reponse Mistral sans liste de resultats")
+    return data
+
+
+def validate_record(rec):
+    """
+    Verifie un enregistrement IA : coordonnees dans les bornes, non nulles, et code pays ISO.
+    Retourne l'enregistrement normalise, ou None s'il est invalide.
+    """
+    if not isinstance(rec, dict):
+        return None
+    try:
+        lat, lon = float(rec["latitude"]), float(rec["longitude"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180) or (lat == 0 and lon == 0):
+        return None
+    country = str(rec.get("country") or "").strip().upper()
+    if not re.fullmatch(r"[A-Z]{2}", country):
+        return None
+    return {
+        "ip": str(rec.get("ip", "")).strip(),
+        "source": rec.get("source") or "ai",
+        "latitude": lat,
+        "longitude": lon,
+        "city": rec.get("city") or None,
+        "region": rec.get("region") or None,
+        "country": country,
+    }
+
+
+def call_mistral_batch(ips, client):
+    """
+    Geolocalise un lot d'IP en une seule requete. Retourne {ip: enregistrement valide}.
+    """
     messages = [
         {"role": "system", "content": SYSTEM_PROMPT},
-        {"role": "user", "content": ip},
+        {"role": "user", "content": "\n".join(ips)},
     ]
-    resp = client.chat.complete(model=MISTRAL_MODEL, messages=messages)
-    text = resp.choices[0].message.content.strip()
-    text = re.sub(r"^```json", "", text)
-    text = re.sub(r"```$", "", text).strip()
-    match = re.search(r"\{.*\}$", text, re.DOTALL)
-    json_str = match.group(0) if match else text
-    return json.loads(json_str)
+    with metrics.api_call("mistral"):
+        resp = client.chat.complete(
+            model=MISTRAL_MODEL,
+            messages=messages,
+            response_format={"type": "json_object"},
+        )
+    wanted = set(ips)
+    valid = {}
+    for rec in parse_mistral_results(resp.choices[0].message.content):
+        rec = validate_record(rec)
+        if rec is not None and rec["ip"] in wanted:
+            valid[rec["ip"]] = rec
+    return valid
 
 
-def enrich_ip(ip, mistral_client):
-    # Tentative IPInfo
+def mistral_fallback(ips, client, quota=None, deadline=None):
+    """
+    Fallback IA par lots de MISTRAL_BATCH_SIZE IP ; seules les IP dont la reponse
+    est absente ou invalide sont renvoyees au tour suivant.
+    Chaque lot consomme une unite de `quota` ; quota ou echeance atteints, les lots restants
+    ne sont pas envoyes. Retourne (resultats, IP effectivement soumises).
+    """
+    results = {}
+    attempted = set()
+    pending = list(ips)
+    for attempt in range(1 + MISTRAL_MAX_RETRIES):
+        if not pending:
+            break
+        if attempt:
+            print(f"[*] Mistral : nouvel essai pour {len(pending)} IP invalides ou manquantes.")
+        for i in range(0, len(pending), MISTRAL_BATCH_SIZE):
+            if (quota and not quota.available()) or (deadline and deadline.expired()):
+                return results, attempted
+            batch = pending[i:i + MISTRAL_BATCH_SIZE]
+            if quota:
+                quota.consume()
+            attempted.update(batch)
+            try:
+                results.update(call_mistral_batch(batch, client))
+            except Exception as e:
+                print(f"[!] Lot Mistral de {len(batch)} IP echoue : {e}")
+        pending = [ip for ip in pending if ip not in results]
+    return results, attempted
+
+
+def enrich_ip(ip, local_hits=None):
+    # Base GeoIP locale (resolue en amont pour tout le lot)
+    if local_hits and ip in local_hits:
+        return local_hits[ip]
+
+    # Tentative IPInfo ; en cas d'echec l'IP part dans le fallback Mistral par lots
     try:
         rec = call_ipinfo(ip)
         if rec["latitude"] is not None and rec["longitude"] is not None:
             return rec
         raise ValueError("coords manquantes IPInfo")
     except Exception as e:
-        print(f"[*] IPInfo echouee ({e}), fallback Mistral pour {ip}")
-
-    # Fallback Mistral
-    if not mistral_client:
-        print(f"[!] Pas de client Mistral disponible, IP {ip} ignoree.")
+        print(f"[*] IPInfo echouee ({e}), {ip} reportee au fallback Mistral")
         return None
+
+
+def append_record(writer, rec):
+    """
+    Confie un enregistrement au writer bufferise ; retourne False si le flush declenche echoue.
+    """
     try:
-        rec = call_mistral(ip, mistral_client)
-        if rec.get("latitude") is None or rec.get("longitude") is None:
-            raise ValueError("coords manquantes Mistral")
-        rec["source"] = rec.get("source", "ai")
-        return rec
-    except Exception as e:
-        print(f"[!] Mistral fallback echoue pour {ip}: {e}")
-        return None
+        writer.write(rec)
+        return True
+    except OSError as e:
+        print(f"[!] Ecriture differee pour {rec['ip']} ({e}), le lot reste en tampon.")
+        return False
 
 
 def notify_discord(message):
@@ -132,25 +238,29 @@ def notify_discord(message):
         print("[!] DISCORD_WEBHOOK_URL non defini, pas de notification.")
         return
     try:
-        resp = requests.post(DISCORD_WEBHOOK_URL, json={"content": message}, timeout=5)
-        resp.raise_for_status()
+        with metrics.api_call("discord"):
+            resp = requests.post(DISCORD_WEBHOOK_URL, json={"content": message}, timeout=5)
+            resp.raise_for_status()
         print("[+] Notification Discord envoyee.")
     except Exception as e:
         print(f"[!] Echec notification Discord: {e}")
 
 
 def main():
+    deadline = Deadline(GEO_DEADLINE_SECONDS)
+
     # Validation des secrets DANS main() — jamais au niveau module
     if not IPINFO_TOKEN:
         print("[!] IPINFO_TOKEN manquant — geolocalisation IPInfo desactivee, fallback Mistral uniquement.")
 
     mistral_client = None
     if MISTRAL_API_KEY:
-        mistral_client = Mistral(api_key=MISTRAL_API_KEY)
+        mistral_client = Mistral(api_key=MISTRAL_API_KEY, server_url=MISTRAL_SERVER_URL)
     else:
         print("[!] MISTRAL_API_KEY manquant — fallback Mistral desactive.")
 
     ensure_output_csv()
+    writer = GeoWriter(OUTPUT_CSV)
     done = load_done_ips()
 
     if not os.path.exists(INPUT_CSV):
@@ -158,26 +268,125 @@ def main():
         return
 
     ips = pd.read_csv(INPUT_CSV, header=None)[0].astype(str).tolist()
-    to_do = [ip for ip in ips if ip not in done]
+    keys, valid = ips_to_uint32(ips)
+    pending = valid & ~np.isin(keys, done)
+
+    # File persistante : les plus recentes et les reseaux inconnus d'abord
+    now = int(time.time())
+    queue = GeoQueue.load()
+    queue.sync(keys[pending], now)
+    resolved_networks = np.unique(done >> PREFIX_BITS)
+    todo_idx = np.flatnonzero(pending)
+    _, first = np.unique(keys[todo_idx], return_index=True)  # une IP listee deux fois n'est traitee qu'une fois
+    todo_idx = todo_idx[np.sort(first)]
+    todo_idx = todo_idx[queue.order(keys[todo_idx], resolved_networks, now)]
+    to_do = [ips[i] for i in todo_idx]
+    metrics.record_rows(rows_in=len(to_do))
+
+    quota_state = load_quota_state()
+    ipinfo_quota = Quota("ipinfo", IPINFO_MONTHLY_QUOTA, quota_state, now)
+    mistral_quota = Quota("mistral", MISTRAL_MONTHLY_QUOTA, quota_state, now)
+    quotas = [ipinfo_quota, mistral_quota]
 
     if not to_do:
         print("[+] Aucune nouvelle IP a enrichir.")
+        write_backlog(queue, keys[pending], resolved_networks, quotas, now)
         return
 
-    print(f"[*] {len(to_do)} IPs a traiter...")
-    success = 0
-    for idx, ip in enumerate(to_do, start=1):
-        print(f"[*] ({idx}/{len(to_do)}) {ip}")
-        rec = enrich_ip(ip, mistral_client)
-        if rec is None:
-            print(f"[!] Echec total pour {ip}, on passe.")
-            continue
-        pd.DataFrame([rec]).to_csv(OUTPUT_CSV, mode="a", index=False, header=False)
-        success += 1
-        time.sleep(0.5)
-
-    print(f"[+] Termine : {success}/{len(to_do)} IPs enrichies.")
-    notify_discord(f":white_check_mark: Geolocate termine : {success}/{len(to_do)} IPs enrichies.")
+    print(f"[*] {len(to_do)} IPs a traiter (allocation IPInfo de cette execution : {ipinfo_quota.allowance}, "
+          f"{ipinfo_quota.used}/{ipinfo_quota.limit} utilises ce mois)...")
+
+    local_hits = {}
+    geo_db = open_database(GEOIP_DB_PATH)
+    if geo_db is not None:
+        local_hits = geo_db.resolve(to_do)
+        print(f"[+] Base GeoIP locale : {len(local_hits)}/{len(to_do)} IPs resolues hors ligne.")
+
+    cache = GeoCache.load()
+    if len(cache) == 0:
+        cache.warm(geostore.load(columns=["ip", *REC_FIELDS]))
+
+    fallback = []
+    failed = []
+    deferred = 0
+    stopped_by = None
+    try:
+        for idx, ip in enumerate(to_do, start=1):
+            if deadline.expired():
+                stopped_by = "deadline"
+                print(f"[!] Echeance atteinte ({GEO_DEADLINE_SECONDS:g} s), {len(to_do) - idx + 1} IPs reportees.")
+                break
+            rec = None
+            from_network = False
+            if ip not in local_hits:
+                rec = cache.get(ip)
+                if rec is NEGATIVE:
+                    continue
+            if rec is None and ip not in local_hits and IPINFO_TOKEN:
+                if not ipinfo_quota.available():
+                    # part du quota de cette execution epuisee : l'IP reste en file
+                    stopped_by = stopped_by or "quota_ipinfo"
+                    deferred += 1
+                    continue
+                ipinfo_quota.consume()
+            print(f"[*] ({idx}/{len(to_do)}) {ip}")
+            if rec is None:
+                rec = enrich_ip(ip, local_hits)
+                from_network = ip not in local_hits
+                if from_network and rec is not None:
+                    cache.put(ip, rec)
+            if rec is None:
+                fallback.append(ip)
+                continue
+            append_record(writer, rec)
+            if from_network:
+                time.sleep(IPINFO_DELAY)
+
+        attempted = set(fallback)
+        if fallback and mistral_client:
+            print(f"[*] Fallback Mistral par lots pour {len(fallback)} IPs...")
+            ai_results, attempted = mistral_fallback(fallback, mistral_client, mistral_quota, deadline)
+            if len(attempted) < len(fallback):
+                stopped_by = stopped_by or "quota_mistral"
+                print(f"[!] Budget Mistral ou echeance atteint, {len(fallback) - len(attempted)} IPs reportees.")
+        else:
+            if fallback:
+                print(f"[!] Pas de client Mistral disponible, {len(fallback)} IPs ignorees.")
+            ai_results = {}
+        for ip in fallback:
+            if ip not in attempted:
+                continue
+            rec = ai_results.get(ip)
+            cache.put(ip, rec)
+            if rec is None:
+                failed.append(ip)
+                print(f"[!] Echec total pour {ip}, on passe.")
+                continue
+            append_record(writer, rec)
+    finally:
+        try:
+            writer.flush()
+        finally:
+            success = writer.written
+            cache.save()
+            # Seules les IP effectivement ecrites (index relu depuis le disque) sortent de la file :
+            # celles restees en tampon apres un echec d'ecriture sont retentees plus tard
+            done = load_done_ips()
+            remaining = np.unique(keys[pending][~np.isin(keys[pending], done)])
+            queue.sync(remaining, now)
+            queue.record_failures(ips_to_uint32(failed)[0])
+            queue.save()
+            save_quotas(quotas)
+            resolved_networks = np.unique(done >> PREFIX_BITS)
+            backlog = write_backlog(queue, remaining, resolved_networks, quotas, now, stopped_by)
+        print(cache.report())
+        metrics.record_rows(rows_out=success, local_hits=len(local_hits), fallback=len(fallback),
+                            deferred=deferred, backlog=backlog["pending"])
+
+    print(f"[+] Termine : {success}/{len(to_do)} IPs enrichies, {backlog['pending']} en attente "
+          f"({', '.join(f'{k}={v}' for k, v in backlog['by_priority'].items())}).")
+    notify_discord(f":white_check_mark: Geolocate termine : {success}/{len(to_do)} IPs enrichies, "
+                   f"{backlog['pending']} en attente.")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+geostore.py
+Stockage colonne (Parquet) partage par les etapes de Map-bad-ip.
+geo_enriched.csv reste le journal d'ajout ecrit par geolocate ; le store Parquet en est
+une copie typee (IP en uint32, colonnes texte categorielles) synchronisee incrementalement,
+et chaque etape ne charge que les colonnes dont elle a besoin. Les colonnes deja lues sont
+gardees en memoire pour les etapes suivantes du meme processus (voir run_all.py).
+
+Disposition : un fichier de base (geo_enriched.parquet) et des fichiers delta
+(geo_enriched.part-<offset>.parquet), un par synchronisation, listes dans le filigrane
+geo_enriched.parquet.json. Une synchronisation n'ecrit que les nouvelles lignes ; les deltas
+sont replies dans la base quand ils sont plus de MAX_PARTS.
+
+Usage :
+    python geostore.py migrate          # (re)construit le store depuis le CSV
+    python geostore.py compact          # replie les deltas dans la base
+    python geostore.py export [chemin]  # exporte le store en CSV compatible
+"""
+
+import os
+import sys
+import json
+import threading
+import numpy as np
+import pandas as pd
+
+from geo_writer import OUTPUT_COLUMNS, file_fingerprint, read_rows_since
+from iputils import ips_to_uint32, uint32_to_ips
+
+DATA_DIR = os.getenv("MAP_DATA_DIR", os.path.join(os.path.dirname(__file__), "..", "data"))
+GEO_CSV = os.path.join(DATA_DIR, "geo_enriched.csv")
+STORE_PATH = os.path.join(DATA_DIR, "geo_enriched.parquet")
+META_PATH = STORE_PATH + ".json"
+PART_PREFIX = "geo_enriched.part-"
+
+MAX_PARTS = int(os.getenv("GEOSTORE_MAX_PARTS", "48"))  # ~1 jour d'executions toutes les 30 min
+
+CATEGORY_COLUMNS = ["source", "city", "region", "country"]
+CSV_DTYPES = {"latitude": "float64", "longitude": "float64", **{c: "category" for c in CATEGORY_COLUMNS}}
+
+# Colonnes deja chargees, partagees entre etapes :
+# {"key": (base, deltas lus), "columns": {nom: Series}}
+_loaded = {"key": None, "columns": {}}
+# run_all.py execute des etapes en parallele : synchronisation et cache sous un meme verrou
+_lock = threading.RLock()
+
+try:
+    import pyarrow  # noqa: F401
+    HAS_PARQUET = True
+except ImportError:
+    HAS_PARQUET = False
+
+
+def _typed(df):
+    """
+    Applique le schema du store : ip en uint32, texte en categorie.
+    """
+    df = df.copy()
+    if "ip" in df.columns and df["ip"].dtype != np.uint32:
+        keys, valid = ips_to_uint32(df["ip"])
+        df = df[valid].copy()
+        df["ip"] = keys[valid]
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    for col in ("latitude", "longitude"):
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+    return df.reset_index(drop=True)
+
+
+def _concat(frames):
+    """
+    Concatene des morceaux du store en conservant le schema (categories unifiees).
+    """
+    if len(frames) == 1:
+        return frames[0]
+    return _typed(pd.concat(frames, ignore_index=True))
+
+
+def _part_path(name):
+    return os.path.join(DATA_DIR, name)
+
+
+def _write_parquet(df, path):
+    tmp = path + ".tmp"
+    df.to_parquet(tmp, index=False)
+    os.replace(tmp, path)
+
+
+def _write_meta(offset, rows, parts):
+    meta = {"offset": offset, "rows": rows, "parts": parts, "fingerprint": file_fingerprint(GEO_CSV, offset)}
+    with open(META_PATH + ".tmp", "w") as f:
+        json.dump(meta, f)
+    os.replace(META_PATH + ".tmp", META_PATH)
+
+
+def _read_meta():
+    try:
+        with open(META_PATH) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    meta.setdefault("parts", [])
+    return meta
+
+
+def _remove_stale_parts(keep=()):
+    """
+    Supprime les deltas absents du filigrane (deja replies, ou ecrits avant un arret brutal).
+    """
+    for name in os.listdir(DATA_DIR):
+        if name.startswith(PART_PREFIX) and name not in keep:
+            os.remove(_part_path(name))
+
+
+def _write_base(df, offset):
+    _write_parquet(df, STORE_PATH)
+    _write_meta(offset, len(df), [])
+    _remove_stale_parts()
+
+
+def migrate():
+    """
+    Construit le store complet a partir de geo_enriched.csv.
+    """
+    with _lock:
+        df, offset = read_rows_since(GEO_CSV, 0)
+        df = _typed(df)
+        _write_base(df, offset)
+        print(f"[+] Store Parquet construit : {len(df)} lignes -> {STORE_PATH}")
+        return df
+
+
+def compact():
+    """
+    Replie les deltas dans le fichier de base (seule reecriture complete du store).
+    """
+    with _lock:
+        meta = _read_meta()
+        if meta is None or not meta["parts"]:
+            return
+        df = _read_store(meta, None)
+        _write_base(df, meta["offset"])
+        print(f"[+] Store Parquet compacte : {len(meta['parts'])} deltas replies, {len(df)} lignes.")
+
+
+def sync():
+    """
+    Ajoute au store, dans un nouveau delta, les lignes ajoutees au CSV depuis la derniere
+    synchronisation. Reconstruit tout si le CSV a ete reecrit (empreinte differente) ou si
+    un fichier du store manque.
+    """
+    with _lock:
+        if not HAS_PARQUET or not os.path.exists(GEO_CSV):
+            return
+        meta = _read_meta()
+        size = os.path.getsize(GEO_CSV)
+        if (
+            meta is None
+            or not os.path.exists(STORE_PATH)
+            or not all(os.path.exists(_part_path(p)) for p in meta["parts"])
+            or meta["offset"] > size
+            or file_fingerprint(GEO_CSV, meta["offset"]) != meta["fingerprint"]
+        ):
+            migrate()
+            return
+        if meta["offset"] == size:
+            return
+        new_rows, offset = read_rows_since(GEO_CSV, meta["offset"])
+        if new_rows.empty:
+            return
+        new_rows = _typed(new_rows)
+        # le delta est ecrit avant le filigrane : un arret entre les deux laisse un fichier ignore
+        name = f"{PART_PREFIX}{offset:012d}.parquet"
+        _write_parquet(new_rows, _part_path(name))
+        _write_meta(offset, meta["rows"] + len(new_rows), meta["parts"] + [name])
+        if len(meta["parts"]) + 1 > MAX_PARTS:
+            compact()
+
+
+def _read_store(meta, columns):
+    frames = [pd.read_parquet(STORE_PATH, columns=columns)]
+    frames += [pd.read_parquet(_part_path(p), columns=columns) for p in meta["parts"]]
+    return _concat(frames)
+
+
+def load(columns=None):
+    """
+    Charge les colonnes demandees du store (toutes par defaut), apres synchronisation.
+    Les colonnes deja en memoire ne sont completees que par les nouveaux deltas.
+    Sans pyarrow, repli sur le CSV avec les memes types.
+    """
+    if HAS_PARQUET:
+        with _lock:
+            sync()
+            meta = _read_meta()
+            if meta is None:  # ni CSV ni store : store vide
+                return _typed(pd.DataFrame({c: pd.Series(dtype=object) for c in columns or OUTPUT_COLUMNS}))
+            base = os.stat(STORE_PATH).st_mtime_ns
+            cached = _loaded["columns"]
+            key = _loaded["key"]
+            if key is None or key[0] != base or key[1] != meta["parts"][:len(key[1])]:
+                cached = {}
+            elif cached and len(key[1]) < len(meta["parts"]):
+                new = [pd.read_parquet(_part_path(p), columns=list(cached)) for p in meta["parts"][len(key[1]):]]
+                merged = _concat([pd.DataFrame(cached)] + new)
+                cached = {c: merged[c] for c in merged.columns}
+            _loaded["key"], _loaded["columns"] = (base, list(meta["parts"])), cached
+            wanted = columns or OUTPUT_COLUMNS
+            missing = [c for c in wanted if c not in cached]
+            if missing:
+                cached.update(_read_store(meta, missing).items())
+            return pd.DataFrame({c: cached[c] for c in wanted})
+    df = pd.read_csv(GEO_CSV, usecols=columns, dtype={k: v for k, v in CSV_DTYPES.items() if not columns or k in columns})
+    return _typed(df)
+
+
+def export_csv(path=GEO_CSV, df=None):
+    """
+    Exporte le store (ou `df`) au format geo_enriched.csv, de facon atomique.
+    """
+    if df is None:
+        df = load()
+    out = df.copy()
+    out["ip"] = uint32_to_ips(out["ip"].to_numpy())
+    tmp = path + ".tmp"
+    out[OUTPUT_COLUMNS].to_csv(tmp, index=False)
+    os.replace(tmp, path)
+    print(f"[+] Export CSV : {len(out)} lignes -> {path}")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "migrate"
+    if command == "migrate":
+        migrate()
+    elif command == "compact":
+        compact()
+    elif command == "export":
+        export_csv(sys.argv[2] if len(sys.argv) > 2 else os.path.join(DATA_DIR, "geo_enriched_export.csv"))
+    else:
+        print(__doc__)
+        sys.exit(1)
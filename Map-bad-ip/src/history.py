@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+history.py
+Historique compact des metriques de menace (une capture par execution du pipeline) :
+nombre total d'IP geolocalisees, nouvelles IP, et compte par pays.
+
+Stockage en trois niveaux (data/history/*.jsonl), chacun encode en deltas :
+- raw.jsonl    : une ligne ajoutee par execution, conservee HISTORY_RAW_DAYS jours
+- hourly.jsonl : une capture par heure, conservee HISTORY_HOURLY_DAYS jours
+- daily.jsonl  : une capture par jour, conservee indefiniment
+Une ligne est soit une image complete {"t", "total", "new", "c"}, soit un delta
+{"dt", "dtotal", "new", "dc"} par rapport a la ligne precedente.
+
+Usage :
+    python history.py                      # capture + rollups + export dashboard
+    python history.py query [jours] [pays]  # affiche une serie
+"""
+
+import os
+import sys
+import json
+import time
+import pandas as pd
+
+CLUBCYBER_ROOT = os.getenv("SITE_ROOT", os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+DATA_DIR = os.getenv("MAP_DATA_DIR", os.path.join(os.path.dirname(__file__), "..", "data"))
+AGG_CSV = os.path.join(DATA_DIR, "agg_by_country.csv")
+HISTORY_DIR = os.path.join(DATA_DIR, "history")
+DASHBOARD_JSON = os.path.join(CLUBCYBER_ROOT, "dashboard", "data", "history.json")
+
+RAW_DAYS = float(os.getenv("HISTORY_RAW_DAYS", "7"))
+HOURLY_DAYS = float(os.getenv("HISTORY_HOURLY_DAYS", "90"))
+DASHBOARD_DAYS = float(os.getenv("HISTORY_DASHBOARD_DAYS", "30"))
+DASHBOARD_TOP = 10
+KEYFRAME_EVERY = 100
+
+TIERS = ["daily", "hourly", "raw"]  # du plus ancien au plus recent
+HOUR, DAY = 3600, 86400
+
+
+def tier_path(tier):
+    return os.path.join(HISTORY_DIR, f"{tier}.jsonl")
+
+
+def encode(snap, prev):
+    """
+    Encode une capture en delta par rapport a la precedente (ou en image complete si prev est None).
+    """
+    if prev is None:
+        return {"t": snap["t"], "total": snap["total"], "new": snap["new"], "c": snap["countries"]}
+    keys = set(snap["countries"]) | set(prev["countries"])
+    dc = {}
+    for k in keys:
+        d = snap["countries"].get(k, 0) - prev["countries"].get(k, 0)
+        if d:
+            dc[k] = d
+    return {"dt": snap["t"] - prev["t"], "dtotal": snap["total"] - prev["total"], "new": snap["new"], "dc": dc}
+
+
+def decode(lines):
+    snaps = []
+    prev = None
+    for line in lines:
+        rec = json.loads(line)
+        if "c" in rec:
+            snap = {"t": rec["t"], "total": rec["total"], "new": rec["new"], "countries": dict(rec["c"])}
+        else:
+            countries = dict(prev["countries"])
+            for k, d in rec["dc"].items():
+                countries[k] = countries.get(k, 0) + d
+                if not countries[k]:
+                    del countries[k]
+            snap = {"t": prev["t"] + rec["dt"], "total": prev["total"] + rec["dtotal"], "new": rec["new"], "countries": countries}
+        snaps.append(snap)
+        prev = snap
+    return snaps
+
+
+def complete_lines(path):
+    """
+    Lignes completes d'un niveau et taille en octets de la partie valide : une ligne
+    sans retour final (ecriture interrompue) est ignoree.
+    """
+    if not os.path.exists(path):
+        return [], 0
+    with open(path, "rb") as f:
+        data = f.read()
+    valid = data[:data.rfind(b"\n") + 1]
+    return [line for line in valid.decode("utf-8").splitlines() if line.strip()], len(valid)
+
+
+def read_tier(tier):
+    return decode(complete_lines(tier_path(tier))[0])
+
+
+def write_tier(tier, snaps):
+    """
+    Reecrit un niveau complet de facon atomique (utilise par les rollups).
+    """
+    os.makedirs(HISTORY_DIR, exist_ok=True)
+    tmp = tier_path(tier) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        prev = None
+        for i, snap in enumerate(snaps):
+            f.write(json.dumps(encode(snap, None if i % KEYFRAME_EVERY == 0 else prev), separators=(",", ":")) + "\n")
+            prev = snap
+    os.replace(tmp, tier_path(tier))
+
+
+def append_raw(snap):
+    """
+    Ajoute une capture en fin de raw.jsonl (seule operation sur le chemin chaud).
+    """
+    lines, valid = complete_lines(tier_path("raw"))
+    raw = decode(lines)
+    prev = raw[-1] if raw and len(raw) % KEYFRAME_EVERY else None
+    os.makedirs(HISTORY_DIR, exist_ok=True)
+    if os.path.exists(tier_path("raw")) and os.path.getsize(tier_path("raw")) > valid:
+        os.truncate(tier_path("raw"), valid)  # fin de ligne partielle d'une execution interrompue
+    with open(tier_path("raw"), "a", encoding="utf-8") as f:
+        f.write(json.dumps(encode(snap, prev), separators=(",", ":")) + "\n")
+
+
+def downsample(snaps, step):
+    """
+    Une capture par intervalle `step` : derniere valeur des compteurs, somme des nouvelles IP.
+    """
+    buckets = {}
+    for snap in snaps:
+        start = snap["t"] - snap["t"] % step
+        cur = buckets.get(start)
+        new = snap["new"] + (cur["new"] if cur else 0)
+        if cur is None or snap["t"] >= cur["last"]:
+            buckets[start] = {"t": start, "last": snap["t"], "total": snap["total"], "new": new, "countries": snap["countries"]}
+        else:
+            cur["new"] = new
+    return [{k: v for k, v in b.items() if k != "last"} for _, b in sorted(buckets.items())]
+
+
+def roll_up(src, dst, keep_seconds, step, now):
+    """
+    Deplace les captures de `src` plus anciennes que `keep_seconds` vers `dst`, reechantillonnees a `step`.
+    La coupure est alignee sur `step` pour ne jamais partager un intervalle entre deux niveaux.
+    """
+    snaps = read_tier(src)
+    cutoff = int(now - keep_seconds)
+    cutoff -= cutoff % step
+    old = [s for s in snaps if s["t"] < cutoff]
+    if not old:
+        return 0
+    target = read_tier(dst)
+    merged = downsample(target + downsample(old, step), step)
+    write_tier(dst, merged)
+    write_tier(src, [s for s in snaps if s["t"] >= cutoff])
+    return len(old)
+
+
+def query(start=None, end=None, step=None, countries=None):
+    """
+    Retourne les captures entre `start` et `end` (epoch, bornes incluses), tous niveaux confondus.
+    step : reechantillonnage optionnel (secondes) ; countries : restreint les comptes par pays.
+    """
+    snaps = [s for tier in TIERS for s in read_tier(tier)]
+    snaps.sort(key=lambda s: s["t"])
+    snaps = [s for s in snaps if (start is None or s["t"] >= start) and (end is None or s["t"] <= end)]
+    if step:
+        snaps = downsample(snaps, step)
+    if countries is not None:
+        wanted = set(countries)
+        snaps = [dict(s, countries={k: v for k, v in s["countries"].items() if k in wanted}) for s in snaps]
+    return snaps
+
+
+def take_snapshot(now):
+    agg = pd.read_csv(AGG_CSV, keep_default_na=False)
+    countries = {str(c): int(n) for c, n in zip(agg["country"], agg["count"])}
+    total = sum(countries.values())
+    raw = read_tier("raw")
+    previous = raw[-1] if raw else (query()[-1:] or [None])[0]
+    new = max(0, total - previous["total"]) if previous else 0
+    return {"t": int(now), "total": total, "new": new, "countries": countries}
+
+
+def export_dashboard(now):
+    """
+    Serie horaire des DASHBOARD_DAYS derniers jours, en colonnes, pour le dashboard.
+    """
+    snaps = query(start=now - DASHBOARD_DAYS * DAY, step=HOUR)
+    latest = snaps[-1]["countries"] if snaps else {}
+    top = sorted(latest, key=latest.get, reverse=True)[:DASHBOARD_TOP]
+    payload = {
+        "t": [s["t"] for s in snaps],
+        "total": [s["total"] for s in snaps],
+        "new": [s["new"] for s in snaps],
+        "countries": {c: [s["countries"].get(c, 0) for s in snaps] for c in top},
+    }
+    os.makedirs(os.path.dirname(DASHBOARD_JSON), exist_ok=True)
+    content = json.dumps(payload, separators=(",", ":"))
+    tmp = DASHBOARD_JSON + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp, DASHBOARD_JSON)
+
+
+def main():
+    now = time.time()
+    snap = take_snapshot(now)
+    append_raw(snap)
+    to_hourly = roll_up("raw", "hourly", RAW_DAYS * DAY, HOUR, now)
+    to_daily = roll_up("hourly", "daily", HOURLY_DAYS * DAY, DAY, now)
+    export_dashboard(now)
+    print(f"[+] Historique : total={snap['total']} nouvelles={snap['new']} "
+          f"({to_hourly} captures -> horaire, {to_daily} -> journalier)")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "query":
+        days = float(sys.argv[2]) if len(sys.argv) > 2 else 7
+        country = sys.argv[3:] or None
+        for s in query(start=time.time() - days * DAY, countries=country):
+            stamp = time.strftime("%Y-%m-%d %H:%M", time.gmtime(s["t"]))
+            print(f"{stamp}  total={s['total']:<7} new={s['new']:<5} {s['countries'] if country else ''}")
+    else:
+        main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+iputils.py
+Conversions vectorisees entre adresses IPv4 texte et entiers uint32.
+
+Seule la notation decimale pointee stricte est acceptee (4 octets de 0 a 255, sans zero
+en tete) : les formes courtes ou octales admises par inet_aton ("1.2.3", "010.0.0.1")
+sont rejetees, pour que toutes les etapes (et Barracuda) lisent les memes IP.
+"""
+
+import re
+import socket
+import numpy as np
+import pandas as pd
+
+OCTET = r"(25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])"  # chiffres ASCII uniquement
+IPV4_PATTERN = r"^" + r"\.".join([OCTET] * 4) + r"$"
+IPV4_RE = re.compile(IPV4_PATTERN)
+
+
+def ip_to_uint32(ip):
+    """
+    Version unitaire de ips_to_uint32 (meme motif) : entier, ou None si l'IP est invalide.
+    """
+    m = IPV4_RE.match(str(ip).strip())
+    if m is None:
+        return None
+    a, b, c, d = map(int, m.groups())
+    return (a << 24) | (b << 16) | (c << 8) | d
+
+
+def ips_to_uint32(ips):
+    """
+    Convertit une sequence d'IP texte en tableau uint32.
+    Retourne (valeurs, masque_valide) ; les IP invalides valent 0 et sont a False dans le masque.
+    Le motif strict ne sert qu'a filtrer (vectorise) ; les IP retenues sont ensuite
+    empaquetees par inet_aton, qui les lit a l'identique.
+    """
+    s = pd.Series(ips, dtype="object").astype(str).str.strip()
+    valid = s.str.fullmatch(IPV4_PATTERN).to_numpy(dtype=bool)
+    values = np.zeros(len(s), dtype=np.uint32)
+    packed = b"".join(map(socket.inet_aton, s[valid].tolist()))
+    values[valid] = np.frombuffer(packed, dtype=">u4")
+    return values, valid
+
+
+def uint32_to_ips(values):
+    """
+    Convertit un tableau d'entiers uint32 en liste d'IP texte.
+    """
+    v = np.asarray(values, dtype=np.uint32)
+    parts = [(v >> shift) & 0xFF for shift in (24, 16, 8, 0)]
+    a, b, c, d = (pd.Series(p).astype(str) for p in parts)
+    return (a + "." + b + "." + c + "." + d).tolist()
+
+
+def sorted_contains(sorted_keys, keys):
+    """
+    Appartenance vectorisee de `keys` a un tableau trie (recherche dichotomique).
+    """
+    if not len(sorted_keys):
+        return np.zeros(len(keys), dtype=bool)
+    pos = np.searchsorted(sorted_keys, keys).clip(max=len(sorted_keys) - 1)
+    return sorted_keys[pos] == keys
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+lookup.py
+Service local d'interrogation des IP malveillantes : "cette IP est-elle listee, et ou est-elle ?".
+
+Le pipeline publie un instantane (data/lookup/<version>/) : un tableau trie de toutes les IP
+connues (blocklist + geolocalisees) en uint32, et des colonnes alignees (presence dans la
+blocklist, latitude, longitude, codes pays/region/ville/source). Les fichiers .npy sont
+rouverts en memory-map ; une requete est un searchsorted sur le tableau trie.
+Le fichier data/lookup/CURRENT designe l'instantane actif ; il est remplace atomiquement
+a chaque publication et le service bascule sur le nouvel instantane sans redemarrer.
+
+Usage :
+    python lookup.py build                          # publie un instantane
+    python lookup.py query 1.2.3.4 10.0.0.0/24 ...  # interrogation en ligne de commande
+    python lookup.py serve [port]                   # endpoint HTTP (LOOKUP_HOST:LOOKUP_PORT)
+
+Endpoint HTTP (JSON) :
+    GET  /ip/<ip>
+    GET  /cidr/<reseau>/<prefixe>?limit=N
+    POST /bulk      (corps : liste JSON d'IP, ou une IP par ligne)
+    GET  /health
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import struct
+import threading
+import ipaddress
+import numpy as np
+import pandas as pd
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import geostore
+import metrics
+from iputils import ip_to_uint32, ips_to_uint32, uint32_to_ips
+
+DATA_DIR = os.getenv("MAP_DATA_DIR", os.path.join(os.path.dirname(__file__), "..", "data"))
+IPS_CSV = os.path.join(DATA_DIR, "ips.csv")
+LOOKUP_DIR = os.path.join(DATA_DIR, "lookup")
+CURRENT_PATH = os.path.join(LOOKUP_DIR, "CURRENT")
+
+LOOKUP_HOST = os.getenv("LOOKUP_HOST", "127.0.0.1")
+LOOKUP_PORT = int(os.getenv("LOOKUP_PORT", "8787"))
+RELOAD_INTERVAL = float(os.getenv("LOOKUP_RELOAD_SECONDS", "1"))
+CIDR_LIMIT = int(os.getenv("LOOKUP_CIDR_LIMIT", "1000"))
+KEEP_SNAPSHOTS = 2
+VECTOR_MIN = 64  # en dessous, conversion IP <-> uint32 en Python pur (evite le cout fixe de pandas)
+
+STRING_COLUMNS = ["source", "city", "region", "country"]
+
+
+def to_keys(ips):
+    """
+    IP texte -> (cles uint32, masque_valide), sans pandas pour les petits lots
+    (meme parseur strict que iputils dans les deux cas).
+    """
+    if len(ips) >= VECTOR_MIN:
+        return ips_to_uint32(ips)
+    values = [ip_to_uint32(ip) for ip in ips]
+    valid = np.array([v is not None for v in values], dtype=bool)
+    keys = np.array([v or 0 for v in values], dtype=np.uint32)
+    return keys, valid
+
+
+def to_ips(keys):
+    if len(keys) >= VECTOR_MIN:
+        return uint32_to_ips(keys)
+    return [socket.inet_ntoa(struct.pack("!I", int(k))) for k in keys]
+
+
+def build_snapshot():
+    """
+    Construit et publie un instantane a partir de ips.csv et du store geolocalise.
+    """
+    listed = np.empty(0, dtype=np.uint32)
+    if os.path.exists(IPS_CSV) and os.path.getsize(IPS_CSV):
+        keys, valid = ips_to_uint32(pd.read_csv(IPS_CSV, header=None, dtype=str)[0])
+        listed = np.unique(keys[valid])
+
+    geo = geostore.load(["ip", "latitude", "longitude"] + STRING_COLUMNS)
+    # derniere occurrence d'une IP geolocalisee plusieurs fois
+    geo_keys = geo["ip"].to_numpy(dtype=np.uint32)[::-1]
+    geo_keys, first = np.unique(geo_keys, return_index=True)
+    geo_rows = len(geo) - 1 - first
+
+    ips = np.union1d(listed, geo_keys).astype(np.uint32)
+    is_listed = np.isin(ips, listed, assume_unique=True)
+    geo_pos = np.searchsorted(ips, geo_keys)
+
+    latitude = np.full(len(ips), np.nan, dtype=np.float32)
+    longitude = np.full(len(ips), np.nan, dtype=np.float32)
+    latitude[geo_pos] = geo["latitude"].to_numpy(dtype=np.float32)[geo_rows]
+    longitude[geo_pos] = geo["longitude"].to_numpy(dtype=np.float32)[geo_rows]
+
+    index = {"": 0}
+    codes = {}
+    for name in STRING_COLUMNS:
+        values = geo[name].astype(object).where(geo[name].notna(), "").to_numpy()[geo_rows]
+        col = np.zeros(len(ips), dtype=np.int32)
+        col[geo_pos] = [index.setdefault(v, len(index)) for v in values]
+        codes[name] = col
+    labels = sorted(index, key=index.get)
+
+    # nom unique meme pour deux publications dans la meme seconde (jamais de reecriture
+    # d'un instantane qu'un service a peut-etre ouvert en memory-map)
+    now_ns = time.time_ns()
+    version = time.strftime("%Y%m%dT%H%M%S", time.gmtime(now_ns // 10**9)) + f".{now_ns % 10**9:09d}-{os.getpid()}"
+    snap_dir = os.path.join(LOOKUP_DIR, version)
+    os.makedirs(snap_dir, exist_ok=True)
+    np.save(os.path.join(snap_dir, "ips.npy"), ips)
+    np.save(os.path.join(snap_dir, "listed.npy"), is_listed)
+    np.save(os.path.join(snap_dir, "latitude.npy"), latitude)
+    np.save(os.path.join(snap_dir, "longitude.npy"), longitude)
+    for name, col in codes.items():
+        np.save(os.path.join(snap_dir, f"{name}.npy"), col)
+    with open(os.path.join(snap_dir, "labels.json"), "w", encoding="utf-8") as f:
+        json.dump(labels, f, ensure_ascii=False)
+    meta = {"version": version, "built_at": int(time.time()), "ips": len(ips),
+            "listed": int(is_listed.sum()), "geolocated": len(geo_keys)}
+    with open(os.path.join(snap_dir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+    # publication : bascule atomique du pointeur, puis menage des anciens instantanes
+    with open(CURRENT_PATH + ".tmp", "w") as f:
+        f.write(version)
+    os.replace(CURRENT_PATH + ".tmp", CURRENT_PATH)
+    prune_snapshots(version)
+    return meta
+
+
+def prune_snapshots(current):
+    """
+    Garde les KEEP_SNAPSHOTS instantanes les plus recents (les fichiers deja ouverts
+    en memory-map par un service restent lisibles apres suppression).
+    """
+    versions = sorted(d for d in os.listdir(LOOKUP_DIR) if os.path.isdir(os.path.join(LOOKUP_DIR, d)))
+    for old in versions[:-KEEP_SNAPSHOTS]:
+        if old != current:
+            shutil.rmtree(os.path.join(LOOKUP_DIR, old), ignore_errors=True)
+
+
+class LookupIndex:
+    """
+    Instantane ouvert en memory-map.
+    """
+
+    def __init__(self, snap_dir):
+        def load(name):
+            return np.load(os.path.join(snap_dir, f"{name}.npy"), mmap_mode="r")
+
+        with open(os.path.join(snap_dir, "meta.json")) as f:
+            self.meta = json.load(f)
+        with open(os.path.join(snap_dir, "labels.json"), encoding="utf-8") as f:
+            self.labels = json.load(f)
+        self.ips = load("ips")
+        self.listed = load("listed")
+        self.latitude = load("latitude")
+        self.longitude = load("longitude")
+        self.codes = {name: load(name) for name in STRING_COLUMNS}
+
+    def __len__(self):
+        return len(self.ips)
+
+    def find(self, keys):
+        """
+        Retourne (masque_trouve, position) pour un tableau de cles uint32.
+        """
+        keys = np.asarray(keys, dtype=np.uint32)
+        if not len(self.ips):
+            return np.zeros(len(keys), dtype=bool), np.zeros(len(keys), dtype=np.int64)
+        pos = np.searchsorted(self.ips, keys).clip(max=len(self.ips) - 1)
+        return self.ips[pos] == keys, pos
+
+    def records(self, ips, found, pos):
+        out = []
+        for i, ip in enumerate(ips):
+            if not found[i]:
+                out.append({"ip": ip, "known": False, "listed": False})
+                continue
+            p = pos[i]
+            rec = {"ip": ip, "known": True, "listed": bool(self.listed[p])}
+            if not np.isnan(self.latitude[p]):
+                rec["latitude"] = round(float(self.latitude[p]), 4)
+                rec["longitude"] = round(float(self.longitude[p]), 4)
+                for name in STRING_COLUMNS:
+                    rec[name] = self.labels[self.codes[name][p]] or None
+            out.append(rec)
+        return out
+
+    def query(self, ips):
+        """
+        Interrogation unitaire ou groupee : une entree par IP demandee (invalides signalees).
+        """
+        ips = [str(ip).strip() for ip in ips]
+        keys, valid = to_keys(ips)
+        found, pos = self.find(keys)
+        out = self.records(ips, found & valid, pos)
+        for i in np.flatnonzero(~valid):
+            out[i] = {"ip": ips[i], "error": "IPv4 invalide"}
+        return out
+
+    def query_cidr(self, cidr, limit=CIDR_LIMIT):
+        """
+        IP connues dans un reseau : deux searchsorted bornent la plage dans le tableau trie.
+        """
+        net = ipaddress.IPv4Network(cidr, strict=False)
+        lo = int(np.searchsorted(self.ips, np.uint32(int(net.network_address)), side="left"))
+        hi = int(np.searchsorted(self.ips, np.uint32(int(net.broadcast_address)), side="right"))
+        keys = np.asarray(self.ips[lo:min(hi, lo + limit)])
+        return {
+            "network": str(net),
+            "known": hi - lo,
+            "listed": int(np.count_nonzero(self.listed[lo:hi])),
+            "truncated": hi - lo > limit,
+            "ips": self.records(to_ips(keys), np.ones(len(keys), dtype=bool), np.arange(lo, lo + len(keys))),
+        }
+
+
+class LookupService:
+    """
+    Detient l'instantane actif et bascule sur le suivant des que CURRENT change.
+    La verification est limitee a une fois par RELOAD_INTERVAL ; le remplacement de
+    la reference est atomique, une requete en cours termine sur l'ancien instantane.
+    """
+
+    def __init__(self):
+        self.index = None
+        self.version = None
+        self.checked = 0.0
+        self.lock = threading.Lock()
+        self.reload()
+
+    def reload(self):
+        if not os.path.exists(CURRENT_PATH):
+            raise FileNotFoundError(f"aucun instantane publie ({CURRENT_PATH}) : lancer d'abord `python lookup.py build`")
+        with open(CURRENT_PATH) as f:
+            version = f.read().strip()
+        if version != self.version:
+            self.index = LookupIndex(os.path.join(LOOKUP_DIR, version))
+            self.version = version
+            print(f"[+] Instantane {version} charge : {len(self.index)} IP.")
+
+    def current(self):
+        now = time.monotonic()
+        if now - self.checked >= RELOAD_INTERVAL and self.lock.acquire(blocking=False):
+            try:
+                self.checked = now
+                self.reload()
+            except (OSError, ValueError) as e:
+                print(f"[!] Rechargement impossible, instantane {self.version} conserve : {e}")
+            finally:
+                self.lock.release()
+        return self.index
+
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        def send_json(self, code, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            parts = [p for p in url.path.split("/") if p]
+            index = service.current()
+            if parts == ["health"]:
+                self.send_json(200, index.meta)
+            elif len(parts) == 2 and parts[0] == "ip":
+                self.send_json(200, index.query([parts[1]])[0])
+            elif len(parts) == 3 and parts[0] == "cidr":
+                try:
+                    limit = int(parse_qs(url.query).get("limit", [CIDR_LIMIT])[0])
+                    if limit < 0:
+                        raise ValueError("limit doit etre positif")
+                    self.send_json(200, index.query_cidr(f"{parts[1]}/{parts[2]}", limit))
+                except ValueError as e:
+                    self.send_json(400, {"error": str(e)})
+            else:
+                self.send_json(404, {"error": "route inconnue"})
+
+        def do_POST(self):
+            if urlparse(self.path).path.rstrip("/") != "/bulk":
+                self.send_json(404, {"error": "route inconnue"})
+                return
+            try:
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+            except ValueError as e:
+                self.send_json(400, {"error": str(e)})
+                return
+            try:
+                ips = json.loads(body)
+            except ValueError:
+                ips = body.split()
+            if not isinstance(ips, list):
+                self.send_json(400, {"error": "liste d'IP attendue"})
+                return
+            self.send_json(200, service.current().query(ips))
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def open_service():
+    """
+    LookupService pour la ligne de commande : arret explicite si aucun instantane n'existe.
+    """
+    try:
+        return LookupService()
+    except FileNotFoundError as e:
+        print(f"[!] {e}")
+        sys.exit(1)
+
+
+def serve(port=LOOKUP_PORT):
+    service = open_service()
+    server = ThreadingHTTPServer((LOOKUP_HOST, port), make_handler(service))
+    print(f"[+] Service de lookup sur http://{LOOKUP_HOST}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main():
+    meta = build_snapshot()
+    metrics.record_rows(rows_in=meta["listed"] + meta["geolocated"], rows_out=meta["ips"])
+    print(f"[+] Instantane de lookup {meta['version']} publie : {meta['ips']} IP "
+          f"({meta['listed']} listees, {meta['geolocated']} geolocalisees).")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "build"
+    if command == "build":
+        main()
+    elif command == "query" and len(sys.argv) > 2:
+        index = open_service().index
+        for arg in sys.argv[2:]:
+            result = index.query_cidr(arg) if "/" in arg else index.query([arg])[0]
+            print(json.dumps(result, ensure_ascii=False))
+    elif command == "serve":
+        serve(int(sys.argv[2]) if len(sys.argv) > 2 else LOOKUP_PORT)
+    else:
+        print(__doc__)
+        sys.exit(1)
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+metrics.py
+Instrumentation partagee du pipeline : duree par etape, lignes en entree / sortie,
+appels API par fournisseur (histogramme de latence) et pic de memoire (RSS).
+
+run_all.py ouvre un run (start_run), execute chaque etape dans stage(), puis ecrit
+un fichier JSON par execution dans data/metrics/. Les modules des etapes se contentent de :
+    metrics.record_rows(rows_in=..., rows_out=...)
+    with metrics.api_call("ipinfo") as call: ...   # call.ok = False pour un echec sans exception
+Hors d'un run (module lance seul), ces appels ne font rien.
+
+Profilage optionnel : PIPELINE_PROFILE=geolocate,aggregate (ou "all") enregistre un
+profil cProfile par etape (data/metrics/<run>-<etape>.prof).
+"""
+
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import threading
+from contextlib import contextmanager
+
+DATA_DIR = os.getenv("MAP_DATA_DIR", os.path.join(os.path.dirname(__file__), "..", "data"))
+METRICS_DIR = os.path.join(DATA_DIR, "metrics")
+METRICS_KEEP = int(os.getenv("METRICS_KEEP", "200"))
+RSS_SAMPLE_SECONDS = float(os.getenv("METRICS_RSS_SAMPLE_SECONDS", "0.05"))
+PROFILE_STAGES = {s for s in os.getenv("PIPELINE_PROFILE", "").split(",") if s}
+
+# bornes superieures des classes de latence (ms) ; la derniere classe est ouverte
+LATENCY_BUCKETS_MS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+_local = threading.local()
+_lock = threading.Lock()
+_run = None
+
+
+def current_rss():
+    """
+    RSS courant en octets (Linux : /proc/self/statm), sinon pic du processus.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return peak_rss()
+
+
+def peak_rss():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Run:
+    """
+    Mesures d'une execution du pipeline.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.run_id = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime(self.started))
+        self.stages = {}
+        self.active = set()
+        self.stop = threading.Event()
+        self.sampler = threading.Thread(target=self._sample, daemon=True)
+        self.sampler.start()
+
+    def _sample(self):
+        """
+        Echantillonne le RSS et l'attribue aux etapes en cours (pic par etape).
+        """
+        while not self.stop.wait(RSS_SAMPLE_SECONDS):
+            rss = current_rss()
+            with _lock:
+                for name in self.active:
+                    st = self.stages[name]
+                    st["peak_rss"] = max(st["peak_rss"], rss)
+
+    def stage_entry(self, name):
+        return self.stages.setdefault(name, {
+            "status": None, "wall_seconds": 0.0, "rows_in": 0, "rows_out": 0,
+            "counters": {}, "peak_rss": 0, "api": {},
+        })
+
+    def to_dict(self):
+        return {
+            "run_id": self.run_id,
+            "started": int(self.started),
+            "wall_seconds": round(time.time() - self.started, 3),
+            "peak_rss": peak_rss(),
+            "stages": self.stages,
+        }
+
+
+def start_run():
+    global _run
+    _run = Run()
+    return _run
+
+
+def _stage_name():
+    return getattr(_local, "stage", None) or "hors_etape"
+
+
+@contextmanager
+def stage(name):
+    """
+    Mesure une etape ; les appels record_rows / api_call du meme thread lui sont attribues.
+    """
+    if _run is None:
+        yield
+        return
+    with _lock:
+        entry = _run.stage_entry(name)
+        _run.active.add(name)
+    entry["peak_rss"] = max(entry["peak_rss"], current_rss())
+    _local.stage = name
+    profiler = cProfile.Profile() if name in PROFILE_STAGES or "all" in PROFILE_STAGES else None
+    start = time.perf_counter()
+    try:
+        if profiler:
+            try:
+                profiler.enable()
+            except ValueError:  # un seul profileur actif a la fois (etapes en parallele)
+                print(f"[!] Profilage de {name} impossible : un autre profil est en cours.")
+                profiler = None
+        yield
+        entry["status"] = "ok"
+    except BaseException:
+        entry["status"] = "echec"
+        raise
+    finally:
+        if profiler:
+            profiler.disable()
+        entry["wall_seconds"] = round(time.perf_counter() - start, 3)
+        _local.stage = None
+        with _lock:
+            _run.active.discard(name)
+            entry["peak_rss"] = max(entry["peak_rss"], current_rss())
+        if profiler:
+            dump_profile(profiler, name)
+
+
+def dump_profile(profiler, name):
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = os.path.join(METRICS_DIR, f"{_run.run_id}-{name}.prof")
+    profiler.dump_stats(path)
+    print(f"[*] Profil de {name} -> {path}")
+    pstats.Stats(profiler, stream=sys.stdout).sort_stats("cumulative").print_stats(15)
+
+
+def set_status(name, status):
+    """
+    Statut d'une etape non executee (sautee, bloquee).
+    """
+    if _run is not None:
+        with _lock:
+            _run.stage_entry(name)["status"] = status
+
+
+def record_rows(rows_in=None, rows_out=None, **counters):
+    """
+    Ajoute des volumes a l'etape courante (lignes lues / ecrites, compteurs libres).
+    """
+    if _run is None:
+        return
+    with _lock:
+        entry = _run.stage_entry(_stage_name())
+        entry["rows_in"] += int(rows_in or 0)
+        entry["rows_out"] += int(rows_out or 0)
+        for key, value in counters.items():
+            entry["counters"][key] = entry["counters"].get(key, 0) + int(value)
+
+
+class ApiCall:
+    ok = True
+
+
+@contextmanager
+def api_call(provider):
+    """
+    Chronometre un appel a un fournisseur externe ; une exception le compte en erreur.
+    """
+    call = ApiCall()
+    start = time.perf_counter()
+    try:
+        yield call
+    except BaseException:
+        call.ok = False
+        raise
+    finally:
+        if _run is not None:
+            _record_call(provider, (time.perf_counter() - start) * 1000, call.ok)
+
+
+def _record_call(provider, elapsed_ms, ok):
+    with _lock:
+        api = _run.stage_entry(_stage_name())["api"]
+        stats = api.setdefault(provider, {
+            "calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0,
+            "buckets_ms": [f"<={b}" for b in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}"],
+            "histogram": [0] * (len(LATENCY_BUCKETS_MS) + 1),
+        })
+        stats["calls"] += 1
+        stats["errors"] += 0 if ok else 1
+        stats["total_ms"] = round(stats["total_ms"] + elapsed_ms, 3)
+        stats["max_ms"] = round(max(stats["max_ms"], elapsed_ms), 3)
+        bucket = next((i for i, b in enumerate(LATENCY_BUCKETS_MS) if elapsed_ms <= b), len(LATENCY_BUCKETS_MS))
+        stats["histogram"][bucket] += 1
+
+
+def finish_run():
+    """
+    Arrete l'echantillonnage et ecrit data/metrics/run-<id>.json ; retourne (chemin, mesures).
+    """
+    global _run
+    run, _run = _run, None
+    if run is None:
+        return None, None
+    run.stop.set()
+    run.sampler.join()
+    payload = run.to_dict()
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = os.path.join(METRICS_DIR, f"run-{run.run_id}.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(payload, f, indent=2)
+    os.replace(path + ".tmp", path)
+    prune()
+    return path, payload
+
+
+def prune():
+    runs = sorted(f for f in os.listdir(METRICS_DIR) if f.startswith("run-") and f.endswith(".json"))
+    for old in runs[:-METRICS_KEEP]:
+        os.remove(os.path.join(METRICS_DIR, old))
@@ -1,20 +1,130 @@
-import subprocess
+#!/usr/bin/env python3
+"""
+run_all.py
+Orchestrateur du pipeline Threat Intelligence, execute dans un seul processus.
+- chaque etape declare ses entrees, ses sorties et ses dependances
+- une etape est sautee si l'empreinte (sha256) de ses entrees n'a pas change depuis
+  son dernier succes et que ses sorties existent
+- les etapes independantes (ex: Barracuda et fetch_ips) tournent en parallele
+- chaque execution ecrit ses mesures (duree, lignes, appels API, memoire) dans
+  data/metrics/run-<id>.json (voir metrics.py) ; un resume est affiche a la fin
+
+Usage :
+    python run_all.py                 # pipeline complet
+    python run_all.py --force         # ignore la detection de changements
+    python run_all.py aggregate ...   # uniquement les etapes nommees
+"""
+
 import os
 import sys
+import json
+import time
+import hashlib
+import traceback
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
 import pandas as pd
 
+import metrics
+
 # Définir le chemin vers le dossier src
-src_folder = os.path.dirname(__file__)
-data_folder = os.path.join(src_folder, "..", "data")  # adapte si besoin
-
-# Liste des scripts à exécuter dans le bon ordre
-scripts = [
-    "fetch_ips.py",
-    #"geolocate.py",
-    "aggregate.py",
-    "visualize.py"
+src_folder = os.path.dirname(os.path.abspath(__file__))
+data_folder = os.getenv("MAP_DATA_DIR", os.path.join(src_folder, "..", "data"))
+repo_root = os.path.abspath(os.path.join(src_folder, "..", ".."))
+site_root = os.getenv("SITE_ROOT", repo_root)  # index.html et dashboard/
+barracuda_logs = os.getenv("BARRACUDA_LOG_DIR", os.path.join(repo_root, "Bad-Ip", "logs"))
+web_folder = os.path.join(src_folder, "..", "web")
+STATE_PATH = os.path.join(data_folder, "pipeline_state.json")
+
+# Budget d'une execution (cron toutes les 30 min) ; alerte au-dela de BUDGET_WARN du budget
+RUN_BUDGET_SECONDS = float(os.getenv("RUN_BUDGET_SECONDS", "1800"))
+BUDGET_WARN = 0.8
+
+
+def data(name):
+    return os.path.join(data_folder, name)
+
+
+def load_barracuda():
+    bad_ip_dir = os.path.join(repo_root, "Bad-Ip")
+    if bad_ip_dir not in sys.path:
+        sys.path.insert(0, bad_ip_dir)  # pour seen_store
+    path = os.path.join(bad_ip_dir, "barracuda.py")
+    spec = importlib.util.spec_from_file_location("barracuda", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_module(name):
+    """
+    Retourne une fonction qui importe le module de l'etape a la demande et lance son main().
+    """
+    def run():
+        if name == "barracuda":
+            load_barracuda().main()
+        else:
+            importlib.import_module(name).main()
+    return run
+
+
+class Stage:
+    """
+    Etape du pipeline.
+    always        : toujours executee (source externe, ex: telechargement d'une blocklist)
+    allow_failure : un echec n'interrompt ni les etapes dependantes ni le code retour
+    """
+
+    def __init__(self, name, func, inputs=(), outputs=(), deps=(), always=False, allow_failure=False):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.deps = list(deps)
+        self.always = always
+        self.allow_failure = allow_failure
+
+
+# Liste des etapes dans l'ordre logique (le graphe est deduit de deps)
+STAGES = [
+    Stage("barracuda", run_module("barracuda"),
+          outputs=[os.path.join(barracuda_logs, "seen_ips.npz")], always=True),
+    Stage("fetch_ips", run_module("fetch_ips"),
+          outputs=[data("ips.csv"), data("ips.json")], always=True),
+    # toujours lancee : l'index des IP traitees rend une execution sans travail quasi gratuite,
+    # et un arriere (echecs, quotas) doit pouvoir avancer meme si ips.csv n'a pas change
+    Stage("geolocate", run_module("geolocate"),
+          inputs=[data("ips.csv")], outputs=[data("geo_enriched.csv"), data("geo_backlog.json")],
+          deps=["fetch_ips"], always=True, allow_failure=True),
+    Stage("aggregate", run_module("aggregate"),
+          inputs=[data("geo_enriched.csv")],
+          outputs=[data("agg_by_country.csv"), data("top_countries.csv"), data("agg_by_city.csv")],
+          deps=["geolocate"], allow_failure=True),
+    # instantane memory-map servi par lookup.py (bascule atomique via data/lookup/CURRENT)
+    Stage("lookup", run_module("lookup"),
+          inputs=[data("ips.csv"), data("geo_enriched.csv")],
+          outputs=[os.path.join(data_folder, "lookup", "CURRENT")],
+          deps=["geolocate"], allow_failure=True),
+    # toujours lancee : une capture par execution, meme sans nouvelle IP
+    Stage("history", run_module("history"),
+          inputs=[data("agg_by_country.csv")],
+          outputs=[os.path.join(site_root, "dashboard", "data", "history.json")],
+          deps=["aggregate"], always=True),
+    Stage("tiles", run_module("tiles"),
+          inputs=[data("agg_by_city.csv")],
+          outputs=[os.path.join(site_root, "dashboard", "tiles", "index.json")],
+          deps=["aggregate"]),
+    Stage("visualizev2", run_module("visualizev2"),
+          inputs=[data("agg_by_country.csv"), data("geo_backlog.json"),
+                  os.path.join(site_root, "dashboard", "tiles", "z1.json"),
+                  os.path.join(site_root, "dashboard", "data", "history.json")]
+                 + [os.path.join(web_folder, f) for f in ("index.html", "app.js", "style.css")],
+          outputs=[os.path.join(site_root, "index.html"), os.path.join(site_root, "dashboard", "data", "manifest.json")],
+          deps=["aggregate", "tiles", "history"]),
 ]
 
+
 def prepare_geo_csv():
     geo_csv_path = os.path.join(data_folder, "geo_ips.csv")
     if not os.path.exists(geo_csv_path):
@@ -22,16 +132,176 @@ def prepare_geo_csv():
         df = pd.DataFrame(columns=["ip", "country", "country_code", "latitude", "longitude"])
         df.to_csv(geo_csv_path, index=False)
 
-def run_scripts():
-    python_cmd = sys.executable
-    for script in scripts:
-        script_path = os.path.join(src_folder, script)
-        print(f"[*] Running {script}...")
-        result = subprocess.run([python_cmd, script_path], capture_output=True, text=True)
-        print(result.stdout)
-        if result.stderr:
-            print(f"[!] Erreur lors de l'exécution de {script}:\n{result.stderr}")
 
-if __name__ == "__main__":
+def inputs_digest(stage):
+    h = hashlib.sha256()
+    for path in stage.inputs:
+        h.update(path.encode())
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                h.update(hashlib.file_digest(f, "sha256").digest())
+        else:
+            h.update(b"<absent>")
+    return h.hexdigest()
+
+
+def load_state():
+    try:
+        with open(STATE_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state):
+    tmp = STATE_PATH + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp, STATE_PATH)
+
+
+def execute(stage):
+    start = time.perf_counter()
+    try:
+        with metrics.stage(stage.name):
+            stage.func()
+        return "ok", time.perf_counter() - start, None
+    except BaseException as e:
+        if isinstance(e, KeyboardInterrupt):
+            raise
+        return "echec", time.perf_counter() - start, traceback.format_exc()
+
+
+def run_pipeline(stages, force=False, max_workers=4):
+    state = load_state()
+    by_name = {s.name: s for s in stages}
+    results = {}
+    pending = list(stages)
+    running = {}
+
+    def blocked(stage):
+        return any(
+            results.get(d, ("ok",))[0] in ("echec", "bloquee") and not by_name[d].allow_failure
+            for d in stage.deps if d in by_name
+        )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while pending or running:
+            for stage in list(pending):
+                if any(d in by_name and d not in results for d in stage.deps):
+                    continue
+                pending.remove(stage)
+                if blocked(stage):
+                    results[stage.name] = ("bloquee", 0.0)
+                    metrics.set_status(stage.name, "bloquee")
+                    print(f"[!] {stage.name} non executee : dependance en echec.")
+                    continue
+                digest = inputs_digest(stage)
+                unchanged = (
+                    not force
+                    and not stage.always
+                    and state.get(stage.name) == digest
+                    and all(os.path.exists(p) for p in stage.outputs)
+                )
+                if unchanged:
+                    results[stage.name] = ("sautee", 0.0)
+                    metrics.set_status(stage.name, "sautee")
+                    print(f"[*] {stage.name} sautee : entrees inchangees.")
+                    continue
+                print(f"[*] Running {stage.name}...")
+                running[pool.submit(execute, stage)] = (stage, digest)
+
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, digest = running.pop(future)
+                status, elapsed, error = future.result()
+                results[stage.name] = (status, elapsed)
+                if status == "ok":
+                    state[stage.name] = digest
+                    save_state(state)
+                else:
+                    print(f"[!] Erreur lors de l'exécution de {stage.name}:\n{error}")
+
+    return results
+
+
+def format_api(api):
+    return ", ".join(
+        f"{p} {s['calls']} appels/{s['errors']} err/{s['total_ms'] / s['calls']:.0f} ms moy"
+        for p, s in api.items()
+    )
+
+
+def summary_rows(results, stages, measures):
+    rows = []
+    for stage in stages:
+        status, elapsed = results.get(stage.name, ("absente", 0.0))
+        m = measures["stages"].get(stage.name, {}) if measures else {}
+        rows.append((stage.name, status, elapsed, m.get("rows_in", 0), m.get("rows_out", 0),
+                     m.get("peak_rss", 0) / 2**20, format_api(m.get("api", {}))))
+    return rows
+
+
+def print_summary(results, stages, measures=None):
+    print("\n[+] Resume du pipeline :")
+    print(f"    {'etape':<14} {'statut':<8} {'duree':>10} {'entree':>9} {'sortie':>9} {'RSS max':>9}  API")
+    total = 0.0
+    for name, status, elapsed, rows_in, rows_out, rss, api in summary_rows(results, stages, measures):
+        total += elapsed
+        print(f"    {name:<14} {status:<8} {elapsed:8.2f} s {rows_in:>9} {rows_out:>9} {rss:>6.0f} Mo  {api}")
+    print(f"    {'total':<14} {'':<8} {total:8.2f} s (somme des etapes)")
+
+
+def report_github(results, stages, measures, wall):
+    """
+    Sur GitHub Actions : tableau dans le resume du job, et annotation pour chaque etape
+    en echec toleree (le job reste vert mais l'echec est visible).
+    """
+    for stage in stages:
+        if results.get(stage.name, ("",))[0] == "echec" and stage.allow_failure:
+            print(f"::warning title=Etape {stage.name} en echec::{stage.name} a echoue (tolere), voir les logs.")
+    if wall > BUDGET_WARN * RUN_BUDGET_SECONDS:
+        print(f"::warning title=Budget d'execution::{wall:.0f} s sur {RUN_BUDGET_SECONDS:.0f} s autorisees.")
+    summary_path = os.getenv("GITHUB_STEP_SUMMARY")
+    if not summary_path:
+        return
+    lines = [
+        f"### Pipeline : {wall:.0f} s / {RUN_BUDGET_SECONDS:.0f} s ({wall / RUN_BUDGET_SECONDS:.0%} du budget)",
+        "",
+        "| Etape | Statut | Duree (s) | Entree | Sortie | RSS max (Mo) | API |",
+        "|---|---|---:|---:|---:|---:|---|",
+    ]
+    for name, status, elapsed, rows_in, rows_out, rss, api in summary_rows(results, stages, measures):
+        lines.append(f"| {name} | {status} | {elapsed:.2f} | {rows_in} | {rows_out} | {rss:.0f} | {api} |")
+    with open(summary_path, "a", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    force = "--force" in argv
+    names = [a for a in argv if not a.startswith("--")]
+    stages = [s for s in STAGES if not names or s.name in names]
+
     prepare_geo_csv()
-    run_scripts()
+    start = time.perf_counter()
+    metrics.start_run()
+    try:
+        results = run_pipeline(stages, force=force)
+    finally:
+        metrics_path, measures = metrics.finish_run()
+    wall = time.perf_counter() - start
+    print_summary(results, stages, measures)
+    print(f"[+] Duree reelle : {wall:.2f} s ({wall / RUN_BUDGET_SECONDS:.0%} du budget), "
+          f"RSS max : {measures['peak_rss'] / 2**20:.0f} Mo")
+    print(f"[+] Mesures enregistrees dans {metrics_path}")
+    report_github(results, stages, measures, wall)
+
+    failed = [s.name for s in stages if results.get(s.name, ("",))[0] == "echec" and not s.allow_failure]
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+tiles.py
+Pre-calcule un clustering spatial multi-resolution pour la carte du dashboard.
+Pour chaque niveau de zoom, les villes (agg_by_city.csv) sont regroupees sur une grille
+en projection Web Mercator (cellules de CELL_PX pixels a l'ecran), puis ecrites dans un
+petit fichier JSON par niveau (dashboard/tiles/z{n}.json) que la page charge a la demande.
+Le dernier niveau contient les points ville sans regroupement.
+"""
+
+import os
+import json
+import numpy as np
+import pandas as pd
+
+import metrics
+
+CLUBCYBER_ROOT = os.getenv("SITE_ROOT", os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+DATA_DIR = os.getenv("MAP_DATA_DIR", os.path.join(os.path.dirname(__file__), "..", "data"))
+CITY_CSV = os.path.join(DATA_DIR, "agg_by_city.csv")
+TILES_DIR = os.path.join(CLUBCYBER_ROOT, "dashboard", "tiles")
+
+MAX_ZOOM = int(os.getenv("TILES_MAX_ZOOM", "8"))  # niveau ville (pas de regroupement)
+CELL_PX = int(os.getenv("TILES_CELL_PX", "64"))
+MAX_LAT = 85.05112878
+
+
+def mercator(lat, lon):
+    """
+    Coordonnees Web Mercator normalisees dans [0, 1).
+    """
+    lat = np.radians(np.clip(lat, -MAX_LAT, MAX_LAT))
+    x = (np.asarray(lon) + 180.0) / 360.0
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / np.pi) / 2.0
+    return np.clip(x, 0, 1 - 1e-12), np.clip(y, 0, 1 - 1e-12)
+
+
+def empty_level():
+    return {"lat": np.empty(0), "lon": np.empty(0), "n": np.empty(0, dtype=int), "label": []}
+
+
+def load_points():
+    try:
+        df = pd.read_csv(CITY_CSV)
+    except pd.errors.EmptyDataError:  # fichier vide (aucune ville agregee)
+        df = pd.DataFrame(columns=["city", "country", "latitude", "longitude", "ip_count"])
+    df = df.dropna(subset=["latitude", "longitude"])
+    df = df[df["latitude"].between(-90, 90) & df["longitude"].between(-180, 180)]
+    df = df.reset_index(drop=True)
+    df["label"] = df["city"].astype(str) + " (" + df["country"].astype(str) + ")"
+    return df
+
+
+def cluster_level(df, x, y, zoom):
+    """
+    Regroupe les points d'un niveau de zoom par cellule de grille.
+    Centroide pondere par le nombre d'IP ; libelle = ville la plus touchee de la cellule.
+    """
+    if not len(df):
+        return empty_level()
+    cells = max(1, (256 << zoom) // CELL_PX)
+    key = (x * cells).astype(np.int64) * cells + (y * cells).astype(np.int64)
+    uniq, inverse = np.unique(key, return_inverse=True)
+    w = df["ip_count"].to_numpy(dtype=float)
+    n = np.bincount(inverse, weights=w)
+    lat = np.bincount(inverse, weights=w * df["latitude"].to_numpy()) / n
+    lon = np.bincount(inverse, weights=w * df["longitude"].to_numpy()) / n
+    places = np.bincount(inverse)
+
+    # ville dominante : tri par (cellule, nombre d'IP) puis derniere ligne de chaque cellule
+    order = np.lexsort((w, inverse))
+    last = np.r_[np.flatnonzero(np.diff(inverse[order])), len(order) - 1]
+    top = df["label"].to_numpy()[order[last]]
+    labels = [t if p == 1 else f"{t} +{p - 1} villes" for t, p in zip(top, places)]
+    return {"lat": lat, "lon": lon, "n": n.astype(int), "label": labels}
+
+
+def serialize(level):
+    return json.dumps({
+        "lat": np.round(level["lat"], 4).tolist(),
+        "lon": np.round(level["lon"], 4).tolist(),
+        "n": [int(v) for v in level["n"]],
+        "label": list(level["label"]),
+    }, ensure_ascii=False, separators=(",", ":"))
+
+
+def write_if_changed(path, content):
+    """
+    N'ecrit le fichier que si son contenu change (diff git et cache navigateur preserves).
+    """
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            if f.read() == content:
+                return False
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp, path)
+    return True
+
+
+def build_levels(df):
+    x, y = mercator(df["latitude"].to_numpy(), df["longitude"].to_numpy())
+    levels = {z: cluster_level(df, x, y, z) for z in range(MAX_ZOOM)}
+    levels[MAX_ZOOM] = {
+        "lat": df["latitude"].to_numpy(dtype=float),
+        "lon": df["longitude"].to_numpy(dtype=float),
+        "n": df["ip_count"].to_numpy(dtype=int),
+        "label": df["label"].tolist(),
+    }
+    return levels
+
+
+def load_level(zoom):
+    """
+    Relit un niveau deja ecrit (utilise par visualizev2 pour la vue initiale) ;
+    niveau vide s'il n'existe pas encore.
+    """
+    path = os.path.join(TILES_DIR, f"z{zoom}.json")
+    if not os.path.exists(path):
+        return {"lat": [], "lon": [], "n": [], "label": []}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main():
+    df = load_points()
+    levels = build_levels(df)
+
+    os.makedirs(TILES_DIR, exist_ok=True)
+    changed = 0
+    for z, level in levels.items():
+        changed += write_if_changed(os.path.join(TILES_DIR, f"z{z}.json"), serialize(level))
+    index = {"max_zoom": MAX_ZOOM, "points": {str(z): len(level["n"]) for z, level in levels.items()}}
+    write_if_changed(os.path.join(TILES_DIR, "index.json"), json.dumps(index, separators=(",", ":")))
+
+    metrics.record_rows(rows_in=len(df), rows_out=sum(len(level["n"]) for level in levels.values()))
+    sizes = ", ".join(f"z{z}={len(level['n'])}" for z, level in levels.items())
+    print(f"[+] Tuiles generees ({changed} niveaux modifies) : {sizes}")
+
+
+if __name__ == "__main__":
+    main()
@@ -12,14 +12,18 @@ import pandas as pd
 import plotly.graph_objects as go
 import plotly.express as px
 
-DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "data")
+import geostore
+from iputils import uint32_to_ips
+
+DATA_DIR = os.getenv("MAP_DATA_DIR", os.path.join(os.path.dirname(__file__), "..", "data"))
 GEO_CSV = os.path.join(DATA_DIR, "geo_enriched.csv")
 AGG_CSV = os.path.join(DATA_DIR, "agg_by_country.csv")
 OUTPUT_HTML = os.path.join(DATA_DIR, "map.html")
 
 def main():
     df_agg = pd.read_csv(AGG_CSV)
-    df_geo = pd.read_csv(GEO_CSV)
+    df_geo = geostore.load(columns=["ip", "latitude", "longitude", "city", "country"])
+    ips = pd.Series(uint32_to_ips(df_geo["ip"].to_numpy()), index=df_geo.index)
 
     # Choropleth
     fig = go.Figure()
@@ -37,9 +41,7 @@ def main():
     fig.add_trace(go.Scattergeo(
         lon=df_geo["longitude"],
         lat=df_geo["latitude"],
-        text=df_geo.apply(
-            lambda r: f"IP: {r.ip}<br>Pays: {r.country}<br>Org: {r.org}", axis=1
-        ),
+        text="IP: " + ips + "<br>Pays: " + df_geo["country"].astype(str) + "<br>Ville: " + df_geo["city"].astype(str),
         mode="markers",
         marker=dict(size=6, opacity=0.7),
         name="IPs"
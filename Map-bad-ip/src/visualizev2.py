@@ -4,72 +4,74 @@ visualizev2.py - Génère un dashboard de cybersécurité avec une carte Mapbox
 """
 
 import os
+import glob
+import json
+import hashlib
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 
+import tiles
+import metrics
+
 # Configuration des paths
-CLUBCYBER_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
-DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "data")
-GEO_CSV = os.path.join(DATA_DIR, "geo_enriched.csv")
+CLUBCYBER_ROOT = os.getenv("SITE_ROOT", os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+DATA_DIR = os.getenv("MAP_DATA_DIR", os.path.join(os.path.dirname(__file__), "..", "data"))
+WEB_DIR = os.path.join(os.path.dirname(__file__), "..", "web")
 AGG_CSV = os.path.join(DATA_DIR, "agg_by_country.csv")
+BACKLOG_JSON = os.path.join(DATA_DIR, "geo_backlog.json")  # écrit par geolocate (geo_scheduler)
 OUTPUT_HTML = os.path.join(CLUBCYBER_ROOT, "index.html")
+ASSETS_DIR = os.path.join(CLUBCYBER_ROOT, "dashboard", "assets")
+SITE_DATA_DIR = os.path.join(CLUBCYBER_ROOT, "dashboard", "data")
+
+INITIAL_ZOOM = 1.5
+INITIAL_LEVEL = int(INITIAL_ZOOM)
 
 def prepare_data():
-    """Charge et nettoie les données"""
+    """Charge le niveau de clustering de la vue initiale et les agrégats pays"""
     try:
-        df_geo = pd.read_csv(GEO_CSV)
+        # Les points sont pré-agrégés par tiles.py (un fichier par niveau de zoom)
+        if not os.path.exists(os.path.join(tiles.TILES_DIR, f"z{INITIAL_LEVEL}.json")):
+            tiles.main()
+        level = tiles.load_level(INITIAL_LEVEL)
+        points = pd.DataFrame({
+            "latitude": level["lat"],
+            "longitude": level["lon"],
+            "ip_count": level["n"],
+            "label": pd.Series(level["label"], dtype=str),  # niveau vide : colonne texte
+        })
         df_agg = pd.read_csv(AGG_CSV)
-        
-        # Nettoyage des coordonnées
-        df_geo = df_geo.dropna(subset=['latitude', 'longitude'])
-        df_geo = df_geo[
-            (df_geo['latitude'].between(-90, 90)) & 
-            (df_geo['longitude'].between(-180, 180))
-        ]
-        
-        # Agrégation par ville
-        city_data = df_geo.groupby(['city', 'country']).agg({
-            'latitude': 'mean',
-            'longitude': 'mean'
-        }).reset_index()
-        
-        # Comptage des IPs
-        ip_counts = df_geo.groupby(['city', 'country']).size().reset_index(name='ip_count')
-        city_data = city_data.merge(ip_counts, on=['city', 'country'])
-        
-        return city_data, df_agg
+        return points, df_agg
     
     except Exception as e:
         print(f"❌ Erreur préparation données: {str(e)}")
         raise
 
-def create_mapbox_figure(city_data):
+def create_mapbox_figure(points):
     """Crée la carte Mapbox style Darkmatter"""
     
     fig = go.Figure()
 
-    # Ajout des marqueurs (villes avec IPs)
+    # Ajout des marqueurs (clusters de villes avec IPs)
     fig.add_trace(go.Scattermapbox(
-        lat=city_data["latitude"],
-        lon=city_data["longitude"],
+        lat=points["latitude"],
+        lon=points["longitude"],
         mode='markers',
         marker=go.scattermapbox.Marker(
-            size=city_data["ip_count"].apply(lambda x: min(15, 5 + x/10)), # Taille dynamique plafonnée
-            color=city_data["ip_count"],
+            size=np.minimum(15, 5 + points["ip_count"] / 10), # Taille dynamique plafonnée
+            color=points["ip_count"],
             colorscale='Viridis', # Ou Custom: [[0, 'cyan'], [1, 'red']]
             showscale=False,
             opacity=0.8
         ),
-        text=city_data.apply(
-            lambda r: f"<b>{r.city} ({r.country})</b><br>IPs détectées: {r.ip_count}", axis=1
-        ),
+        text="<b>" + points["label"] + "</b><br>IPs détectées: " + points["ip_count"].astype(str),
         hoverinfo='text'
     ))
 
     # Configuration du layout Mapbox
     fig.update_layout(
         mapbox_style="carto-darkmatter",
-        mapbox_zoom=1.5,
+        mapbox_zoom=INITIAL_ZOOM,
         mapbox_center={"lat": 20, "lon": 0},
         margin={"r":0,"t":0,"l":0,"b":0},
         paper_bgcolor='rgba(0,0,0,0)',
@@ -78,137 +80,99 @@ def create_mapbox_figure(city_data):
     
     return fig
 
+def content_hash(content):
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:12]
+
+def publish_asset(filename):
+    """Copie un fichier statique de web/ sous un nom versionné par son contenu (app.<hash>.js)"""
+    with open(os.path.join(WEB_DIR, filename), encoding="utf-8") as f:
+        content = f.read()
+    stem, ext = os.path.splitext(filename)
+    name = f"{stem}.{content_hash(content)}{ext}"
+    os.makedirs(ASSETS_DIR, exist_ok=True)
+    tiles.write_if_changed(os.path.join(ASSETS_DIR, name), content)
+    # Suppression des anciennes versions
+    for old in glob.glob(os.path.join(ASSETS_DIR, f"{stem}.*{ext}")):
+        if os.path.basename(old) != name:
+            os.remove(old)
+    return f"dashboard/assets/{name}"
+
+def write_data(name, payload):
+    """Écrit un fichier de données seulement s'il a changé ; retourne sa version"""
+    content = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+    os.makedirs(SITE_DATA_DIR, exist_ok=True)
+    tiles.write_if_changed(os.path.join(SITE_DATA_DIR, name), content)
+    return content_hash(content)
+
+def load_backlog():
+    """État de la file de géolocalisation, sans l'horodatage (évite de republier à chaque exécution)"""
+    try:
+        with open(BACKLOG_JSON, encoding="utf-8") as f:
+            backlog = json.load(f)
+    except (OSError, ValueError):
+        return None
+    backlog.pop("updated", None)
+    return backlog
+
+def build_stats(df_agg):
+    """Statistiques du panneau latéral"""
+    top_countries = df_agg.sort_values(by='count', ascending=False, kind='stable').head(5)
+    return {
+        "backlog": load_backlog(),
+        "total_ips": int(df_agg['count'].sum()),
+        "countries": int(len(df_agg)),
+        "top_countries": [
+            {"country": str(c), "count": int(n)} for c, n in zip(top_countries['country'], top_countries['count'])
+        ],
+    }
+
+def figure_payload(fig):
+    """Données + layout de la carte (sans le template Plotly, inutile côté navigateur)"""
+    payload = json.loads(fig.to_json())
+    payload["layout"].pop("template", None)
+    return payload
+
+def file_version(path):
+    with open(path, encoding="utf-8") as f:
+        return content_hash(f.read())
+
+def tiles_versions():
+    versions = {}
+    for z in range(tiles.MAX_ZOOM + 1):
+        path = os.path.join(tiles.TILES_DIR, f"z{z}.json")
+        if os.path.exists(path):
+            versions[z] = file_version(path)
+    return versions
+
 def generate_dashboard_html(fig, df_agg):
-    """Génère le HTML complet du dashboard avec CSS Cyberpunk"""
-    
-    # Calcul des stats
-    total_ips = df_agg['count'].sum()
-    top_countries = df_agg.sort_values(by='count', ascending=False).head(5)
-    
-    # Génération du top 5 HTML
-    top_list_html = "".join([
-        f"<li style='display:flex; justify-content:space-between; margin-bottom:10px; border-bottom: 1px solid #1f2937; padding-bottom:5px;'>"
-        f"<span>{{row['country']}}</span><span style='color:#ff003c; font-weight:bold;'>{{row['count']}}</span>"
-        f"</li>" for _, row in top_countries.iterrows()
-    ])
-
-    plotly_div = fig.to_html(full_html=False, include_plotlyjs='cdn', config={'displayModeBar': False})
-
-    html_content = f"""
-    <!DOCTYPE html>
-    <html lang="fr">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>ClubCyber - Threat Map</title>
-        <link href="https://fonts.googleapis.com/css2?family=Orbitron:wght@400;700&family=JetBrains+Mono:wght@400;700&display=swap" rel="stylesheet">
-        <style>
-            body {{
-                margin: 0;
-                padding: 0;
-                background-color: #0d1117;
-                color: #00ff41;
-                font-family: 'JetBrains+Mono', monospace;
-                overflow: hidden;
-            }}
-            #dashboard {{
-                display: grid;
-                grid-template-columns: 350px 1fr;
-                height: 100vh;
-                width: 100vw;
-            }}
-            #sidebar {{
-                background-color: #0a0d12;
-                border-right: 2px solid #1f2937;
-                padding: 20px;
-                display: flex;
-                flex-direction: column;
-                z-index: 10;
-                box-shadow: 10px 0 20px rgba(0,0,0,0.5);
-            }}
-            h1 {{
-                font-family: 'Orbitron', sans-serif;
-                font-size: 1.5rem;
-                color: #ff003c;
-                text-transform: uppercase;
-                letter-spacing: 2px;
-                margin-top: 0;
-                border-bottom: 2px solid #ff003c;
-                padding-bottom: 10px;
-                text-shadow: 0 0 10px rgba(255, 0, 60, 0.5);
-            }}
-            .stat-box {{
-                background: #161b22;
-                padding: 15px;
-                border-radius: 8px;
-                margin-bottom: 20px;
-                border: 1px solid #30363d;
-            }}
-            .stat-label {{ color: #8b949e; font-size: 0.8rem; text-transform: uppercase; }}
-            .stat-value {{ font-size: 2rem; font-weight: bold; color: #0bc9ee; }}
-            
-            #map-container {{
-                position: relative;
-                width: 100%;
-                height: 100%;
-            }}
-            .top-countries {{
-                list-style: none;
-                padding: 0;
-                margin-top: 20px;
-                font-size: 0.9rem;
-            }}
-            .footer {{
-                margin-top: auto;
-                font-size: 0.7rem;
-                color: #484f58;
-                text-align: center;
-            }}
-            /* Customizing Plotly */
-            .js-plotly-plot {{ height: 100% !important; }}
-        </style>
-    </head>
-    <body>
-        <div id="dashboard">
-            <div id="sidebar">
-                <h1>Club-Cyber</h1>
-                <div class="stat-box">
-                    <div class="stat-label">Total IPs Malveillantes</div>
-                    <div class="stat-value">{total_ips}</div>
-                </div>
-                
-                <div class="stat-box">
-                    <div class="stat-label">Top 5 - Pays Sources</div>
-                    <ul class="top-countries">
-                        {top_list_html}
-                    </ul>
-                </div>
-
-                <div class="stat-box" style="border-color: #ff003c44;">
-                    <div class="stat-label">Status</div>
-                    <div style="color: #00ff41; font-weight:bold;">● SYSTÈME ACTIF</div>
-                </div>
-
-                <div class="footer">
-                    Généré par VisualizeV2 - © rapatt<br>
-                    ClubCyber Threat Intelligence
-                </div>
-            </div>
-            <div id="map-container">
-                {plotly_div}
-            </div>
-        </div>
-    </body>
-    </html>
-    """
-    return html_content
+    """Génère la coquille HTML statique et les fichiers de données versionnés du dashboard"""
+    files = {
+        "map.json": write_data("map.json", figure_payload(fig)),
+        "stats.json": write_data("stats.json", build_stats(df_agg)),
+        "countries.json": write_data("countries.json", df_agg[["country", "count"]].to_dict("records")),
+    }
+    # history.json est écrit par history.py ; on ne fait qu'en référencer la version
+    history_json = os.path.join(SITE_DATA_DIR, "history.json")
+    if os.path.exists(history_json):
+        files["history.json"] = file_version(history_json)
+    write_data("manifest.json", {
+        "files": files,
+        "tiles": tiles_versions(),
+        "initial_level": INITIAL_LEVEL,
+        "max_zoom": tiles.MAX_ZOOM,
+    })
+
+    with open(os.path.join(WEB_DIR, "index.html"), encoding="utf-8") as f:
+        template = f.read()
+    return template.replace("{{style}}", publish_asset("style.css")).replace("{{app}}", publish_asset("app.js"))
 
 def main():
     print("🛠️  Préparation des données...")
-    city_data, df_agg = prepare_data()
+    points, df_agg = prepare_data()
+    metrics.record_rows(rows_in=len(df_agg) + len(points))
     
     print("🌍 Création de la carte Mapbox...")
-    fig = create_mapbox_figure(city_data)
+    fig = create_mapbox_figure(points)
     
     print("🎨 Génération du Dashboard Cyberpunk...")
     html_dashboard = generate_dashboard_html(fig, df_agg)
@@ -216,8 +180,8 @@ def main():
     print(f"💾 Sauvegarde dans {OUTPUT_HTML}...")
     os.makedirs(os.path.dirname(OUTPUT_HTML), exist_ok=True)
     
-    with open(OUTPUT_HTML, "w", encoding="utf-8") as f:
-        f.write(html_dashboard)
+    if not tiles.write_if_changed(OUTPUT_HTML, html_dashboard):
+        print("📎 Coquille HTML inchangée.")
     
     print("✅ Dashboard généré avec succès!")
     print(f"📌 Emplacement: {os.path.abspath(OUTPUT_HTML)}")
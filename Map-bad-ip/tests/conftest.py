@@ -0,0 +1,46 @@
+"""
+Configuration commune des tests de Map-bad-ip : les modules de src/ sont importes
+directement (comme le fait run_all.py) et les repertoires de donnees pointent vers un
+dossier temporaire, pour qu'aucun test n'ecrive dans data/ ou dans le site.
+"""
+
+import os
+import sys
+import tempfile
+
+_SANDBOX = tempfile.mkdtemp(prefix="map-bad-ip-tests-")
+os.environ.setdefault("MAP_DATA_DIR", os.path.join(_SANDBOX, "data"))
+os.environ.setdefault("SITE_ROOT", os.path.join(_SANDBOX, "site"))
+os.makedirs(os.environ["MAP_DATA_DIR"], exist_ok=True)
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+
+import pytest  # noqa: E402
+
+
+@pytest.fixture
+def geo_csv(tmp_path, monkeypatch):
+    """
+    geo_enriched.csv vide (en-tete seul) dans tmp_path, avec le store Parquet a cote.
+    Retourne une fonction d'ajout de lignes (ip, ville[, pays[, lat, lon]]).
+    """
+    import geostore
+    from geo_writer import OUTPUT_COLUMNS
+
+    path = tmp_path / "geo_enriched.csv"
+    monkeypatch.setattr(geostore, "DATA_DIR", str(tmp_path))
+    monkeypatch.setattr(geostore, "GEO_CSV", str(path))
+    monkeypatch.setattr(geostore, "STORE_PATH", str(tmp_path / "geo_enriched.parquet"))
+    monkeypatch.setattr(geostore, "META_PATH", str(tmp_path / "geo_enriched.parquet.json"))
+    monkeypatch.setattr(geostore, "_loaded", {"key": None, "columns": {}})
+    path.write_text(",".join(OUTPUT_COLUMNS) + "\n")
+
+    def append(*rows):
+        with open(path, "a") as f:
+            for ip, city, *rest in rows:
+                country, lat, lon = (list(rest) + ["FR", 1.5, 2.5][len(rest):])[:3]
+                f.write(f"{ip},ipinfo,{lat},{lon},{city},R,{country}\n")
+
+    append.path = path
+    return append
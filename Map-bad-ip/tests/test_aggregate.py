@@ -0,0 +1,80 @@
+import pandas as pd
+import pytest
+
+import aggregate
+
+
+@pytest.fixture
+def agg(geo_csv, tmp_path, monkeypatch):
+    monkeypatch.setattr(aggregate, "DATA_DIR", str(tmp_path))
+    monkeypatch.setattr(aggregate, "INPUT_CSV", str(geo_csv.path))
+    monkeypatch.setattr(aggregate, "OUTPUT_CSV", str(tmp_path / "agg_by_country.csv"))
+    monkeypatch.setattr(aggregate, "TOP_COUNTRIES_CSV", str(tmp_path / "top_countries.csv"))
+    monkeypatch.setattr(aggregate, "CITY_CSV", str(tmp_path / "agg_by_city.csv"))
+    monkeypatch.setattr(aggregate, "STATE_PATH", str(tmp_path / "agg_state.json"))
+    monkeypatch.setattr(aggregate, "AGG_MODE", "incremental")
+    return geo_csv
+
+
+def outputs(tmp_path):
+    return (pd.read_csv(tmp_path / "agg_by_country.csv"),
+            pd.read_csv(tmp_path / "agg_by_city.csv"),
+            pd.read_csv(tmp_path / "top_countries.csv"))
+
+
+def test_empty_input(agg, tmp_path):
+    aggregate.main()
+    countries, cities, top = outputs(tmp_path)
+    assert countries.empty and cities.empty and top.empty
+
+
+def test_incremental_matches_full(agg, tmp_path, monkeypatch):
+    agg(("1.1.1.1", "Paris", "FR", 48.0, 2.0), ("2.2.2.2", "Paris", "FR", 50.0, 4.0))
+    aggregate.main()
+    agg(("3.3.3.3", "Tokyo", "JP", 35.0, 139.0), ("4.4.4.4", "Nowhere", "US", 200.0, 0.0))
+    aggregate.main()
+    incremental = outputs(tmp_path)
+
+    countries, cities, top = incremental
+    assert dict(zip(countries["country"], countries["count"])) == {"FR": 2, "JP": 1, "US": 1}
+    paris = cities[cities["city"] == "Paris"].iloc[0]
+    assert (paris["latitude"], paris["longitude"], paris["ip_count"]) == (49.0, 3.0, 2)
+    assert "Nowhere" not in cities["city"].tolist()  # coordonnees hors bornes
+    assert top["country"].iloc[0] == "FR"
+
+    for mode in ("full", "chunked"):
+        monkeypatch.setattr(aggregate, "AGG_MODE", mode)
+        monkeypatch.setattr(aggregate, "CHUNK_ROWS", 1)
+        aggregate.main()
+        for got, expected in zip(outputs(tmp_path), incremental):
+            pd.testing.assert_frame_equal(got, expected)
+
+
+def test_only_new_rows_are_folded(agg):
+    agg(("1.1.1.1", "Paris"))
+    state, rows = aggregate.aggregate_incremental()
+    aggregate.save_state(state)
+    agg(("2.2.2.2", "Lyon"))
+    state, rows = aggregate.aggregate_incremental()
+    assert rows == 1 and state["countries"] == {"FR": 2}
+
+
+def test_rewritten_csv_resets_state(agg):
+    agg(("1.1.1.1", "Paris"), ("2.2.2.2", "Lyon"))
+    aggregate.save_state(aggregate.aggregate_incremental()[0])
+    agg.path.write_text("ip,source,latitude,longitude,city,region,country\n")
+    agg(("3.3.3.3", "Tokyo", "JP"))
+    state, rows = aggregate.aggregate_incremental()
+    assert state["countries"] == {"JP": 1}
+
+
+def test_torn_last_line_waits_for_next_run(agg):
+    agg(("1.1.1.1", "Paris"))
+    with open(agg.path, "a") as f:
+        f.write("2.2.2.2,ipinfo,1.5")
+    state, rows = aggregate.aggregate_incremental()
+    assert rows == 1
+    with open(agg.path, "a") as f:
+        f.write(",2.5,Lyon,R,FR\n")
+    aggregate.save_state(state)
+    assert aggregate.aggregate_incremental()[1] == 1
@@ -0,0 +1,68 @@
+import os
+
+import pandas as pd
+import pytest
+
+import check_double_entree as dedupe
+import geostore
+from geo_writer import OUTPUT_COLUMNS
+
+
+@pytest.fixture
+def csv(geo_csv, monkeypatch):
+    monkeypatch.setattr(dedupe, "INPUT_CSV", str(geo_csv.path))
+    monkeypatch.setattr(dedupe, "CHUNK_ROWS", 2)
+    return geo_csv
+
+
+def ips(path):
+    return pd.read_csv(path, dtype=str)["ip"].tolist()
+
+
+def test_chunked_removes_duplicates_across_chunks(csv):
+    csv(("1.1.1.1", "Paris"), ("2.2.2.2", "Lyon"), ("1.1.1.1", "Paris"),
+        ("not-an-ip", "X"), ("2.2.2.2", "Lyon"), ("not-an-ip", "X"), ("3.3.3.3", "Nice"))
+    dedupe.remove_duplicates_chunked()
+    assert ips(csv.path) == ["1.1.1.1", "2.2.2.2", "not-an-ip", "3.3.3.3"]
+    assert not os.path.exists(str(csv.path) + ".tmp")
+
+
+def test_chunked_without_duplicates_keeps_file(csv):
+    csv(("1.1.1.1", "Paris"), ("2.2.2.2", "Lyon"), ("3.3.3.3", "Nice"))
+    before = os.stat(csv.path)
+    dedupe.remove_duplicates_chunked()
+    after = os.stat(csv.path)
+    assert (before.st_ino, before.st_mtime_ns) == (after.st_ino, after.st_mtime_ns)
+
+
+def test_chunked_empty_file(csv):
+    dedupe.remove_duplicates_chunked()
+    assert ips(csv.path) == []
+
+
+def test_store_mode(csv):
+    csv(("1.1.1.1", "Paris"), ("2001:db8::1", "X"), ("2.2.2.2", "Lyon"), ("1.1.1.1", "Paris"),
+        ("2001:db8::1", "X"))
+    dedupe.remove_duplicates()
+    assert ips(csv.path) == ["1.1.1.1", "2001:db8::1", "2.2.2.2"]
+    assert len(geostore.load(["ip"])) == 2
+    dedupe.remove_duplicates()  # plus de doublon : rien a reecrire
+    assert ips(csv.path) == ["1.1.1.1", "2001:db8::1", "2.2.2.2"]
+
+
+def test_modes_agree(csv, tmp_path):
+    rows = [("not-an-ip", "X"), ("0.0.0.0", "Null"), ("1.1.1.1", "Paris"), ("0.0.0.0", "Null"),
+            ("2001:db8::1", "X"), ("1.1.1.1", "Paris")]
+    csv(*rows)
+    dedupe.remove_duplicates()
+    store_result = csv.path.read_text()
+    csv.path.write_text(",".join(OUTPUT_COLUMNS) + "\n")
+    csv(*rows)
+    dedupe.remove_duplicates_chunked()
+    assert csv.path.read_text() == store_result
+    assert ips(csv.path) == ["not-an-ip", "0.0.0.0", "1.1.1.1", "2001:db8::1"]
+
+
+def test_store_mode_empty(csv):
+    dedupe.remove_duplicates()
+    assert ips(csv.path) == []
@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+
+import geo_cache
+from geo_cache import GeoCache, NEGATIVE
+from iputils import ips_to_uint32
+
+PARIS = {"source": "ipinfo", "latitude": 48.85, "longitude": 2.35, "city": "Paris", "region": "IDF", "country": "FR"}
+LYON = {"source": "ipinfo", "latitude": 45.76, "longitude": 4.84, "city": "Lyon", "region": "ARA", "country": "FR"}
+
+
+def frame(rows):
+    df = pd.DataFrame([dict(rec, ip=ip) for ip, rec in rows])
+    df["ip"] = ips_to_uint32(df["ip"])[0]
+    for col in ("source", "city", "region", "country"):
+        df[col] = df[col].astype("category")
+    return df
+
+
+def test_ip_prefix():
+    assert geo_cache.ip_prefix("1.12.246.7") == "1.12.246.0/24"
+    assert geo_cache.ip_prefix("1.2.3") is None
+    assert geo_cache.ip_prefix("1.2.3.256") is None
+
+
+def test_exact_and_negative(tmp_path):
+    cache = GeoCache(str(tmp_path / "cache.json"))
+    cache.put("1.2.3.4", PARIS, now=1000)
+    cache.put("5.6.7.8", None, now=1000)
+    assert cache.get("1.2.3.4", now=1001)["city"] == "Paris"
+    assert cache.get("5.6.7.8", now=1001) is NEGATIVE
+    assert cache.get("5.6.7.8", now=1000 + geo_cache.NEGATIVE_TTL + 1) is None
+
+
+def test_prefix_requires_agreement(tmp_path):
+    cache = GeoCache(str(tmp_path / "cache.json"))
+    cache.put("1.2.3.1", PARIS, now=1000)
+    assert cache.get("1.2.3.9", now=1001) is None  # une seule observation
+    cache.put("1.2.3.2", PARIS, now=1000)
+    assert cache.get("1.2.3.9", now=1001)["source"] == "prefix_cache"
+    cache.put("1.2.3.3", LYON, now=1000)
+    assert cache.get("1.2.3.9", now=1001) is None  # localisation plus assez majoritaire
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / "cache.json")
+    cache = GeoCache(path)
+    cache.put("1.2.3.4", PARIS)
+    cache.save()
+    assert GeoCache.load(path).get("1.2.3.4")["city"] == "Paris"
+
+
+def test_load_corrupt_file(tmp_path):
+    path = tmp_path / "cache.json"
+    path.write_text("{not json")
+    assert len(GeoCache.load(str(path))) == 0
+
+
+def test_warm_matches_put(tmp_path):
+    rows = [("1.2.3.1", PARIS), ("1.2.3.2", PARIS), ("1.2.4.3", dict(PARIS, city=None)),
+            ("9.9.9.9", dict(LYON, latitude=np.nan)), ("8.8.8.8", dict(LYON, source="prefix_cache"))]
+    warmed = GeoCache(str(tmp_path / "a.json"))
+    warmed.warm(frame(rows), now=1000)
+    expected = GeoCache(str(tmp_path / "b.json"))
+    for ip, rec in rows:
+        if not np.isnan(rec["latitude"]):
+            expected.put(ip, rec, now=1000)
+    assert dict(warmed.exact) == dict(expected.exact)
+    assert dict(warmed.prefix) == dict(expected.prefix)
+    assert warmed.get("1.2.3.200", now=1001)["city"] == "Paris"
+
+
+def test_warm_keeps_most_recent(tmp_path, monkeypatch):
+    monkeypatch.setattr(geo_cache, "MAX_EXACT", 2)
+    monkeypatch.setattr(geo_cache, "MAX_PREFIX", 1)
+    cache = GeoCache(str(tmp_path / "cache.json"))
+    cache.warm(frame([("1.1.1.1", PARIS), ("2.2.2.2", PARIS), ("3.3.3.3", LYON)]), now=1000)
+    assert list(cache.exact) == ["2.2.2.2", "3.3.3.3"]
+    assert list(cache.prefix) == ["3.3.3.0/24"]
+
+
+def test_warm_empty(tmp_path):
+    cache = GeoCache(str(tmp_path / "cache.json"))
+    cache.warm(frame([("1.1.1.1", dict(PARIS, latitude=None))]))
+    assert len(cache) == 0 and not cache.prefix
+
+
+def test_save_only_when_changed(tmp_path):
+    path = str(tmp_path / "cache" / "cache.json")
+    cache = GeoCache(path)
+    assert not cache.save()
+    cache.put("1.2.3.4", PARIS)
+    assert cache.save()
+    loaded = GeoCache.load(path)
+    loaded.get("1.2.3.4")
+    assert not loaded.save()
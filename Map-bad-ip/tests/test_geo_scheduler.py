@@ -0,0 +1,116 @@
+import calendar
+import json
+import time
+
+import numpy as np
+
+import geo_scheduler
+from geo_scheduler import GeoQueue, Quota, Deadline, billing_period, save_quotas, load_quota_state, write_backlog
+from geo_scheduler import FRESH, UNRESOLVED_NETWORK, BACKLOG
+
+NOW = calendar.timegm((2026, 3, 15, 12, 0, 0))
+DAY = 86400
+
+
+def keys(*values):
+    return np.array(values, dtype=np.uint32)
+
+
+def test_queue_sync_keeps_entry_dates(tmp_path):
+    queue = GeoQueue(str(tmp_path / "queue.npz"))
+    assert queue.sync(keys(5, 1, 1), NOW - DAY) == 2
+    assert queue.sync(keys(1, 9), NOW) == 1
+    assert queue.ips.tolist() == [1, 9]
+    assert queue.queued_at.tolist() == [NOW - DAY, NOW]
+
+
+def test_queue_save_and_load(tmp_path):
+    path = str(tmp_path / "queue.npz")
+    queue = GeoQueue(path)
+    queue.sync(keys(1, 2), NOW)
+    queue.record_failures(keys(2, 7))
+    queue.save()
+    loaded = GeoQueue.load(path)
+    assert loaded.ips.tolist() == [1, 2]
+    assert loaded.attempts.tolist() == [0, 1]
+    assert len(GeoQueue.load(str(tmp_path / "absent.npz"))) == 0
+
+
+def test_queue_order(tmp_path):
+    queue = GeoQueue(str(tmp_path / "queue.npz"))
+    old = NOW - 10 * DAY
+    known_net, new_net = 0x01020300, 0x05060700
+    queue.sync(keys(known_net + 1, known_net + 2, new_net + 1), old)
+    queue.sync(keys(known_net + 1, known_net + 2, new_net + 1, known_net + 3), NOW)
+    todo = keys(known_net + 1, known_net + 2, new_net + 1, known_net + 3)
+    resolved = keys(known_net >> geo_scheduler.PREFIX_BITS)
+    prio, _, _ = queue.priorities(todo, resolved, NOW)
+    assert prio.tolist() == [BACKLOG, BACKLOG, UNRESOLVED_NETWORK, FRESH]
+    # a priorite egale, la plus tardive dans ips.csv passe en premier
+    assert queue.order(todo, resolved, NOW).tolist() == [3, 2, 1, 0]
+
+
+def test_queue_order_empty(tmp_path):
+    queue = GeoQueue(str(tmp_path / "queue.npz"))
+    assert queue.order(keys(), keys(), NOW).tolist() == []
+
+
+def test_billing_period():
+    start, end = billing_period(NOW, day=1)
+    assert start == calendar.timegm((2026, 3, 1, 0, 0, 0))
+    assert end == calendar.timegm((2026, 4, 1, 0, 0, 0))
+    start, end = billing_period(calendar.timegm((2026, 1, 10, 0, 0, 0)), day=20)
+    assert start == calendar.timegm((2025, 12, 20, 0, 0, 0))
+    assert end == calendar.timegm((2026, 1, 20, 0, 0, 0))
+    # jour absent du mois : dernier jour du mois
+    assert billing_period(calendar.timegm((2026, 3, 1, 0, 0, 0)), day=31)[0] == calendar.timegm((2026, 2, 28, 0, 0, 0))
+
+
+def test_quota_allowance(monkeypatch):
+    monkeypatch.setattr(geo_scheduler, "BILLING_DAY", 1)
+    start, end = billing_period(NOW)
+    runs_left = -(-(end - NOW) // geo_scheduler.RUN_INTERVAL_SECONDS)
+    quota = Quota("ipinfo", 10000, {"ipinfo": {"period_start": start, "used": 4000}}, NOW)
+    assert quota.allowance == -(-6000 // runs_left)
+    stale = Quota("ipinfo", 10000, {"ipinfo": {"period_start": start - DAY, "used": 9999}}, NOW)
+    assert stale.used == 0
+
+
+def test_quota_consume_and_unlimited():
+    quota = Quota("ipinfo", 1, {}, NOW)
+    assert quota.available()
+    quota.consume()
+    assert not quota.available()
+    unlimited = Quota("mistral", 0, {}, NOW)
+    unlimited.consume(10 ** 6)
+    assert unlimited.available() and unlimited.to_dict()["run_allowance"] is None
+
+
+def test_save_quotas_merges_state(tmp_path):
+    path = str(tmp_path / "quota.json")
+    save_quotas([Quota("ipinfo", 100, {}, NOW)], path)
+    save_quotas([Quota("mistral", 50, {}, NOW)], path)
+    assert set(load_quota_state(path)) == {"ipinfo", "mistral"}
+    (tmp_path / "broken.json").write_text("{")
+    assert load_quota_state(str(tmp_path / "broken.json")) == {}
+
+
+def test_deadline():
+    assert not Deadline(0).expired()
+    assert Deadline(-1).remaining() == float("inf")
+    deadline = Deadline(0.001)
+    time.sleep(0.002)
+    assert deadline.expired()
+
+
+def test_write_backlog(tmp_path):
+    path = str(tmp_path / "backlog.json")
+    queue = GeoQueue(str(tmp_path / "queue.npz"))
+    queue.sync(keys(1, 2), NOW - 3 * DAY)
+    payload = write_backlog(queue, queue.ips, keys(), [Quota("ipinfo", 100, {}, NOW)], NOW, "deadline", path)
+    with open(path) as f:
+        assert json.load(f) == payload
+    assert payload["pending"] == 2 and payload["stopped_by"] == "deadline"
+    assert payload["oldest_queued_at"] == NOW - 3 * DAY
+    empty = write_backlog(queue, keys(), keys(), [], NOW, path=path)
+    assert empty["pending"] == 0 and empty["oldest_queued_at"] is None
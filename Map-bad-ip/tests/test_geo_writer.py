@@ -0,0 +1,128 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import geo_writer
+from geo_writer import GeoWriter, DoneIndex, OUTPUT_COLUMNS, repair_tail, read_rows_since
+from iputils import ips_to_uint32
+
+
+@pytest.fixture
+def csv_path(tmp_path):
+    path = tmp_path / "geo_enriched.csv"
+    path.write_text(",".join(OUTPUT_COLUMNS) + "\n")
+    return str(path)
+
+
+def rec(ip, city="Paris"):
+    return {"ip": ip, "source": "ipinfo", "latitude": 1.0, "longitude": 2.0, "city": city, "region": "R", "country": "FR"}
+
+
+def csv_ips(path):
+    return pd.read_csv(path)["ip"].tolist()
+
+
+def test_buffered_until_flush_rows(csv_path):
+    writer = GeoWriter(csv_path, flush_rows=3, flush_seconds=3600)
+    writer.write(rec("1.1.1.1"))
+    writer.write(rec("2.2.2.2"))
+    assert csv_ips(csv_path) == []
+    writer.write(rec("3.3.3.3"))
+    assert csv_ips(csv_path) == ["1.1.1.1", "2.2.2.2", "3.3.3.3"]
+    assert writer.written == 3 and writer.buffer == []
+
+
+def test_context_manager_flushes_on_exception(csv_path):
+    with pytest.raises(RuntimeError):
+        with GeoWriter(csv_path, flush_rows=100, flush_seconds=3600) as writer:
+            writer.write(rec("1.1.1.1"))
+            raise RuntimeError("interruption")
+    assert csv_ips(csv_path) == ["1.1.1.1"]
+
+
+def test_done_index_is_incremental(csv_path):
+    with GeoWriter(csv_path, flush_rows=1) as writer:
+        writer.write(rec("1.1.1.1"))
+    index = DoneIndex(csv_path)
+    assert index.load().tolist() == [0x01010101]
+    # ligne ajoutee par un autre ecrivain : seule la fin du CSV est relue
+    with open(csv_path, "a") as f:
+        f.write("2.2.2.2,ipinfo,1,2,Lyon,R,FR\n")
+    assert index.load().tolist() == [0x01010101, 0x02020202]
+    assert os.path.getsize(index.index_path) == 8
+
+
+def test_done_index_empty_csv(csv_path):
+    assert DoneIndex(csv_path).load().tolist() == []
+
+
+def test_torn_tail_is_repaired_on_resume(csv_path):
+    with GeoWriter(csv_path, flush_rows=1) as writer:
+        writer.write(rec("1.1.1.1"))
+    with open(csv_path, "a") as f:
+        f.write("2.2.2.2,ipinfo,1.0")  # crash au milieu d'une ligne
+    assert DoneIndex(csv_path).load().tolist() == [0x01010101]  # ligne incomplete ignoree
+    with GeoWriter(csv_path, flush_rows=1) as writer:
+        writer.write(rec("2.2.2.2"))
+    assert csv_ips(csv_path) == ["1.1.1.1", "2.2.2.2"]
+    assert DoneIndex(csv_path).load().tolist() == [0x01010101, 0x02020202]
+
+
+def test_repair_tail_without_any_newline(tmp_path):
+    path = tmp_path / "torn.csv"
+    path.write_text("ip,sou")
+    repair_tail(str(path))
+    assert path.read_text() == ""
+    repair_tail(str(tmp_path / "absent.csv"))
+
+
+def test_rewritten_csv_rebuilds_index(csv_path):
+    with GeoWriter(csv_path, flush_rows=1) as writer:
+        writer.write(rec("1.1.1.1"))
+        writer.write(rec("2.2.2.2"))
+    DoneIndex(csv_path).load()
+    with open(csv_path, "w") as f:  # dedoublonnage / reecriture
+        f.write(",".join(OUTPUT_COLUMNS) + "\n3.3.3.3,ipinfo,1,2,Nice,R,FR\n")
+    assert DoneIndex(csv_path).load().tolist() == [0x03030303]
+
+
+def test_index_tail_without_watermark_is_dropped(csv_path):
+    with GeoWriter(csv_path, flush_rows=1) as writer:
+        writer.write(rec("1.1.1.1"))
+    index = DoneIndex(csv_path)
+    with open(index.index_path, "ab") as f:  # crash entre l'index et son filigrane
+        f.write(np.array([7], dtype=np.uint32).tobytes())
+    with open(csv_path, "a") as f:
+        f.write("2.2.2.2,ipinfo,1,2,Lyon,R,FR\n")
+    assert index.load().tolist() == [0x01010101, 0x02020202]
+    assert np.fromfile(index.index_path, dtype=np.uint32).tolist() == [0x01010101, 0x02020202]
+
+
+def test_partial_write_is_rolled_back(csv_path, monkeypatch):
+    real_write = os.write
+
+    def short_write(fd, data):
+        return real_write(fd, data[:10])
+
+    writer = GeoWriter(csv_path, flush_rows=100)
+    writer.write(rec("1.1.1.1"))
+    with monkeypatch.context() as m:
+        m.setattr(geo_writer.os, "write", short_write)
+        with pytest.raises(OSError):
+            writer.flush()
+    assert writer.buffer and csv_ips(csv_path) == []
+    writer.flush()
+    assert csv_ips(csv_path) == ["1.1.1.1"]
+    assert DoneIndex(csv_path).load().tolist() == [0x01010101]
+
+
+def test_read_rows_since(csv_path):
+    with GeoWriter(csv_path, flush_rows=1) as writer:
+        writer.write(rec("1.1.1.1"))
+    df, offset = read_rows_since(csv_path, 0)
+    assert df["ip"].tolist() == ["1.1.1.1"] and offset == os.path.getsize(csv_path)
+    df, same = read_rows_since(csv_path, offset)
+    assert df.empty and same == offset
+    assert ips_to_uint32(df["ip"])[0].tolist() == []
@@ -0,0 +1,73 @@
+import os
+import sys
+
+import pytest
+
+import geoip_db
+from geoip_db import GeoIPDatabase, open_database
+
+DBIP = """1.0.0.0,1.0.0.255,OC,AU,Queensland,Brisbane,-27.4679,153.028
+1.0.4.0,1.0.7.255,OC,AU,Victoria,Melbourne,-37.814,144.963
+2.0.0.0,2.0.0.255,EU,FR,,,,
+2001:db8::,2001:db8::ffff,EU,FR,Ile-de-France,Paris,48.85,2.35
+"""
+
+IP2LOCATION = """16777216,16777471,AU,Australia,Queensland,Brisbane,-27.4679,153.028
+16778240,16779263,AU,Australia,Victoria,Melbourne,-37.814,144.963
+"""
+
+
+@pytest.fixture
+def dbip(tmp_path):
+    path = tmp_path / "dbip-city-lite.csv"
+    path.write_text(DBIP)
+    return str(path)
+
+
+def test_resolve_dbip(dbip):
+    db = GeoIPDatabase(dbip)
+    assert len(db) == 3  # la plage IPv6 est ignoree
+    hits = db.resolve(["1.0.0.7", "1.0.5.1", "1.0.3.1", "2.0.0.1", "0.0.0.1", "9.9.9.9", "bad"])
+    assert set(hits) == {"1.0.0.7", "1.0.5.1"}
+    assert hits["1.0.5.1"] == {"ip": "1.0.5.1", "source": "geoip_db", "latitude": -37.814, "longitude": 144.963,
+                               "city": "Melbourne", "region": "Victoria", "country": "AU"}
+
+
+def test_resolve_ip2location(tmp_path):
+    path = tmp_path / "IP2LOCATION-LITE-DB5.CSV"
+    path.write_text(IP2LOCATION)
+    hits = GeoIPDatabase(str(path)).resolve(["1.0.0.1", "1.0.4.9", "1.0.2.0"])
+    assert {ip: rec["city"] for ip, rec in hits.items()} == {"1.0.0.1": "Brisbane", "1.0.4.9": "Melbourne"}
+
+
+def test_resolve_empty_batch(dbip):
+    assert GeoIPDatabase(dbip).resolve([]) == {}
+
+
+def test_recompiles_when_source_changes(dbip):
+    GeoIPDatabase(dbip)
+    with open(dbip, "a") as f:
+        f.write("5.5.5.0,5.5.5.255,EU,DE,Berlin,Berlin,52.52,13.40\n")
+    os.utime(dbip, (1, 1))
+    assert "5.5.5.5" in GeoIPDatabase(dbip).resolve(["5.5.5.5"])
+
+
+def test_interrupted_compile_is_redone(dbip):
+    db = GeoIPDatabase(dbip)
+    os.remove(os.path.join(db.index_dir, "meta.json"))
+    os.remove(os.path.join(db.index_dir, "start.npy"))
+    assert "1.0.0.1" in GeoIPDatabase(dbip).resolve(["1.0.0.1"])
+
+
+def test_open_database_missing_or_broken(tmp_path):
+    assert open_database("") is None
+    assert open_database(str(tmp_path / "absent.csv")) is None
+    empty = tmp_path / "empty.csv"
+    empty.write_text("")
+    assert open_database(str(empty)) is None
+
+
+def test_mmdb_requires_optional_package(tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, "maxminddb", None)
+    with pytest.raises(RuntimeError, match="maxminddb"):
+        geoip_db._read_mmdb_ranges(str(tmp_path / "GeoLite2-City.mmdb"))
@@ -0,0 +1,201 @@
+import json
+import os
+import shutil
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import geo_writer
+import geolocate
+import geostore
+from geo_scheduler import GeoQueue
+
+
+@pytest.fixture
+def data_dir(monkeypatch):
+    """
+    Repertoire de donnees vide (MAP_DATA_DIR du bac a sable) et fournisseurs simules.
+    """
+    path = os.environ["MAP_DATA_DIR"]
+    shutil.rmtree(path)
+    os.makedirs(path)
+    monkeypatch.setattr(geostore, "_loaded", {"key": None, "columns": {}})
+    monkeypatch.setattr(geolocate, "IPINFO_TOKEN", "token")
+    monkeypatch.setattr(geolocate, "IPINFO_MONTHLY_QUOTA", 0)
+    monkeypatch.setattr(geolocate, "IPINFO_DELAY", 0)
+    monkeypatch.setattr(geolocate, "MISTRAL_API_KEY", "")
+    monkeypatch.setattr(geolocate, "open_database", lambda path: None)
+    monkeypatch.setattr(geolocate, "notify_discord", lambda message: None)
+    monkeypatch.setattr(geolocate, "enrich_ip", lambda ip, local_hits=None: {
+        "ip": ip, "source": "ipinfo", "latitude": 1.0, "longitude": 2.0,
+        "city": "Paris", "region": "IDF", "country": "FR"})
+    return path
+
+
+def write_ips(path, ips):
+    with open(os.path.join(path, "ips.csv"), "w") as f:
+        f.write("".join(f"{ip}\n" for ip in ips))
+
+
+def queued(path):
+    return GeoQueue.load(os.path.join(path, "geo_queue.npz")).ips
+
+
+def test_no_input(data_dir):
+    geolocate.main()
+    assert pd.read_csv(geolocate.OUTPUT_CSV).empty
+
+
+def test_enriches_each_ip_once(data_dir):
+    write_ips(data_dir, ["1.1.1.1", "2.2.2.2", "1.1.1.1", "bad"])
+    geolocate.main()
+    assert sorted(pd.read_csv(geolocate.OUTPUT_CSV)["ip"]) == ["1.1.1.1", "2.2.2.2"]
+    assert len(queued(data_dir)) == 0
+    geolocate.main()  # rien de nouveau
+    assert len(pd.read_csv(geolocate.OUTPUT_CSV)) == 2
+
+
+def test_failed_writes_stay_queued(data_dir, monkeypatch):
+    write_ips(data_dir, ["1.1.1.1", "2.2.2.2", "3.3.3.3"])
+
+    def broken_write(fd, data):
+        raise OSError("disque plein")
+
+    with monkeypatch.context() as m:
+        m.setattr(geo_writer.os, "write", broken_write)
+        with pytest.raises(OSError):
+            geolocate.main()
+    assert pd.read_csv(geolocate.OUTPUT_CSV).empty
+    assert len(queued(data_dir)) == 3
+
+    geolocate.main()
+    assert sorted(pd.read_csv(geolocate.OUTPUT_CSV)["ip"]) == ["1.1.1.1", "2.2.2.2", "3.3.3.3"]
+    assert len(queued(data_dir)) == 0
+
+
+def test_deadline_keeps_rest_queued(data_dir, monkeypatch):
+    write_ips(data_dir, ["1.1.1.1", "2.2.2.2"])
+    monkeypatch.setattr(geolocate, "GEO_DEADLINE_SECONDS", 1e-9)
+    geolocate.main()
+    assert np.array_equal(queued(data_dir), np.array([0x01010101, 0x02020202], dtype=np.uint32))
+
+
+def reply(*records, fenced=False, wrapped=True):
+    text = json.dumps({"results": list(records)} if wrapped else list(records))
+    return f"```json\n{text}\n```" if fenced else text
+
+
+def record(ip, lat=48.85, lon=2.35, country="FR"):
+    return {"ip": ip, "latitude": lat, "longitude": lon, "city": "Paris", "region": "IDF", "country": country}
+
+
+class StubMistral:
+    """
+    Client Mistral simule : `answer(ips)` fournit le texte de la reponse a chaque lot.
+    """
+
+    def __init__(self, answer):
+        self.answer = answer
+        self.batches = []
+        self.chat = self
+
+    def complete(self, model, messages, response_format):
+        ips = messages[-1]["content"].split("\n")
+        self.batches.append(ips)
+        content = self.answer(ips)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+class StubQuota:
+    def __init__(self, units):
+        self.units = units
+
+    def available(self, units=1):
+        return self.units >= units
+
+    def consume(self, units=1):
+        self.units -= units
+
+
+@pytest.mark.parametrize("fenced", [False, True])
+@pytest.mark.parametrize("wrapped", [False, True])
+def test_parse_mistral_results(fenced, wrapped):
+    text = reply(record("1.1.1.1"), record("2.2.2.2"), fenced=fenced, wrapped=wrapped)
+    assert [r["ip"] for r in geolocate.parse_mistral_results(text)] == ["1.1.1.1", "2.2.2.2"]
+
+
+def test_parse_mistral_single_object_and_garbage():
+    assert geolocate.parse_mistral_results(json.dumps(record("1.1.1.1"))) == [record("1.1.1.1")]
+    with pytest.raises(ValueError):
+        geolocate.parse_mistral_results('"Paris"')
+    with pytest.raises(ValueError):
+        geolocate.parse_mistral_results("je ne sais pas")
+
+
+@pytest.mark.parametrize("rec", [
+    record("1.1.1.1", lat=91),
+    record("1.1.1.1", lon=-180.5),
+    record("1.1.1.1", lat=0, lon=0),
+    record("1.1.1.1", lat="nord"),
+    record("1.1.1.1", country="France"),
+    record("1.1.1.1", country="F1"),
+    record("1.1.1.1", country=None),
+    "1.1.1.1",
+])
+def test_validate_record_rejects(rec):
+    assert geolocate.validate_record(rec) is None
+
+
+def test_validate_record_normalizes():
+    rec = geolocate.validate_record(dict(record(" 1.1.1.1 ", lat="48.85", country="fr"), city=""))
+    assert rec == {"ip": "1.1.1.1", "source": "ai", "latitude": 48.85, "longitude": 2.35,
+                   "city": None, "region": "IDF", "country": "FR"}
+
+
+def test_mistral_retries_only_missing_or_invalid(monkeypatch):
+    monkeypatch.setattr(geolocate, "MISTRAL_BATCH_SIZE", 10)
+    monkeypatch.setattr(geolocate, "MISTRAL_MAX_RETRIES", 2)
+    rounds = []
+
+    def answer(ips):
+        rounds.append(ips)
+        if len(rounds) == 1:  # 3.3.3.3 absente, 2.2.2.2 en (0, 0), IP hors lot ignoree
+            return reply(record("1.1.1.1"), record("2.2.2.2", lat=0, lon=0), record("9.9.9.9"))
+        return reply(*(record(ip) for ip in ips), fenced=True, wrapped=False)
+
+    results, attempted = geolocate.mistral_fallback(["1.1.1.1", "2.2.2.2", "3.3.3.3"], StubMistral(answer))
+    assert rounds == [["1.1.1.1", "2.2.2.2", "3.3.3.3"], ["2.2.2.2", "3.3.3.3"]]
+    assert sorted(results) == ["1.1.1.1", "2.2.2.2", "3.3.3.3"]
+    assert attempted == {"1.1.1.1", "2.2.2.2", "3.3.3.3"}
+
+
+def test_mistral_gives_up_after_retries(monkeypatch):
+    monkeypatch.setattr(geolocate, "MISTRAL_MAX_RETRIES", 1)
+    client = StubMistral(lambda ips: "pas du JSON")
+    results, attempted = geolocate.mistral_fallback(["1.1.1.1"], client)
+    assert results == {} and attempted == {"1.1.1.1"}
+    assert len(client.batches) == 2
+
+
+def test_mistral_quota_cutoff(monkeypatch):
+    monkeypatch.setattr(geolocate, "MISTRAL_BATCH_SIZE", 2)
+    ips = [f"10.0.0.{i}" for i in range(1, 6)]
+    client = StubMistral(lambda batch: reply(*(record(ip) for ip in batch)))
+    quota = StubQuota(2)
+    results, attempted = geolocate.mistral_fallback(ips, client, quota=quota)
+    assert client.batches == [ips[:2], ips[2:4]]
+    assert attempted == set(ips[:4]) and sorted(results) == ips[:4]
+    assert quota.units == 0
+
+
+def test_mistral_deadline_cutoff(monkeypatch):
+    monkeypatch.setattr(geolocate, "MISTRAL_BATCH_SIZE", 2)
+    ips = [f"10.0.0.{i}" for i in range(1, 6)]
+    client = StubMistral(lambda batch: reply(*(record(ip) for ip in batch[:1])))
+    deadline = SimpleNamespace(expired=lambda: len(client.batches) >= 3)
+    results, attempted = geolocate.mistral_fallback(ips, client, deadline=deadline)
+    assert client.batches == [ips[:2], ips[2:4], ips[4:]]
+    # echeance atteinte avant le tour de reprise : les IP sans reponse ne sont pas resoumises
+    assert attempted == set(ips) and sorted(results) == [ips[0], ips[2], ips[4]]
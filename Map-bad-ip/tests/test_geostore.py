@@ -0,0 +1,130 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import geostore
+from geo_writer import OUTPUT_COLUMNS
+
+pytestmark = pytest.mark.skipif(not geostore.HAS_PARQUET, reason="pyarrow absent")
+
+
+@pytest.fixture
+def store(geo_csv):
+    return geo_csv.path.parent
+
+
+def append_rows(path, rows):
+    with open(path / "geo_enriched.csv", "a") as f:
+        for ip, city in rows:
+            f.write(f"{ip},ipinfo,1.5,2.5,{city},R,FR\n")
+
+
+def parts(path):
+    return sorted(p for p in os.listdir(path) if p.startswith(geostore.PART_PREFIX))
+
+
+def test_empty_store(store):
+    df = geostore.load(["ip", "city"])
+    assert df.empty and df["ip"].dtype == np.uint32
+
+
+def test_no_csv_at_all(store):
+    os.remove(store / "geo_enriched.csv")
+    assert geostore.load(["ip"]).empty
+
+
+def test_sync_appends_delta_parts(store):
+    append_rows(store, [("1.1.1.1", "Paris")])
+    geostore.load()
+    base_mtime = os.stat(geostore.STORE_PATH).st_mtime_ns
+    append_rows(store, [("2.2.2.2", "Lyon"), ("bad", "Nowhere")])
+    df = geostore.load()
+    assert df["ip"].tolist() == [0x01010101, 0x02020202]
+    assert df["city"].dtype == "category" and df["city"].tolist() == ["Paris", "Lyon"]
+    assert len(parts(store)) == 1
+    assert os.stat(geostore.STORE_PATH).st_mtime_ns == base_mtime  # base non reecrite
+
+
+def test_cached_columns_follow_new_parts(store):
+    append_rows(store, [("1.1.1.1", "Paris")])
+    assert geostore.load(["ip"])["ip"].tolist() == [0x01010101]
+    append_rows(store, [("2.2.2.2", "Lyon")])
+    assert geostore.load(["ip"])["ip"].tolist() == [0x01010101, 0x02020202]
+    assert geostore.load(["ip", "city"])["city"].tolist() == ["Paris", "Lyon"]
+
+
+def test_compaction(store, monkeypatch):
+    monkeypatch.setattr(geostore, "MAX_PARTS", 2)
+    for i in range(1, 4):  # base + 2 deltas
+        append_rows(store, [(f"10.0.0.{i}", "Paris")])
+        geostore.sync()
+    assert len(parts(store)) == 2
+    append_rows(store, [("10.0.0.4", "Paris")])
+    geostore.sync()
+    assert parts(store) == []
+    assert len(pd.read_parquet(geostore.STORE_PATH)) == 4
+    assert len(geostore.load()) == 4
+
+
+def test_stale_part_is_ignored(store):
+    append_rows(store, [("1.1.1.1", "Paris")])
+    geostore.sync()
+    # delta ecrit mais filigrane non mis a jour (arret brutal)
+    pd.DataFrame({"ip": np.array([9], dtype=np.uint32)}).to_parquet(store / f"{geostore.PART_PREFIX}999.parquet")
+    append_rows(store, [("2.2.2.2", "Lyon")])
+    assert geostore.load(["ip"])["ip"].tolist() == [0x01010101, 0x02020202]
+    geostore.compact()
+    assert parts(store) == []
+
+
+def test_rewritten_csv_triggers_rebuild(store):
+    append_rows(store, [("1.1.1.1", "Paris"), ("2.2.2.2", "Lyon")])
+    geostore.sync()
+    append_rows(store, [("3.3.3.3", "Nice")])
+    geostore.sync()
+    (store / "geo_enriched.csv").write_text(",".join(OUTPUT_COLUMNS) + "\n")
+    append_rows(store, [("4.4.4.4", "Brest")])
+    assert geostore.load(["city"])["city"].tolist() == ["Brest"]
+    assert parts(store) == []
+
+
+def test_missing_part_triggers_rebuild(store):
+    append_rows(store, [("1.1.1.1", "Paris")])
+    geostore.sync()
+    append_rows(store, [("2.2.2.2", "Lyon")])
+    geostore.sync()
+    os.remove(store / parts(store)[0])
+    assert len(geostore.load()) == 2
+
+
+def test_export_round_trip(store):
+    append_rows(store, [("1.1.1.1", "Paris"), ("2.2.2.2", "Lyon")])
+    out = store / "export.csv"
+    geostore.export_csv(str(out))
+    assert pd.read_csv(out)["ip"].tolist() == ["1.1.1.1", "2.2.2.2"]
+
+
+def test_concurrent_loads_share_one_sync(store):
+    """Etapes paralleles de run_all (aggregate et lookup) : une seule synchronisation."""
+    geostore.load(["ip"])
+    errors, results = [], []
+
+    def worker():
+        try:
+            results.append(len(geostore.load(["ip", "city"])))
+        except Exception as e:  # noqa: BLE001
+            errors.append(e)
+
+    for trial in range(5):
+        append_rows(store, [(f"10.0.{trial}.{i}", "Lyon") for i in range(50)])
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    assert errors == []
+    assert results[-4:] == [250] * 4
+    assert len(parts(store)) == 5
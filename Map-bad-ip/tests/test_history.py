@@ -0,0 +1,105 @@
+import json
+
+import pytest
+
+import history
+
+T0 = 1_700_000_000 - 1_700_000_000 % history.DAY
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(history, "HISTORY_DIR", str(tmp_path / "history"))
+    monkeypatch.setattr(history, "AGG_CSV", str(tmp_path / "agg_by_country.csv"))
+    monkeypatch.setattr(history, "DASHBOARD_JSON", str(tmp_path / "site" / "history.json"))
+    return tmp_path
+
+
+def snap(t, countries, new=0):
+    return {"t": t, "total": sum(countries.values()), "new": new, "countries": countries}
+
+
+def encoded(snaps, every=history.KEYFRAME_EVERY):
+    lines, prev = [], None
+    for i, s in enumerate(snaps):
+        lines.append(json.dumps(history.encode(s, None if i % every == 0 else prev)))
+        prev = s
+    return lines
+
+
+def test_encode_decode_roundtrip():
+    snaps = [snap(T0, {"FR": 2}), snap(T0 + 60, {"FR": 2, "JP": 1}, 1), snap(T0 + 120, {"JP": 4}, 3)]
+    assert history.decode(encoded(snaps)) == snaps
+    assert history.decode(encoded(snaps, every=1)) == snaps
+
+
+def test_delta_drops_countries_back_to_zero():
+    delta = history.encode(snap(T0 + 60, {"JP": 1}), snap(T0, {"FR": 2, "JP": 1}))
+    assert delta == {"dt": 60, "dtotal": -2, "new": 0, "dc": {"FR": -2}}
+
+
+def test_empty_store(store):
+    assert history.read_tier("raw") == []
+    assert history.query() == []
+    assert history.roll_up("raw", "hourly", 0, history.HOUR, T0) == 0
+
+
+def test_keyframes_every_n_appends(store, monkeypatch):
+    monkeypatch.setattr(history, "KEYFRAME_EVERY", 3)
+    snaps = [snap(T0 + 60 * i, {"FR": i + 1}) for i in range(7)]
+    for s in snaps:
+        history.append_raw(s)
+    with open(history.tier_path("raw")) as f:
+        frames = [i for i, line in enumerate(f) if '"c"' in line]
+    assert frames == [0, 3, 6]
+    assert history.read_tier("raw") == snaps
+
+
+def test_interrupted_append_is_ignored_then_repaired(store):
+    history.append_raw(snap(T0, {"FR": 1}))
+    with open(history.tier_path("raw"), "a") as f:
+        f.write('{"dt":60,"dto')  # crash au milieu d'une ecriture
+    assert history.read_tier("raw") == [snap(T0, {"FR": 1})]
+    history.append_raw(snap(T0 + 60, {"FR": 3}, 2))
+    assert history.read_tier("raw") == [snap(T0, {"FR": 1}), snap(T0 + 60, {"FR": 3}, 2)]
+
+
+def test_roll_up_downsamples_old_snapshots(store):
+    for i in range(6):  # deux heures, trois captures chacune
+        history.append_raw(snap(T0 + i * 1200, {"FR": i + 1}, new=1))
+    recent = snap(T0 + 3 * history.HOUR, {"FR": 10}, new=4)
+    history.append_raw(recent)
+    moved = history.roll_up("raw", "hourly", history.HOUR, history.HOUR, T0 + 4 * history.HOUR)
+    assert moved == 6
+    assert history.read_tier("raw") == [recent]
+    hourly = history.read_tier("hourly")
+    assert [(s["t"], s["total"], s["new"]) for s in hourly] == [(T0, 3, 3), (T0 + history.HOUR, 6, 3)]
+    # les niveaux ne se chevauchent pas : la serie complete reste ordonnee et sans doublon
+    assert [s["t"] for s in history.query()] == [T0, T0 + history.HOUR, recent["t"]]
+
+
+def test_query_filters_range_and_countries(store):
+    for i in range(3):
+        history.append_raw(snap(T0 + i * 60, {"FR": 1, "JP": i}))
+    out = history.query(start=T0 + 60, countries=["JP"])
+    assert [s["countries"] for s in out] == [{"JP": 1}, {"JP": 2}]
+
+
+def test_snapshot_counts_new_ips(store):
+    with open(history.AGG_CSV, "w") as f:
+        f.write("country,country_code,count\nFR,FR,3\nNA,NA,2\n")
+    first = history.take_snapshot(T0)
+    assert first["countries"] == {"FR": 3, "NA": 2} and first["new"] == 0
+    history.append_raw(first)
+    with open(history.AGG_CSV, "w") as f:
+        f.write("country,country_code,count\nFR,FR,6\nNA,NA,2\n")
+    assert history.take_snapshot(T0 + 60)["new"] == 3
+
+
+def test_export_with_empty_aggregates(store):
+    with open(history.AGG_CSV, "w") as f:
+        f.write("country,country_code,count\n")
+    history.append_raw(history.take_snapshot(T0))
+    history.export_dashboard(T0)
+    with open(history.DASHBOARD_JSON) as f:
+        assert json.load(f) == {"t": [T0], "total": [0], "new": [0], "countries": {}}
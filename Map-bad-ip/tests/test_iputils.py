@@ -0,0 +1,41 @@
+import numpy as np
+
+from iputils import ip_to_uint32, ips_to_uint32, uint32_to_ips, sorted_contains
+
+
+def test_round_trip():
+    ips = ["0.0.0.0", "1.2.3.4", "255.255.255.255", "192.168.1.10"]
+    keys, valid = ips_to_uint32(ips)
+    assert valid.all()
+    assert keys.dtype == np.uint32
+    assert keys[1] == (1 << 24) | (2 << 16) | (3 << 8) | 4
+    assert uint32_to_ips(keys) == ips
+
+
+def test_invalid_entries_are_masked():
+    keys, valid = ips_to_uint32(["1.2.3.4", "1.2.3.256", "not an ip", "", None])
+    assert valid.tolist() == [True, False, False, False, False]
+    assert keys[~valid].tolist() == [0, 0, 0, 0]
+
+
+def test_empty_input():
+    keys, valid = ips_to_uint32([])
+    assert len(keys) == len(valid) == 0
+    assert uint32_to_ips(np.empty(0, dtype=np.uint32)) == []
+
+
+def test_sorted_contains():
+    sorted_keys = np.array([3, 10, 42], dtype=np.uint32)
+    keys = np.array([0, 3, 11, 42, 100], dtype=np.uint32)
+    assert sorted_contains(sorted_keys, keys).tolist() == [False, True, False, True, False]
+    assert sorted_contains(sorted_keys[:0], keys).tolist() == [False] * 5
+    assert sorted_contains(sorted_keys, keys[:0]).tolist() == []
+
+
+def test_strict_dotted_decimal():
+    texts = ["010.0.0.1", "01.2.3.4", "1.2.3", "1.2.3.4.5", "0x7f.0.0.1", "1.2.3.4/24",
+             "\uff11.2.3.4", "1.2.3.4 5", " 8.8.8.8 "]
+    keys, valid = ips_to_uint32(texts)
+    assert valid.tolist() == [False] * 8 + [True]
+    assert keys[-1] == 0x08080808
+    assert [ip_to_uint32(t) for t in texts] == [None] * 8 + [0x08080808]
@@ -0,0 +1,133 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import lookup
+from iputils import ips_to_uint32
+
+
+@pytest.fixture
+def snapshot_dirs(tmp_path, monkeypatch):
+    monkeypatch.setattr(lookup, "IPS_CSV", str(tmp_path / "ips.csv"))
+    monkeypatch.setattr(lookup, "LOOKUP_DIR", str(tmp_path / "lookup"))
+    monkeypatch.setattr(lookup, "CURRENT_PATH", str(tmp_path / "lookup" / "CURRENT"))
+    monkeypatch.setattr(lookup, "RELOAD_INTERVAL", 0)
+    return tmp_path
+
+
+def publish(tmp_path, monkeypatch, listed, geo_rows):
+    (tmp_path / "ips.csv").write_text("".join(f"{ip}\n" for ip in listed))
+    geo = pd.DataFrame(geo_rows, columns=["ip", "latitude", "longitude", "source", "city", "region", "country"])
+    geo["ip"] = ips_to_uint32(geo["ip"])[0]
+    monkeypatch.setattr(lookup.geostore, "load", lambda columns=None: geo[columns])
+    return lookup.build_snapshot()
+
+
+@pytest.fixture
+def service(snapshot_dirs, monkeypatch):
+    publish(snapshot_dirs, monkeypatch, ["1.2.3.4", "1.2.3.5", "9.9.9.9"], [
+        ["1.2.3.4", 48.85, 2.35, "ipinfo", "Paris", "IDF", "FR"],
+        ["8.8.8.8", 37.4, -122.1, "ipinfo", None, None, "US"],
+        ["1.2.3.4", 45.76, 4.84, "ipinfo", "Lyon", "ARA", "FR"],
+    ])
+    return lookup.LookupService()
+
+
+@pytest.mark.parametrize("ips", [
+    ["1.2.3.4", "010.0.0.1", "1.2.3", " 8.8.8.8", "256.0.0.1", "abc"],
+    ["1.2.3.4", "010.0.0.1", "1.2.3", " 8.8.8.8", "256.0.0.1", "abc"] * 20,
+])
+def test_to_keys_same_rules_for_small_and_large_batches(ips):
+    keys, valid = lookup.to_keys(ips)
+    ref_keys, ref_valid = ips_to_uint32(ips)
+    assert valid.tolist() == ref_valid.tolist()
+    assert keys[valid].tolist() == ref_keys[ref_valid].tolist()
+    assert valid[:6].tolist() == [True, False, False, True, False, False]
+
+
+def test_to_ips():
+    keys = np.array([0x01020304, 0], dtype=np.uint32)
+    assert lookup.to_ips(keys) == ["1.2.3.4", "0.0.0.0"]
+    assert lookup.to_ips(np.tile(keys, 64))[:2] == ["1.2.3.4", "0.0.0.0"]
+
+
+def test_query(service):
+    index = service.current()
+    paris, google, unknown, bad = index.query(["1.2.3.4", "8.8.8.8", "4.4.4.4", "1.2.3"])
+    assert paris["listed"] and paris["city"] == "Lyon"  # derniere geolocalisation retenue
+    assert google == {"ip": "8.8.8.8", "known": True, "listed": False, "latitude": 37.4,
+                      "longitude": -122.1, "source": "ipinfo", "city": None, "region": None, "country": "US"}
+    assert unknown == {"ip": "4.4.4.4", "known": False, "listed": False}
+    assert "error" in bad
+
+
+def test_query_cidr(service):
+    result = service.current().query_cidr("1.2.3.0/24", limit=1)
+    assert result["known"] == 2 and result["listed"] == 2 and result["truncated"]
+    assert [r["ip"] for r in result["ips"]] == ["1.2.3.4"]
+    assert service.current().query_cidr("200.0.0.0/8")["known"] == 0
+
+
+def test_empty_snapshot(snapshot_dirs, monkeypatch):
+    meta = publish(snapshot_dirs, monkeypatch, [], [])
+    assert meta["ips"] == 0
+    index = lookup.LookupService().current()
+    assert index.query(["1.2.3.4"])[0]["known"] is False
+    assert index.query_cidr("0.0.0.0/0")["known"] == 0
+
+
+def test_missing_current_is_explicit(snapshot_dirs):
+    with pytest.raises(FileNotFoundError, match="lookup.py build"):
+        lookup.LookupService()
+
+
+def test_hot_reload_and_pruning(service, snapshot_dirs, monkeypatch):
+    first = service.version
+    for _ in range(3):
+        publish(snapshot_dirs, monkeypatch, ["5.5.5.5"], [])
+    assert service.current().query(["5.5.5.5"])[0]["listed"]
+    assert service.version != first
+    snapshots = [p for p in (snapshot_dirs / "lookup").iterdir() if p.is_dir()]
+    assert len(snapshots) == lookup.KEEP_SNAPSHOTS
+
+
+@pytest.fixture
+def server(service):
+    httpd = lookup.ThreadingHTTPServer(("127.0.0.1", 0), lookup.make_handler(service))
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def fetch(url, data=None):
+    try:
+        with urllib.request.urlopen(url, data=data, timeout=5) as resp:
+            return resp.status, json.load(resp)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+
+
+def test_http_routes(server):
+    assert fetch(f"{server}/health")[1]["ips"] == 4
+    assert fetch(f"{server}/ip/9.9.9.9")[1]["listed"]
+    status, body = fetch(f"{server}/cidr/1.2.3.0/24?limit=5")
+    assert status == 200 and body["known"] == 2
+    status, body = fetch(f"{server}/bulk", data=b'["1.2.3.5", "nope"]')
+    assert status == 200 and body[0]["listed"] and "error" in body[1]
+    assert fetch(f"{server}/bulk", data=b"1.2.3.5\n9.9.9.9")[1][1]["listed"]
+    assert fetch(f"{server}/nowhere")[0] == 404
+
+
+@pytest.mark.parametrize("path", ["/cidr/1.2.3.0/24?limit=abc", "/cidr/1.2.3.0/24?limit=-1",
+                                  "/cidr/1.2.3.0/99", "/cidr/not/24"])
+def test_http_bad_requests(server, path):
+    status, body = fetch(server + path)
+    assert status == 400 and "error" in body
+    assert fetch(f"{server}/bulk", data=b'{"ip": "1.2.3.4"}')[0] == 400
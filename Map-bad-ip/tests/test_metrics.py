@@ -0,0 +1,86 @@
+import json
+import os
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture
+def run(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_DIR", str(tmp_path / "metrics"))
+    monkeypatch.setattr(metrics, "_run", None)
+    current = metrics.start_run()
+    yield current
+    if metrics._run is not None:
+        metrics.finish_run()
+
+
+def test_noop_outside_a_run(monkeypatch):
+    monkeypatch.setattr(metrics, "_run", None)
+    metrics.record_rows(rows_in=3, rows_out=2)
+    metrics.set_status("geolocate", "sautee")
+    with metrics.api_call("ipinfo") as call:
+        call.ok = False
+    with metrics.stage("aggregate"):
+        pass
+    assert metrics.finish_run() == (None, None)
+
+
+def test_stage_status_and_rows(run):
+    with metrics.stage("aggregate"):
+        metrics.record_rows(rows_in=10, rows_out=4, skipped=2)
+        metrics.record_rows(rows_in=5, skipped=1)
+    with pytest.raises(RuntimeError):
+        with metrics.stage("tiles"):
+            raise RuntimeError("boom")
+    metrics.set_status("history", "bloquee")
+    metrics.record_rows(rows_in=1)
+    assert run.stages["aggregate"]["status"] == "ok"
+    assert (run.stages["aggregate"]["rows_in"], run.stages["aggregate"]["rows_out"]) == (15, 4)
+    assert run.stages["aggregate"]["counters"] == {"skipped": 3}
+    assert run.stages["tiles"]["status"] == "echec"
+    assert run.stages["history"]["status"] == "bloquee"
+    assert run.stages["hors_etape"]["rows_in"] == 1
+
+
+def test_latency_histogram(run):
+    with metrics.stage("geolocate"):
+        for ms in (5, 10, 11, 20000):
+            metrics._record_call("ipinfo", ms, ok=True)
+        with pytest.raises(OSError):
+            with metrics.api_call("ipinfo"):
+                raise OSError("timeout")
+        with metrics.api_call("ipinfo") as call:
+            call.ok = False
+    stats = run.stages["geolocate"]["api"]["ipinfo"]
+    assert stats["calls"] == 6 and stats["errors"] == 2
+    assert stats["max_ms"] == 20000
+    assert len(stats["histogram"]) == len(stats["buckets_ms"]) == len(metrics.LATENCY_BUCKETS_MS) + 1
+    assert stats["histogram"][0] == 4  # 5 ms, 10 ms (borne incluse) et les deux appels instantanes
+    assert stats["histogram"][1] == 1 and stats["histogram"][-1] == 1
+
+
+def test_finish_run_writes_json(run):
+    with metrics.stage("aggregate"):
+        metrics.record_rows(rows_out=7)
+    path, payload = metrics.finish_run()
+    assert metrics._run is None and not run.sampler.is_alive()
+    assert os.path.basename(path) == f"run-{run.run_id}.json"
+    with open(path) as f:
+        assert json.load(f) == payload
+    assert payload["stages"]["aggregate"]["rows_out"] == 7
+    assert payload["stages"]["aggregate"]["peak_rss"] > 0
+
+
+def test_prune_keeps_latest_runs(run, monkeypatch):
+    os.makedirs(metrics.METRICS_DIR)
+    for i in range(5):
+        with open(os.path.join(metrics.METRICS_DIR, f"run-2020010{i}T000000Z.json"), "w") as f:
+            f.write("{}")
+    with open(os.path.join(metrics.METRICS_DIR, "run-x-geolocate.prof"), "w") as f:
+        f.write("")
+    monkeypatch.setattr(metrics, "METRICS_KEEP", 2)
+    path, _ = metrics.finish_run()
+    left = sorted(os.listdir(metrics.METRICS_DIR))
+    assert left == ["run-20200104T000000Z.json", os.path.basename(path), "run-x-geolocate.prof"]
@@ -0,0 +1,98 @@
+import threading
+
+import pytest
+
+import run_all
+from run_all import Stage, run_pipeline
+
+
+@pytest.fixture
+def state(tmp_path, monkeypatch):
+    monkeypatch.setattr(run_all, "STATE_PATH", str(tmp_path / "pipeline_state.json"))
+    return tmp_path
+
+
+class Recorder:
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def stage(self, name, fail=False, write=None):
+        def func():
+            with self.lock:
+                self.calls.append(name)
+            if write:
+                write.write_text(name)
+            if fail:
+                raise RuntimeError(f"{name} en echec")
+        return func
+
+
+def statuses(results):
+    return {name: status for name, (status, _) in results.items()}
+
+
+def test_dependencies_run_in_order(state):
+    rec = Recorder()
+    stages = [
+        Stage("c", rec.stage("c"), deps=["b"], always=True),
+        Stage("b", rec.stage("b"), deps=["a"], always=True),
+        Stage("a", rec.stage("a"), always=True),
+    ]
+    assert statuses(run_pipeline(stages)) == {"a": "ok", "b": "ok", "c": "ok"}
+    assert rec.calls == ["a", "b", "c"]
+
+
+def test_unchanged_inputs_are_skipped(state):
+    source, output = state / "in.csv", state / "out.csv"
+    source.write_text("v1")
+    rec = Recorder()
+    stages = [Stage("agg", rec.stage("agg", write=output), inputs=[str(source)], outputs=[str(output)])]
+    assert statuses(run_pipeline(stages)) == {"agg": "ok"}
+    assert statuses(run_pipeline(stages)) == {"agg": "sautee"}
+    source.write_text("v2")
+    assert statuses(run_pipeline(stages)) == {"agg": "ok"}
+    output.unlink()  # sortie manquante : l'etape est relancee
+    assert statuses(run_pipeline(stages)) == {"agg": "ok"}
+    assert statuses(run_pipeline(stages, force=True)) == {"agg": "ok"}
+    assert rec.calls == ["agg"] * 4
+
+
+def test_failure_blocks_dependents(state):
+    rec = Recorder()
+    stages = [
+        Stage("fetch", rec.stage("fetch", fail=True), always=True),
+        Stage("geo", rec.stage("geo"), deps=["fetch"], always=True),
+        Stage("map", rec.stage("map"), deps=["geo"], always=True),
+    ]
+    assert statuses(run_pipeline(stages)) == {"fetch": "echec", "geo": "bloquee", "map": "bloquee"}
+    assert rec.calls == ["fetch"]
+
+
+def test_tolerated_failure_does_not_block(state):
+    rec = Recorder()
+    stages = [
+        Stage("geo", rec.stage("geo", fail=True), always=True, allow_failure=True),
+        Stage("agg", rec.stage("agg"), deps=["geo"], always=True),
+    ]
+    assert statuses(run_pipeline(stages)) == {"geo": "echec", "agg": "ok"}
+
+
+def test_failed_stage_is_retried_next_run(state):
+    source = state / "in.csv"
+    source.write_text("v1")
+    rec = Recorder()
+    stages = [Stage("agg", rec.stage("agg", fail=True), inputs=[str(source)])]
+    run_pipeline(stages)
+    assert statuses(run_pipeline(stages)) == {"agg": "echec"}  # aucun digest enregistre
+    assert rec.calls == ["agg", "agg"]
+
+
+def test_empty_pipeline(state):
+    assert run_pipeline([]) == {}
+
+
+def test_summary_without_measures(capsys):
+    stages = [Stage("a", lambda: None)]
+    run_all.print_summary({"a": ("ok", 1.5)}, stages)
+    assert "a" in capsys.readouterr().out
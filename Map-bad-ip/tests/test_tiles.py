@@ -0,0 +1,62 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import tiles
+
+
+@pytest.fixture
+def city_csv(tmp_path, monkeypatch):
+    path = tmp_path / "agg_by_city.csv"
+    monkeypatch.setattr(tiles, "CITY_CSV", str(path))
+    monkeypatch.setattr(tiles, "TILES_DIR", str(tmp_path / "tiles"))
+    return path
+
+
+def write_cities(path, rows):
+    pd.DataFrame(rows, columns=["city", "country", "latitude", "longitude", "ip_count"]).to_csv(path, index=False)
+
+
+def test_cluster_level_empty():
+    df = pd.DataFrame({"latitude": [], "longitude": [], "ip_count": [], "label": []})
+    x, y = tiles.mercator(df["latitude"].to_numpy(dtype=float), df["longitude"].to_numpy(dtype=float))
+    level = tiles.cluster_level(df, x, y, 3)
+    assert len(level["lat"]) == len(level["lon"]) == len(level["n"]) == len(level["label"]) == 0
+
+
+@pytest.mark.parametrize("content", ["city,country,latitude,longitude,ip_count\n", ""])
+def test_main_without_cities(city_csv, content):
+    city_csv.write_text(content)
+    tiles.main()
+    for z in range(tiles.MAX_ZOOM + 1):
+        assert tiles.load_level(z) == {"lat": [], "lon": [], "n": [], "label": []}
+    with open(f"{tiles.TILES_DIR}/index.json") as f:
+        assert set(json.load(f)["points"].values()) == {0}
+
+
+def test_load_level_missing(city_csv):
+    assert tiles.load_level(0)["n"] == []
+
+
+def test_clusters_merge_nearby_cities(city_csv):
+    write_cities(city_csv, [
+        ["Paris", "France", 48.85, 2.35, 10],
+        ["Versailles", "France", 48.80, 2.13, 2],
+        ["Tokyo", "Japan", 35.68, 139.69, 5],
+    ])
+    levels = tiles.build_levels(tiles.load_points())
+    world = levels[0]
+    assert sorted(world["n"].tolist()) == [5, 12]
+    assert "Paris (France) +1 villes" in world["label"]
+    paris = world["label"].index("Paris (France) +1 villes")
+    assert np.isclose(world["lat"][paris], (48.85 * 10 + 48.80 * 2) / 12)
+    assert len(levels[tiles.MAX_ZOOM]["n"]) == 3
+
+
+def test_write_if_changed(tmp_path):
+    path = str(tmp_path / "z0.json")
+    assert tiles.write_if_changed(path, "{}")
+    assert not tiles.write_if_changed(path, "{}")
+    assert tiles.write_if_changed(path, "[]")
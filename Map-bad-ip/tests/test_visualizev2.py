@@ -0,0 +1,78 @@
+import json
+import os
+import re
+
+import pytest
+
+import tiles
+import visualizev2
+
+
+@pytest.fixture
+def site(tmp_path, monkeypatch):
+    data, root = tmp_path / "data", tmp_path / "site"
+    data.mkdir()
+    monkeypatch.setattr(visualizev2, "AGG_CSV", str(data / "agg_by_country.csv"))
+    monkeypatch.setattr(visualizev2, "BACKLOG_JSON", str(data / "geo_backlog.json"))
+    monkeypatch.setattr(visualizev2, "OUTPUT_HTML", str(root / "index.html"))
+    monkeypatch.setattr(visualizev2, "ASSETS_DIR", str(root / "dashboard" / "assets"))
+    monkeypatch.setattr(visualizev2, "SITE_DATA_DIR", str(root / "dashboard" / "data"))
+    monkeypatch.setattr(tiles, "CITY_CSV", str(data / "agg_by_city.csv"))
+    monkeypatch.setattr(tiles, "TILES_DIR", str(root / "dashboard" / "tiles"))
+    (data / "agg_by_country.csv").write_text("country,country_code,count\nFR,FR,3\nJP,JP,1\n")
+    (data / "agg_by_city.csv").write_text(
+        "city,country,latitude,longitude,ip_count\nParis,FR,48.85,2.35,3\nTokyo,JP,35.68,139.69,1\n")
+    return root
+
+
+def read_json(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_shell_and_versioned_data(site):
+    visualizev2.main()
+    html = (site / "index.html").read_text(encoding="utf-8")
+    for asset in re.findall(r"dashboard/assets/[\w.]+", html):
+        assert (site / asset).exists()
+    manifest = read_json(site / "dashboard" / "data" / "manifest.json")
+    for name, version in manifest["files"].items():
+        assert visualizev2.file_version(site / "dashboard" / "data" / name) == version
+    assert set(manifest["tiles"]) == {str(z) for z in range(tiles.MAX_ZOOM + 1)}
+    stats = read_json(site / "dashboard" / "data" / "stats.json")
+    assert stats["total_ips"] == 4 and stats["countries"] == 2 and stats["backlog"] is None
+
+
+def test_rerun_without_changes_rewrites_nothing(site):
+    visualizev2.main()
+    before = {p: os.stat(p).st_mtime_ns for p in site.rglob("*") if p.is_file()}
+    visualizev2.main()
+    after = {p: os.stat(p).st_mtime_ns for p in site.rglob("*") if p.is_file()}
+    assert before == after
+
+
+def test_old_asset_versions_are_removed(site):
+    visualizev2.main()
+    stale = site / "dashboard" / "assets" / "app.0123456789ab.js"
+    stale.write_text("ancienne version")
+    visualizev2.main()
+    assert not stale.exists()
+    assert len(list((site / "dashboard" / "assets").glob("app.*.js"))) == 1
+
+
+def test_backlog_without_timestamp(site):
+    with open(visualizev2.BACKLOG_JSON, "w") as f:
+        json.dump({"updated": 123, "pending": 7, "by_priority": {"recentes": 7}}, f)
+    visualizev2.main()
+    stats = read_json(site / "dashboard" / "data" / "stats.json")
+    assert stats["backlog"] == {"pending": 7, "by_priority": {"recentes": 7}}
+
+
+def test_empty_aggregates(site):
+    with open(visualizev2.AGG_CSV, "w") as f:
+        f.write("country,country_code,count\n")
+    with open(tiles.CITY_CSV, "w") as f:
+        f.write("city,country,latitude,longitude,ip_count\n")
+    visualizev2.main()
+    stats = read_json(site / "dashboard" / "data" / "stats.json")
+    assert stats["total_ips"] == 0 and stats["top_countries"] == []
@@ -0,0 +1,96 @@
+// Dashboard ClubCyber : coquille statique, donnees chargees depuis dashboard/data/.
+// manifest.json (jamais mis en cache) donne la version de chaque fichier de donnees ;
+// les fichiers eux-memes sont demandes avec ?v=<version> et peuvent etre caches.
+(function() {
+    var DATA = 'dashboard/data/';
+    var TILES = 'dashboard/tiles/';
+    var manifest = null, current = null, cache = {};
+
+    function getJSON(url) {
+        return fetch(url).then(function(r) { return r.json(); });
+    }
+
+    function versioned(base, name, version) {
+        return base + name + '?v=' + (version || '0');
+    }
+
+    function renderStats(stats) {
+        document.getElementById('total-ips').textContent = stats.total_ips;
+        var list = document.getElementById('top-countries');
+        list.innerHTML = '';
+        stats.top_countries.forEach(function(c) {
+            var li = document.createElement('li');
+            var name = document.createElement('span');
+            var count = document.createElement('span');
+            name.textContent = c.country;
+            count.textContent = c.count;
+            count.className = 'count';
+            li.appendChild(name);
+            li.appendChild(count);
+            list.appendChild(li);
+        });
+        renderBacklog(stats.backlog);
+    }
+
+    function renderBacklog(b) {
+        if (!b) return;
+        document.getElementById('backlog').textContent = b.pending + ' IP en attente';
+        var parts = [b.by_priority.recentes + ' récentes', b.by_priority.reseaux_inconnus + ' réseaux inconnus'];
+        var q = b.quotas && b.quotas.ipinfo;
+        if (q && q.limit > 0) parts.push('quota IPInfo ' + q.used + '/' + q.limit);
+        document.getElementById('backlog-detail').textContent = parts.join(' · ');
+    }
+
+    function renderTrend(h) {
+        var dates = h.t.map(function(t) { return new Date(t * 1000); });
+        Plotly.newPlot('trend', [
+            {x: dates, y: h.total, type: 'scatter', mode: 'lines', line: {color: '#0bc9ee'}, name: 'Total'},
+            {x: dates, y: h['new'], type: 'bar', marker: {color: '#ff003c'}, yaxis: 'y2', name: 'Nouvelles'}
+        ], {
+            margin: {l: 0, r: 0, t: 0, b: 0}, showlegend: false,
+            paper_bgcolor: 'rgba(0,0,0,0)', plot_bgcolor: 'rgba(0,0,0,0)',
+            xaxis: {visible: false}, yaxis: {visible: false},
+            yaxis2: {visible: false, overlaying: 'y', side: 'right'}
+        }, {displayModeBar: false, staticPlot: true, responsive: true});
+    }
+
+    function applyLevel(gd, level, d) {
+        if (level !== current) return;
+        Plotly.restyle(gd, {
+            lat: [d.lat], lon: [d.lon],
+            text: [d.label.map(function(l, i) { return '<b>' + l + '</b><br>IPs détectées: ' + d.n[i]; })],
+            'marker.size': [d.n.map(function(n) { return Math.min(15, 5 + n / 10); })],
+            'marker.color': [d.n]
+        }, [0]);
+    }
+
+    function loadLevel(gd, level) {
+        if (level === current) return;
+        current = level;
+        if (cache[level]) return applyLevel(gd, level, cache[level]);
+        getJSON(versioned(TILES, 'z' + level + '.json', manifest.tiles[level]))
+            .then(function(d) { cache[level] = d; applyLevel(gd, level, d); });
+    }
+
+    function renderMap(fig) {
+        var gd = document.getElementById('map');
+        Plotly.newPlot(gd, fig.data, fig.layout, {displayModeBar: false, responsive: true}).then(function() {
+            current = manifest.initial_level;
+            gd.on('plotly_relayout', function(ev) {
+                var z = ev['mapbox.zoom'];
+                if (z !== undefined) loadLevel(gd, Math.max(0, Math.min(manifest.max_zoom, Math.floor(z))));
+            });
+        });
+    }
+
+    fetch(DATA + 'manifest.json', {cache: 'no-store'})
+        .then(function(r) { return r.json(); })
+        .then(function(m) {
+            manifest = m;
+            getJSON(versioned(DATA, 'stats.json', m.files['stats.json'])).then(renderStats);
+            getJSON(versioned(DATA, 'map.json', m.files['map.json'])).then(renderMap);
+            if (m.files['history.json']) {
+                getJSON(versioned(DATA, 'history.json', m.files['history.json'])).then(renderTrend);
+            }
+        });
+})();